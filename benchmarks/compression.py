@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Compare database compression formats on synthetic databases.
+
+Databases are built as in `serializers.py`. For each database size,
+serializer and compression, the size of the file and the time taken to
+write and load it are reported.
+
+Run from an environment in which `jobnotify` is installed:
+
+    $ python benchmarks/compression.py
+    $ python benchmarks/compression.py --sizes 10000 --serializers compact
+"""
+import argparse
+import os
+from tempfile import TemporaryDirectory
+import time
+
+from jobnotify.compression import COMPRESSIONS, open_file
+from jobnotify.serializers import SERIALIZERS
+
+from serializers import make_db
+
+
+def benchmark(db, serializer, compression, path):
+    """Return the write time, load time and file size for `compression`."""
+    t0 = time.perf_counter()
+    with open_file(path, 'w' + serializer.mode, compression) as f:
+        serializer.dump(db, f)
+    t1 = time.perf_counter()
+    with open_file(path, 'r' + serializer.mode) as f:
+        loaded = serializer.load(f)
+    t2 = time.perf_counter()
+
+    assert len(loaded) == len(db)
+
+    return t1 - t0, t2 - t1, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--sizes',
+        nargs='+',
+        type=int,
+        default=[10000, 100000],
+        help='numbers of postings to benchmark',
+    )
+    parser.add_argument(
+        '--serializers',
+        nargs='+',
+        choices=sorted(SERIALIZERS),
+        default=sorted(SERIALIZERS),
+        help='serializers to benchmark',
+    )
+    args = parser.parse_args()
+
+    print(
+        f'{"postings":>10}  {"serializer":<10}  {"compression":<11}  '
+        f'{"write (s)":>9}  {"load (s)":>9}  {"size (MB)":>10}'
+    )
+
+    with TemporaryDirectory() as tmpdir:
+        for n in args.sizes:
+            db = make_db(n)
+            for name in args.serializers:
+                serializer = SERIALIZERS[name]()
+                path = os.path.join(tmpdir, f'db{serializer.extension}')
+                for compression in [None, *COMPRESSIONS]:
+                    write, load, size = benchmark(db, serializer, compression, path)
+                    print(
+                        f'{n:>10}  {name:<10}  {compression or "none":<11}  '
+                        f'{write:>9.3f}  {load:>9.3f}  {size / 1e6:>10.1f}'
+                    )
+
+
+if __name__ == '__main__':
+    main()
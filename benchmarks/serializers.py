@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Compare the database serializers on synthetic databases.
+
+Postings are shaped like those in `.test_databases/.samplelargedb.json`.
+For each database size and serializer, the time to dump and load the
+database and the size of the resulting file are reported.
+
+Run from an environment in which `jobnotify` is installed:
+
+    $ python benchmarks/serializers.py
+    $ python benchmarks/serializers.py --sizes 10000 100000
+"""
+import argparse
+from email.utils import formatdate
+import os
+import random
+from tempfile import TemporaryDirectory
+import time
+
+from jobnotify.posting import Posting
+from jobnotify.serializers import SERIALIZERS
+
+WORDS = (
+    'data scientist engineer research analyst senior junior lead team process '
+    'development machine learning statistics biotechnology clinical software '
+    'platform business laboratory university programme manager opportunity'
+).split()
+
+
+def sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize()
+
+
+def make_db(n, seed=0):
+    """Return a synthetic database of `n` postings."""
+    rng = random.Random(seed)
+    companies = [f'{sentence(rng, 3)} Ltd' for _ in range(max(1, n // 20))]
+    locations = [sentence(rng, 1) for _ in range(50)]
+    start = 1491177600  # 3 Apr 2017
+
+    db = {}
+    while len(db) < n:
+        jobkey = f'{rng.getrandbits(64):016x}'
+        db[jobkey] = Posting(
+            jobtitle=sentence(rng, 5),
+            company=rng.choice(companies),
+            date_created=formatdate(start + rng.randrange(365 * 86400), usegmt=True),
+            location=rng.choice(locations),
+            url=f'http://ie.indeed.com/viewjob?jk={jobkey}',
+            lat=53 + rng.random(),
+            lon=-6 - rng.random(),
+            desc=sentence(rng, 25) + '...',
+        )
+
+    return db
+
+
+def benchmark(db, serializer, path):
+    """Return the dump time, load time and file size for `serializer`."""
+    t0 = time.perf_counter()
+    with open(path, 'w' + serializer.mode) as f:
+        serializer.dump(db, f)
+    t1 = time.perf_counter()
+    with open(path, 'r' + serializer.mode) as f:
+        loaded = serializer.load(f)
+    t2 = time.perf_counter()
+
+    assert len(loaded) == len(db)
+
+    return t1 - t0, t2 - t1, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--sizes',
+        nargs='+',
+        type=int,
+        default=[10000, 100000, 1000000],
+        help='numbers of postings to benchmark',
+    )
+    args = parser.parse_args()
+
+    print(f'{"postings":>10}  {"serializer":<10}  {"dump (s)":>9}  {"load (s)":>9}  {"size (MB)":>10}')
+
+    with TemporaryDirectory() as tmpdir:
+        for n in args.sizes:
+            db = make_db(n)
+            for name, cls in SERIALIZERS.items():
+                serializer = cls()
+                path = os.path.join(tmpdir, f'db{serializer.extension}')
+                dump, load, size = benchmark(db, serializer, path)
+                print(f'{n:>10}  {name:<10}  {dump:>9.3f}  {load:>9.3f}  {size / 1e6:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -11,5 +11,16 @@ echo "Running tests.."
 coverage run -m unittest tests.test_utils
 coverage run -am unittest tests.test_jobnotify
 coverage run -am unittest tests.test_main
+coverage run -am unittest tests.test_client
+coverage run -am unittest tests.test_stream
+coverage run -am unittest tests.test_posting
+coverage run -am unittest tests.test_storage
+coverage run -am unittest tests.test_index
+coverage run -am unittest tests.test_serializers
+coverage run -am unittest tests.test_compression
+coverage run -am unittest tests.test_lock
+coverage run -am unittest tests.test_smtp
+coverage run -am unittest tests.test_slack
+coverage run -am unittest tests.test_outbox
 coverage html
 coverage report -m
@@ -1,26 +1,77 @@
+from .client import (
+    ConnectionPool,
+    get_connection_pool,
+    get_rate_limiter,
+    HTTPClient,
+    ResponseCache,
+    RetryPolicy,
+    TokenBucket,
+)
+from .compression import COMPRESSIONS, detect_compression, open_file
 from .exceptions import (
     BlankKeyError,
     ConfigurationFileError,
+    DatabaseCfgError,
+    IndeedRequestError,
+    NotificationError,
+    NotificationTimeoutError,
+    RequestBudgetExceededError,
     RequiredKeyMissingError,
     SectionNotFoundError,
     SlackCfgError,
 )
+from .index import JobkeyIndex
 from .jobnotify import (
+    async_deliver,
+    async_email_notify,
+    async_indeed_api_request,
+    async_jobnotify,
+    async_notify,
+    async_slack_notify,
     build_url,
+    ChannelResult,
+    CHANNELS,
     construct_email,
     construct_slack_message,
+    deliver,
     email_notify,
     INDEED_API_LIMIT,
     indeed_api_request,
     INDEED_BASE_URL,
+    iter_slack_messages,
     jobnotify,
     notify,
     send_email,
     slack_notify,
 )
+from .outbox import Outbox
+from .posting import Posting
+from .serializers import (
+    BinarySerializer,
+    CompactJSONSerializer,
+    PrettyJSONSerializer,
+    Serializer,
+    SERIALIZERS,
+)
+from .slack import get_slack_client, SlackAuthCache
+from .smtp import get_smtp_session, SMTPSession
+from .storage import (
+    Database,
+    JSONLStorage,
+    JSONStorage,
+    migrate,
+    open_storage,
+    reshard,
+    SearchMatches,
+    ShardedStorage,
+    SQLiteStorage,
+    Storage,
+    STORAGE_BACKENDS,
+)
 from .utils import (
     EmailMatch,
     get_sanitised_params,
+    get_searches,
     get_section_configs,
     initial_setup,
     load_json_db,
@@ -0,0 +1,612 @@
+import email.utils
+import hashlib
+import http.client
+import io
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import urllib.request
+import zlib
+
+from .exceptions import IndeedRequestError, RequestBudgetExceededError
+
+
+class PooledResponse:
+    """File-like wrapper around a response from a `ConnectionPool`.
+
+    When the response is closed, the underlying connection is handed
+    back to the pool if the body was read to the end and the server
+    did not ask for the connection to be closed.
+    """
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.status = response.status
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def close(self):
+        if self._conn is None:
+            return
+
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool._release(self._key, self._conn)
+        else:
+            self._response.close()
+            self._conn.close()
+
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool:
+    """A pool of persistent HTTP connections, keyed by host.
+
+    Connections are reused across requests to the same scheme, host
+    and port until they have been idle for `idle_timeout` seconds.
+    At most `maxsize` idle connections are kept for each host; any
+    extra connections are closed when released.
+
+    Attributes:
+        stats: counters for connections `created`, `reused` and
+            `discarded` (closed because they were stale or the
+            pool was full).
+    """
+    def __init__(self, maxsize=4, idle_timeout=30.0, timeout=30.0):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0}
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _new_connection(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            conn_cls = http.client.HTTPSConnection
+        else:
+            conn_cls = http.client.HTTPConnection
+
+        with self._lock:
+            self.stats['created'] += 1
+
+        return conn_cls(host, port, timeout=self.timeout)
+
+    def _acquire(self, key):
+        """Return an idle connection for `key`, or None."""
+        now = time.monotonic()
+
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    self.stats['reused'] += 1
+                    return conn
+                conn.close()
+                self.stats['discarded'] += 1
+
+        return None
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.monotonic()))
+                return
+            self.stats['discarded'] += 1
+
+        conn.close()
+
+    def request(self, url, headers=None):
+        """Perform a GET request for `url`.
+
+        Args:
+            url: URL to request.
+            headers: optional dictionary of request headers.
+
+        Returns:
+            PooledResponse object.
+
+        Raises:
+            urllib.error.HTTPError: for a response status >= 400.
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'http'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path = f'{path}?{parts.query}'
+
+        conn = self._acquire(key)
+        reused = conn is not None
+
+        while True:
+            if conn is None:
+                conn = self._new_connection(key)
+
+            try:
+                conn.request('GET', path, headers=headers or {})
+                response = conn.getresponse()
+            except (http.client.HTTPException, ConnectionError) as e:
+                conn.close()
+                if not reused:
+                    raise
+                # the server closed an idle connection; retry on a new one
+                logging.debug('Stale pooled connection to %s: %r', key[1], e)
+                conn, reused = None, False
+                continue
+            break
+
+        if response.status >= 400:
+            body = response.read()
+            conn.close()
+            raise urllib.error.HTTPError(
+                url, response.status, response.reason, response.headers, io.BytesIO(body)
+            )
+
+        return PooledResponse(self, key, conn, response)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+class _DecompressingResponse:
+    """File-like wrapper which decompresses a gzip or deflate body.
+
+    Compressed data is read from the underlying response in chunks
+    and decompressed as it is read, so the whole body is never held
+    in memory at once.
+    """
+    def __init__(self, response, encoding, chunk_size=16384):
+        self._context = response
+        self._response = response
+        self._encoding = encoding
+        self._chunk_size = chunk_size
+        self._decompressor = None
+        self._eof = False
+
+    def _new_decompressor(self, data):
+        if self._encoding == 'gzip':
+            wbits = 16 + zlib.MAX_WBITS
+        elif len(data) >= 2 and data[0] & 0x0f == 8 and (data[0] << 8 | data[1]) % 31 == 0:
+            # deflate should be zlib-wrapped, but some servers send raw deflate
+            wbits = zlib.MAX_WBITS
+        else:
+            wbits = -zlib.MAX_WBITS
+        return zlib.decompressobj(wbits)
+
+    def read(self, amt=None):
+        if amt is None or amt < 0:
+            chunks = []
+            while True:
+                chunk = self.read(self._chunk_size)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+
+        out = b''
+        while not out and not self._eof:
+            if self._decompressor is not None and self._decompressor.unconsumed_tail:
+                data = self._decompressor.unconsumed_tail
+            else:
+                data = self._response.read(self._chunk_size)
+
+            if not data:
+                self._eof = True
+                if self._decompressor is not None:
+                    out = self._decompressor.flush()
+                break
+
+            if self._decompressor is None:
+                self._decompressor = self._new_decompressor(data)
+            out = self._decompressor.decompress(data, amt)
+
+            if self._decompressor.eof:
+                self._eof = True
+
+        return out
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __enter__(self):
+        self._response = self._context.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._context.__exit__(exc_type, exc_value, traceback)
+
+
+class ResponseCache:
+    """On-disk cache of response bodies with a TTL and LRU eviction.
+
+    Entries are keyed by the canonical form of the request URL, with
+    the query parameters in `ignore_params` (by default the Indeed
+    publisher key) removed. Each entry is a single file: its
+    modification time records when it was stored, and its access time
+    when it was last used.
+
+    Args:
+        directory: directory to store cached responses in.
+        ttl: number of seconds a response remains valid.
+        max_entries: maximum number of responses to keep; the least
+            recently used responses are evicted first.
+        ignore_params: query parameters left out of the cache key.
+
+    Attributes:
+        stats: counters for cache `hits`, `misses` and `evictions`.
+    """
+    def __init__(self, directory, ttl=3600, max_entries=256, ignore_params=('publisher',)):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.ignore_params = set(ignore_params)
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, url):
+        """Return the cache key for `url`."""
+        parts = urlsplit(url)
+        params = sorted(
+            (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+            if k not in self.ignore_params
+        )
+        canonical = f'{parts.scheme}://{parts.netloc}{parts.path}?{urlencode(params)}'
+
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _path(self, url):
+        return os.path.join(self.directory, self.key(url))
+
+    def get(self, url):
+        """Return the cached body for `url`, or None."""
+        path = self._path(url)
+        now = time.time()
+
+        try:
+            stored = os.stat(path).st_mtime
+            if now - stored < self.ttl:
+                with open(path, 'rb') as f:
+                    body = f.read()
+                # record the access for LRU eviction, keeping the store time
+                os.utime(path, (now, stored))
+            else:
+                body = None
+        except FileNotFoundError:
+            body = None
+
+        with self._lock:
+            self.stats['hits' if body is not None else 'misses'] += 1
+
+        return body
+
+    def put(self, url, body):
+        """Store `body` as the response for `url`."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, self._path(url))
+
+        self._evict()
+
+    def _evict(self):
+        """Remove expired entries and the least recently used extras."""
+        now = time.time()
+        entries = []
+
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.tmp'):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime >= self.ttl:
+                self._remove(entry.path)
+            else:
+                entries.append((st.st_atime, entry.path))
+
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+
+        with self._lock:
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        """Remove all cached responses."""
+        for entry in os.scandir(self.directory):
+            os.remove(entry.path)
+
+
+class _CachingResponse:
+    """Wrapper which stores the body it has read in a `ResponseCache`.
+
+    The body is only stored if the `with` block using the response
+    exits without an exception, so that callers can reject a response
+    (e.g., an API error) by raising before the block ends.
+    """
+    def __init__(self, response, cache, url):
+        self._context = response
+        self._response = response
+        self._cache = cache
+        self._url = url
+        self._body = bytearray()
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        self._body += data
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __enter__(self):
+        self._response = self._context.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            self._cache.put(self._url, bytes(self._body))
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter.
+
+    Tokens are added at `rate` per second, up to `capacity`, and each
+    request takes one token. A single bucket may be shared by all the
+    searches run in a process, to keep their combined request rate
+    within the API quota.
+
+    Attributes:
+        stats: counters for `acquired` tokens and `throttled`
+            requests, i.e., those which had to wait for a token.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.stats = {'acquired': 0, 'throttled': 0}
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token, returning how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            self.stats['acquired'] += 1
+
+            wait = max(-self._tokens / self.rate, self._blocked_until - now, 0.0)
+            if wait > 0:
+                self.stats['throttled'] += 1
+            return wait
+
+    def acquire(self):
+        """Block until a request may be made."""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def block(self, seconds):
+        """Hold back every request for `seconds`, e.g., after a 429."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter.
+
+    Args:
+        max_retries: number of times to retry a failed request.
+        backoff: base delay in seconds; the delay before retry `n`
+            is drawn uniformly from `[0, backoff * 2**n]`.
+        max_backoff: upper bound on any single delay.
+    """
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, max_retries=3, backoff=1.0, max_backoff=60.0):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def is_retryable(self, error):
+        """Return True if `error` is likely to be transient."""
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code in self.RETRY_STATUSES
+        return isinstance(error, (urllib.error.URLError, http.client.HTTPException, OSError))
+
+    def delay(self, attempt, retry_after=None):
+        """Return the number of seconds to wait before retry `attempt`."""
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+def _retry_after(error):
+    """Return the delay requested by a `Retry-After` header, or None."""
+    if not isinstance(error, urllib.error.HTTPError) or error.headers is None:
+        return None
+
+    value = error.headers.get('Retry-After')
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, when.timestamp() - time.time())
+
+
+class HTTPClient:
+    """Client used to request pages from the Indeed API.
+
+    Without a `pool`, every request is made with
+    `urllib.request.urlopen` on a new connection. Compressed
+    (gzip or deflate) responses are requested, and decompressed
+    transparently as they are read. Transient failures are retried
+    according to `retry`, honouring any `Retry-After` header.
+
+    One client should be used per search, so that `budget` limits
+    the number of requests made for that search.
+
+    Args:
+        pool: optional `ConnectionPool` used to reuse connections.
+        cache: optional `ResponseCache` used to serve repeated
+            requests locally.
+        limiter: optional `TokenBucket` used to rate limit requests.
+        retry: `RetryPolicy`; defaults to three retries.
+        budget: maximum number of requests, including retries, or
+            None for no limit.
+
+    Attributes:
+        stats: counters for `requests` made, and requests `retried`.
+    """
+    def __init__(self, pool=None, cache=None, limiter=None, retry=None, budget=None):
+        self.pool = pool
+        self.cache = cache
+        self.limiter = limiter
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.budget = budget
+        self.stats = {'requests': 0, 'retried': 0}
+        self._lock = threading.Lock()
+
+    def open(self, url):
+        """Open `url` and return a file-like response object.
+
+        The response should be used as a context manager. If a cache
+        is configured, the body is stored when the `with` block exits
+        cleanly, so the body should be validated inside the block.
+
+        Raises:
+            RequestBudgetExceededError: if the request budget is spent.
+            IndeedRequestError: if the request still fails after retrying.
+        """
+        if self.cache is not None:
+            body = self.cache.get(url)
+            if body is not None:
+                logging.debug('Serving %r from cache', url)
+                return io.BytesIO(body)
+
+        attempt = 0
+        while True:
+            with self._lock:
+                if self.budget is not None and self.stats['requests'] >= self.budget:
+                    raise RequestBudgetExceededError(
+                        f'Request budget of {self.budget} request(s) exhausted.'
+                    )
+                self.stats['requests'] += 1
+
+            if self.limiter is not None:
+                self.limiter.acquire()
+
+            try:
+                response = self._open(url)
+            except Exception as e:
+                if not self.retry.is_retryable(e):
+                    raise
+                if attempt >= self.retry.max_retries:
+                    raise IndeedRequestError(f'Request failed: {e}') from e
+
+                retry_after = _retry_after(e)
+                if retry_after is not None and self.limiter is not None:
+                    self.limiter.block(retry_after)
+
+                delay = self.retry.delay(attempt, retry_after)
+                logging.info('Request failed (%s); retrying in %.1fs', e, delay)
+                with self._lock:
+                    self.stats['retried'] += 1
+                time.sleep(delay)
+                attempt += 1
+                continue
+            break
+
+        if self.cache is not None:
+            response = _CachingResponse(response, self.cache, url)
+
+        return response
+
+    def _open(self, url):
+        headers = {'Accept-Encoding': 'gzip, deflate'}
+
+        if self.pool is None:
+            response = urllib.request.urlopen(urllib.request.Request(url, headers=headers))
+        else:
+            response = self.pool.request(url, headers=headers)
+
+        encoding = response.headers.get('Content-Encoding', '').lower()
+        if encoding in ('gzip', 'deflate'):
+            response = _DecompressingResponse(response, encoding)
+
+        return response
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(maxsize, idle_timeout):
+    """Return a process-wide `ConnectionPool` for these settings.
+
+    Searches run within the same process share the returned pool,
+    so connections are reused across searches as well as pages.
+    """
+    key = (maxsize, idle_timeout)
+
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(maxsize=maxsize, idle_timeout=idle_timeout)
+        return _pools[key]
+
+
+_limiters = {}
+
+
+def get_rate_limiter(rate):
+    """Return a process-wide `TokenBucket` allowing `rate` requests per second."""
+    with _pools_lock:
+        if rate not in _limiters:
+            _limiters[rate] = TokenBucket(rate)
+        return _limiters[rate]
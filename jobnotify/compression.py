@@ -0,0 +1,51 @@
+import bz2
+import functools
+import gzip
+import lzma
+
+# file openers and the magic numbers which identify their files
+COMPRESSIONS = {
+    'gzip': (functools.partial(gzip.open, compresslevel=6), b'\x1f\x8b'),
+    'bz2': (bz2.open, b'BZh'),
+    'lzma': (lzma.open, b'\xfd7zXZ\x00'),
+}
+
+
+def detect_compression(path):
+    """Return the compression of the file at `path`, or None if it is uncompressed."""
+    with open(path, 'rb') as f:
+        head = f.read(6)
+
+    for name, (_, magic) in COMPRESSIONS.items():
+        if head.startswith(magic):
+            return name
+
+    return None
+
+
+def open_file(path, mode='rt', compression=None):
+    """Open a file which may be compressed.
+
+    Files opened for reading are decompressed if their magic number
+    shows they are compressed, so uncompressed and compressed files
+    can be read alike. Files opened for writing are compressed with
+    `compression`. Data is compressed and decompressed as it is
+    written and read.
+
+    Args:
+        path: path to the file.
+        mode: 'rt', 'rb', 'wt' or 'wb'.
+        compression: name of the compression used for writing, a key
+            of `COMPRESSIONS`, or None to write an uncompressed file.
+
+    Returns:
+        a file object.
+    """
+    if 'r' in mode:
+        compression = detect_compression(path)
+
+    if compression is None:
+        return open(path, mode)
+
+    opener, _ = COMPRESSIONS[compression]
+    return opener(path, mode)
@@ -22,9 +22,41 @@ class SlackCfgError(ConfigurationFileError):
     """Base exception class for errors relation to the Slack Configuration."""
 
 
+class DatabaseCfgError(ConfigurationFileError):
+    """Raised when the `database` section of the config file is invalid."""
+
+
 class EmailAuthenticationError(ConfigurationFileError):
     """Raised when either `email_from` or `password` are incorrect in config file."""
 
 
 class IndeedAuthenticationError(ConfigurationFileError):
     """Raised when there is an issue with the Indeed publisher key."""
+
+
+class IndeedRequestError(Exception):
+    """Raised when a request to the Indeed API fails."""
+
+
+class RequestBudgetExceededError(IndeedRequestError):
+    """Raised when a search has used up its budget of API requests."""
+
+
+class NotificationError(Exception):
+    """Raised when a notification could not be sent through every channel.
+
+    Attributes:
+        results: `ChannelResult` of every channel, including those which
+            succeeded.
+    """
+    def __init__(self, msg, results=()):
+        super().__init__(msg)
+        self.results = list(results)
+
+
+class NotificationTimeoutError(NotificationError):
+    """Raised when sending a notification takes longer than its timeout."""
+
+
+class DatabaseLockedError(Exception):
+    """Raised when a database is locked by another process for too long."""
@@ -0,0 +1,242 @@
+from array import array
+from bisect import bisect_left
+import mmap
+import os
+import re
+import struct
+import sys
+
+_MAGIC = b'JNIDX\x00\x00\x01'
+# magic, database mtime (ns), database size, number of packed keys, number of other keys
+_HEADER = struct.Struct('<8sqqQQ')
+_KEY = struct.Struct('<Q')
+_JOBKEY = re.compile(r'[0-9a-f]{16}')
+
+
+def index_path(path_to_db):
+    """Return the path of the jobkey index kept beside `path_to_db`."""
+    return f'{os.path.splitext(path_to_db)[0]}.idx'
+
+
+def pack_jobkey(jobkey):
+    """Return `jobkey` as a 64-bit integer, or None if it cannot be packed.
+
+    Indeed jobkeys are 16 hexadecimal characters, which fit exactly in
+    64 bits.
+    """
+    if not _JOBKEY.fullmatch(jobkey):
+        return None
+    return int(jobkey, 16)
+
+
+def _split(keys):
+    """Return the set of packed `keys`, and the set of keys which cannot be packed."""
+    packed = set()
+    other = set()
+    for k in keys:
+        n = pack_jobkey(k)
+        if n is None:
+            other.add(k)
+        else:
+            packed.add(n)
+    return packed, other
+
+
+def _signature(path_to_db):
+    """Return the modification time and size of the database."""
+    try:
+        st = os.stat(path_to_db)
+    except FileNotFoundError:
+        return 0, 0
+    return st.st_mtime_ns, st.st_size
+
+
+class _PackedKeys:
+    """Read-only sequence view of the packed keys in a memory map."""
+    def __init__(self, buf, count):
+        self.buf = buf
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return _KEY.unpack_from(self.buf, _HEADER.size + i * _KEY.size)[0]
+
+
+class JobkeyIndex:
+    """Index of the jobkeys stored in a database.
+
+    The index is a sorted array of jobkeys packed as 64-bit integers,
+    which is memory-mapped and searched by bisection, so checking
+    whether a jobkey has been seen needs neither the database records
+    nor much memory. The few jobkeys which cannot be packed are kept
+    in a set. The index records the modification time and size of the
+    database it was built from, so a stale index can be detected.
+
+    Use `JobkeyIndex.open` rather than creating instances directly.
+
+    Args:
+        path: path to the index file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.signature = (0, 0)
+        self._file = None
+        self._mmap = None
+        self._keys = _PackedKeys(b'', 0)
+        self._other = set()
+
+    @classmethod
+    def open(cls, path_to_db, keys):
+        """Open the index of the database at `path_to_db`.
+
+        Args:
+            path_to_db: path to the database.
+            keys: callable returning the jobkeys in the database,
+                which is only called if the index must be rebuilt.
+
+        Returns:
+            a `JobkeyIndex`.
+        """
+        index = cls(index_path(path_to_db))
+
+        if not index._read() or index.signature != _signature(path_to_db):
+            # the database may be created by reading its keys, so take
+            # its signature afterwards
+            packed, other = _split(keys())
+            index._write(packed, other, _signature(path_to_db))
+
+        return index
+
+    def _read(self):
+        """Map the index file into memory.
+
+        Returns:
+            False if the index does not exist or cannot be read.
+        """
+        self._close_map()
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            f.close()
+            return False
+
+        magic, mtime, size, count, n_other = _HEADER.unpack(header)
+        data_size = _HEADER.size + count * _KEY.size
+        if magic != _MAGIC or os.fstat(f.fileno()).st_size < data_size:
+            f.close()
+            return False
+
+        f.seek(data_size)
+        other = f.read().decode('utf-8').split('\n') if n_other else []
+
+        if count:
+            self._file = f
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._keys = _PackedKeys(self._mmap, count)
+        else:
+            f.close()
+            self._keys = _PackedKeys(b'', 0)
+
+        self._other = set(other)
+        self.signature = (mtime, size)
+        return True
+
+    def _write(self, packed, other, signature):
+        """Write an index of the `packed` and `other` keys and map it into memory."""
+        self._write_sorted(array('Q', sorted(packed)), other, signature)
+
+    def _write_sorted(self, packed, other, signature):
+        """Write an index of the sorted array `packed` and the `other` keys."""
+        other = sorted(other)
+        if sys.byteorder != 'little':
+            packed.byteswap()
+
+        self._close_map()
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, *signature, len(packed), len(other)))
+            f.write(packed.tobytes())
+            f.write('\n'.join(other).encode('utf-8'))
+        os.replace(tmp_path, self.path)
+
+        self._read()
+
+    def is_stale(self, path_to_db):
+        """Return True if the database has changed since the index was written."""
+        return self.signature != _signature(path_to_db)
+
+    def _packed(self):
+        """Return a copy of the packed keys as an array."""
+        packed = array('Q')
+        if self._keys.count:
+            start = _HEADER.size
+            packed.frombytes(self._mmap[start:start + self._keys.count * _KEY.size])
+            if sys.byteorder != 'little':
+                packed.byteswap()
+        return packed
+
+    def add(self, keys, path_to_db):
+        """Add `keys` to the index after they are added to the database.
+
+        The new keys are merged into a copy of the packed keys, which
+        is only ever handled in bulk, so adding a few keys to a large
+        index costs little more than writing the file.
+        """
+        packed, other = _split(keys)
+        existing = self._packed()
+
+        merged = array('Q')
+        start = 0
+        for n in sorted(packed):
+            i = bisect_left(existing, n, start)
+            if i < len(existing) and existing[i] == n:
+                continue
+            merged.extend(existing[start:i])
+            merged.append(n)
+            start = i
+        merged.extend(existing[start:])
+
+        other.update(self._other)
+        self._write_sorted(merged, other, _signature(path_to_db))
+
+    def keys(self):
+        """Return the set of indexed jobkeys."""
+        keys = {f'{n:016x}' for n in self._keys}
+        keys.update(self._other)
+        return keys
+
+    def __contains__(self, jobkey):
+        n = pack_jobkey(jobkey)
+        if n is None:
+            return jobkey in self._other
+
+        i = bisect_left(self._keys, n)
+        return i < len(self._keys) and self._keys[i] == n
+
+    def __len__(self):
+        return len(self._keys) + len(self._other)
+
+    def _close_map(self):
+        self._keys = _PackedKeys(b'', 0)
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """Unmap the index."""
+        self._close_map()
+        self._other = set()
+
+    def __repr__(self):
+        return f'JobkeyIndex({self.path!r}, {len(self)} keys)'
@@ -1,36 +1,124 @@
 #!/usr/bin/env python3
+import asyncio
+import contextlib
 from configparser import DuplicateOptionError
 import email
+import functools
+import http.client
 import json
 import logging
 import os
-import re
 import smtplib
 import sys
+import threading
+import time
 from urllib.parse import urlencode
-import urllib.request
-
-from slackclient import SlackClient
 
+from .client import (
+    get_connection_pool,
+    get_rate_limiter,
+    HTTPClient,
+    ResponseCache,
+    RetryPolicy,
+)
 from .exceptions import (
     ConfigurationFileError,
+    DatabaseLockedError,
     EmailAuthenticationError,
     IndeedAuthenticationError,
+    IndeedRequestError,
+    NotificationError,
+    NotificationTimeoutError,
     SlackCfgError,
 )
+from .outbox import Outbox, outbox_path
+from .posting import Posting
+from .storage import (
+    Database,
+    migrate_legacy,
+    reshard,
+    search_matches_path,
+    SearchMatches,
+    ShardedStorage,
+    storage_for,
+)
+from .slack import AUTH_ERRORS, get_slack_client, SlackAuthCache
+from .smtp import get_smtp_session, SMTP_TIMEOUT, SMTPSession
+from .stream import iter_json_object
 from .utils import (
+    get_fromage,
     get_sanitised_params,
+    get_searches,
     get_section_configs,
     initial_setup,
-    load_json_db,
+    load_optional_cfg,
+    load_run_metadata,
     process_args,
-    write_json_db,
+    write_run_metadata,
 )
 
 INDEED_BASE_URL = 'http://api.indeed.com/ads/apisearch'
 INDEED_API_LIMIT = 25
 DB_DIR = os.path.join(os.path.expanduser('~'), '.jobnotify', 'databases')
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.jobnotify', 'cache')
+SHARED_DB_NAME = 'shared'
+NOTIFY_TIMEOUT = 60.0
+SLACK_MAX_BYTES = 4000
+SLACK_MAX_LISTINGS = 10
 PATH_TO_CFG = os.path.join(os.path.expanduser('~'), '.jobnotify', 'jobnotify.config')
+SLACK_AUTH_CACHE = os.path.join(os.path.expanduser('~'), '.jobnotify', 'slack_auth.json')
+
+
+def _run(coro):
+    """Run `coro` to completion on a new event loop and return its result."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def _iter_async(agen):
+    """Iterate over the asynchronous generator `agen` on a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.close()
+
+
+async def _in_executor(func, *args):
+    """Run the blocking callable `func` in the default executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
+
+async def _locked(lock, func, *args):
+    """Run `func` in the default executor while holding the `FileLock` `lock`.
+
+    The lock is waited for on the event loop, so that runs waiting for
+    a database never take the executor threads which the run holding
+    it needs in order to finish.
+    """
+    await lock.acquire_async()
+    try:
+        return await _in_executor(func, *args)
+    finally:
+        # a storage closed by `func` has already released its lock
+        if lock.locked:
+            lock.release()
+
+
+async def _open_storage(database_dir, name, backend, cfg):
+    """Asynchronous version of `open_storage`."""
+    storage = storage_for(database_dir, name, backend, cfg)
+    await _locked(storage.lock, migrate_legacy, storage, database_dir, name)
+    return storage
 
 
 def build_url(base_url, params):
@@ -47,44 +135,75 @@ def build_url(base_url, params):
     return f'{base_url}?{encoded_params}'
 
 
-def construct_slack_message(posts):
+def iter_slack_messages(posts, max_bytes=SLACK_MAX_BYTES, max_listings=SLACK_MAX_LISTINGS):
+    """Generate the Slack messages for `posts`.
+
+    Listings are rendered one at a time and packed greedily into
+    messages of at most `max_bytes` bytes of UTF-8 and `max_listings`
+    listings, so the full text of every listing is never held at
+    once. A single listing longer than `max_bytes` is sent alone.
+
+    Args:
+        posts: dictionary containing new job listings.
+        max_bytes: maximum size of a message.
+        max_listings: maximum number of listings in a message.
+
+    Yields:
+        the text of each message.
+    """
+    nposts = len(posts)
+    msg_template = '{}. <{url}|{jobtitle} @ {company}>\nSnippet: {desc}\n'
+
+    chunk = []
+    size = 0
+    for i, p in enumerate(posts.values(), 1):
+        # listings are separated by a blank line, which ends the message
+        # if the next listing is sent separately
+        listing = msg_template.format(i, **p)
+        if i < nposts:
+            listing += '\n'
+        n = len(listing.encode('utf-8'))
+
+        if chunk and (size + n > max_bytes or len(chunk) == max_listings):
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+
+        chunk.append(listing)
+        size += n
+
+    if chunk:
+        yield ''.join(chunk)
+
+
+def construct_slack_message(posts, max_bytes=SLACK_MAX_BYTES, max_listings=SLACK_MAX_LISTINGS):
     """Construct a Slack message for sending.
 
     The Slack RTM API (https://api.slack.com/rtm#limits)
     recommends that a single message be no longer than 4 kB.
-    To handle this, we construct our message, and then
-    subsequently split into messages of 10 listings or less.
+    To handle this, the listings are split into messages of
+    at most `max_bytes` bytes and `max_listings` listings.
 
-    An iterable is returned: either a single element list
-    containing a message with <= 10 listings, or a
-    generator with > 10 listings.
+    An iterable is returned: either a list of messages if
+    there are no more than `max_listings` listings, or a
+    generator from `iter_slack_messages` otherwise.
 
     Args:
         posts: dictionary containing new job listings.
+        max_bytes: maximum size of a message.
+        max_listings: maximum number of listings in a message.
 
     Returns:
         msg_it: an iterable containing the message(s) to
-            be posted. Note this may be a single element
-            list or a generator.
+            be posted. Note this may be a list or a generator.
     """
-    nposts = len(posts)
+    msg_it = iter_slack_messages(posts, max_bytes, max_listings)
 
-    # build the full message
-    msg_template = '{}. <{url}|{jobtitle} @ {company}>\nSnippet: {desc}\n'
-    msg = '\n'.join(msg_template.format(i+1, **p) for i, p in enumerate(posts.values()))
-
-    if nposts > 10:
-        logging.debug('Splitting message into %d chunks..', (nposts//10)+1)
-        # split the message after 10 listings, i.e., on a `11.`, `21.`, etc.
-        t = [''] + re.split(r'(\d?\d1\.)', msg)
-        # create an iterator from the above list
-        it = iter(t)
-        # create a generator which pairs successive elements of the original list
-        msg_it = (m+next(it, '') for m in it)
-    else:
-        msg_it = [msg]
+    if len(posts) > max_listings:
+        logging.debug('Splitting %d listings into several messages..', len(posts))
+        return msg_it
 
-    return msg_it
+    return list(msg_it)
 
 
 def construct_email(cfg, query, location, posts):
@@ -146,11 +265,187 @@ def construct_email(cfg, query, location, posts):
     return s
 
 
-def indeed_api_request(params):
+def _iter_page(params, client=None, page=None):
+    """Request a single page of results from the Indeed API.
+
+    The response is decoded incrementally, and each posting is
+    yielded as soon as it has been read from the socket.
+
+    Args:
+        params: dictionary with search parameters.
+        client: `HTTPClient` used to make the request.
+        page: optional dictionary which is filled with the other
+            top-level fields of the response, e.g., `totalResults`
+            and `end`.
+
+    Returns:
+        posts: a generator containing dictionaries.
+
+    Raises:
+        IndeedAuthenticationError: if the publisher key is rejected.
+        IndeedRequestError: if the request fails after retrying, or
+            the connection fails while the response is read.
+        json.decoder.JSONDecodeError: for a malformed response.
+    """
+    if client is None:
+        client = HTTPClient()
+    if page is None:
+        page = {}
+
+    url = build_url(INDEED_BASE_URL, params)
+
+    with client.open(url) as u:
+        try:
+            for key, value in iter_json_object(u, 'results'):
+                if key == 'results':
+                    yield _parse_result(value)
+                elif key == 'error':
+                    # raise inside the `with` block, so that errors are never cached
+                    raise IndeedAuthenticationError('Invalid Indeed publisher key provided.')
+                else:
+                    page[key] = value
+        except (http.client.HTTPException, OSError) as e:
+            raise IndeedRequestError(f'Reading response failed: {e}') from e
+
+
+async def _stream_page(params, client=None, page=None):
+    """Asynchronous version of `_iter_page`.
+
+    The response is read and decoded in the default executor, and each
+    posting is handed to the event loop as soon as it has been decoded.
+    `page` is only complete once every posting has been yielded.
+
+    Returns:
+        posts: an asynchronous generator containing dictionaries.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    end = object()
+
+    def produce():
+        posts = _iter_page(params, client, page)
+        try:
+            for post in posts:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, post)
+        finally:
+            posts.close()
+            loop.call_soon_threadsafe(queue.put_nowait, end)
+
+    future = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            post = await queue.get()
+            if post is end:
+                break
+            yield post
+        # raise any error which stopped the response being read
+        await future
+    finally:
+        # let the request finish before the connection is released
+        stop.set()
+        if not future.done():
+            await asyncio.wait([future])
+        if not future.cancelled():
+            future.exception()
+
+
+async def _request_page(params, client=None):
+    """Request a single page of results from the Indeed API.
+
+    Returns:
+        (page, posts): the top-level fields of the response, and
+            a list of the postings on the page.
+    """
+    page = {}
+    posts = [post async for post in _stream_page(params, client, page)]
+
+    return page, posts
+
+
+def _parse_result(result):
+    """Return a posting from a single entry of an API response."""
+    return {
+        result['jobkey']:
+            Posting(
+                jobtitle=result['jobtitle'],
+                company=result['company'],
+                date_created=result['date'],
+                location=result['formattedLocation'],
+                url=result['url'].split('&')[0],
+                lat=result['latitude'],
+                lon=result['longitude'],
+                desc=result['snippet'],
+            )
+        }
+
+
+class _SeenTracker:
+    """Track runs of results whose jobkeys have been seen before.
+
+    In incremental mode results are sorted by date, so once a whole
+    page (or `stop_after` consecutive results) consists of postings
+    which are already in the database, the remaining pages can only
+    contain older postings and need not be requested.
+
+    Args:
+        seen: container of known jobkeys, or None to disable tracking.
+        stop_after: number of consecutive known results after which
+            to stop. If None, stop only after a fully known page.
+    """
+    def __init__(self, seen=None, stop_after=None):
+        self.seen = seen
+        self.stop_after = stop_after
+        self.run = 0
+        self.page_seen = True
+        self.exhausted = False
+
+    def track(self, post):
+        """Record `post`, the next result on the current page."""
+        if self.seen is None:
+            return
+
+        if any(k in self.seen for k in post):
+            self.run += 1
+        else:
+            self.run = 0
+            self.page_seen = False
+
+    def end_page(self):
+        """Update `exhausted` once every result on the page has been tracked."""
+        if self.seen is None:
+            return
+
+        self.exhausted = self.page_seen or (
+            self.stop_after is not None and self.run >= self.stop_after
+        )
+        self.page_seen = True
+
+
+def indeed_api_request(params, workers=1, client=None, seen=None, stop_after=None):
     """Performs an API request and returns results.
 
+    The first page is always requested on its own. When `workers`
+    is greater than one, the `totalResults` field of the first
+    response is used to work out the offsets of the remaining
+    pages, which are then requested concurrently. Results are
+    yielded in page order regardless of `workers`.
+
+    If `seen` is given, pages are requested one after another and
+    paging stops early once a page, or a run of `stop_after`
+    consecutive results, consists only of jobkeys in `seen`. This
+    is only useful when results are sorted by date.
+
     Args:
         params: dictionary with search parameters.
+        workers: maximum number of pages to request at once.
+        client: `HTTPClient` used to make requests. Pass a
+            client with a `ConnectionPool` to reuse connections.
+        seen: optional container of jobkeys already known.
+        stop_after: number of consecutive known results after
+            which to stop paging.
 
     Returns:
         posts: a generator containing dictionaries.
@@ -159,39 +454,73 @@ def indeed_api_request(params):
         json.decoder.JSONDecodeError: may be raised if we
             get a malformed response from the API.
     """
-    complete_result = False
-
-    while not complete_result:
-        url = build_url(INDEED_BASE_URL, params)
+    yield from _iter_async(async_indeed_api_request(params, workers, client, seen, stop_after))
 
-        with urllib.request.urlopen(url) as u:
-            r = u.read().decode('utf-8')
 
-        response = json.loads(r)
+async def async_indeed_api_request(params, workers=1, client=None, seen=None, stop_after=None):
+    """Asynchronous version of `indeed_api_request`.
 
-        if 'error' in response:
-            raise IndeedAuthenticationError('Invalid Indeed publisher key provided.')
+    Each page is requested in the default executor so that the
+    event loop is never blocked on the network. Postings are yielded
+    as soon as they are decoded, except those on pages requested
+    concurrently, which are held until the pages before them have
+    been yielded.
 
-        for result in response['results']:
-            yield {
-                result['jobkey']:
-                    {
-                        'jobtitle': result['jobtitle'],
-                        'company': result['company'],
-                        'date_created': result['date'],
-                        'location': result['formattedLocation'],
-                        'url': result['url'].split('&')[0],
-                        'lat': result['latitude'],
-                        'lon': result['longitude'],
-                        'desc': result['snippet'],
-                    }
-                }
+    Args:
+        params: dictionary with search parameters.
+        workers: maximum number of pages to request at once.
+        client: `HTTPClient` used to make requests.
+        seen: optional container of jobkeys already known.
+        stop_after: number of consecutive known results after
+            which to stop paging.
 
-        if response['end'] >= response['totalResults']:
-            complete_result = True
+    Returns:
+        posts: an asynchronous generator containing dictionaries.
+    """
+    tracker = _SeenTracker(seen, stop_after)
 
-        # update results start in order to get to the next page
-        params['start'] += INDEED_API_LIMIT
+    page = {}
+    posts = _stream_page(params, client, page)
+    try:
+        async for post in posts:
+            tracker.track(post)
+            yield post
+    finally:
+        await posts.aclose()
+    tracker.end_page()
+
+    if workers > 1 and seen is None:
+        semaphore = asyncio.Semaphore(workers)
+
+        async def request(start):
+            async with semaphore:
+                return await _request_page({**params, 'start': start}, client)
+
+        starts = range(
+            params['start'] + INDEED_API_LIMIT, page['totalResults'], INDEED_API_LIMIT
+        )
+        tasks = [asyncio.ensure_future(request(start)) for start in starts]
+
+        try:
+            for task in tasks:
+                _, posts = await task
+                for post in posts:
+                    yield post
+        finally:
+            for task in tasks:
+                task.cancel()
+    else:
+        while not tracker.exhausted and page['end'] < page['totalResults']:
+            params['start'] += INDEED_API_LIMIT
+            page = {}
+            posts = _stream_page(params, client, page)
+            try:
+                async for post in posts:
+                    tracker.track(post)
+                    yield post
+            finally:
+                await posts.aclose()
+            tracker.end_page()
 
 
 def email_notify(cfg, posts, query, location):
@@ -203,6 +532,18 @@ def email_notify(cfg, posts, query, location):
         query: query from `indeed` section of config file
         location: location from `indeed` section of config file
     """
+    _run(async_email_notify(cfg, posts, query, location))
+
+
+async def async_email_notify(cfg, posts, query, location, session=None):
+    """Asynchronous version of `email_notify`.
+
+    The SMTP conversation is carried out in the default executor.
+
+    Args:
+        session: optional `SMTPSession` whose connection is used to send
+            the email. By default a new connection is opened and closed.
+    """
     user = cfg['email_from']
     password = cfg['password']
 
@@ -211,7 +552,10 @@ def email_notify(cfg, posts, query, location):
     msg.set_charset('utf-8')
 
     try:
-        send_email(user, password, msg)
+        if session is not None:
+            await _in_executor(session.send, msg)
+        else:
+            await _in_executor(send_email, user, password, msg)
     except smtplib.SMTPAuthenticationError as e:
         raise EmailAuthenticationError(
             'Email authentication error. Please check entries for `email_from` '
@@ -231,11 +575,8 @@ def send_email(user, password, msg):
         smtplib.SMTPAuthenticationError:
             535, b'5.7.8 Username and Password not accepted.
     """
-    with smtplib.SMTP('smtp.gmail.com', 587) as smtp:
-        smtp.ehlo()  # success 250
-        smtp.starttls()  # success 220
-        smtp.login(user, password)  # success 235 smtplib.SMTPAuthenticationError
-        smtp.send_message(msg)  # empty dict is a success
+    with SMTPSession(user, password) as session:
+        session.send(msg)
 
 
 def slack_notify(cfg, posts):
@@ -243,18 +584,35 @@ def slack_notify(cfg, posts):
 
     Args:
         cfg: configuration for Slack account.
-        msg_it: message(s) to be sent. May be a list
-            or a generator.
+        posts: dictionary containing new job listings.
 
     Raises:
         SlackCfgError: raised if we get a bad response.
     """
-    msg_it = construct_slack_message(posts)
+    _run(async_slack_notify(cfg, posts))
+
+
+async def async_slack_notify(cfg, posts):
+    """Asynchronous version of `slack_notify`.
+
+    `SlackClient` is blocking, so the messages are posted from
+    the default executor.
+    """
+    await _in_executor(_post_slack_messages, cfg, posts)
+
+
+def _post_slack_messages(cfg, posts):
+    """Validate the Slack token and post the message(s) for `posts`."""
+    msg_it = construct_slack_message(
+        posts,
+        max_bytes=int(cfg.get('max_message_bytes', SLACK_MAX_BYTES)),
+        max_listings=int(cfg.get('max_message_listings', SLACK_MAX_LISTINGS)),
+    )
 
     token = cfg['token']
     channel = cfg['channel']
 
-    sc = SlackClient(token)
+    sc = get_slack_client(token)
 
     # https://api.slack.com/methods/chat.postMessage
     # slack_errors = {
@@ -266,40 +624,132 @@ def slack_notify(cfg, posts):
     #     'channel_not_found': 'Value passed for channel was invalid.',
     # }
 
+    # skip the `api.test` round-trip if the token was validated recently
+    auth_cache_ttl = float(cfg.get('auth_cache_ttl', 0))
+    cache = SlackAuthCache(SLACK_AUTH_CACHE, auth_cache_ttl) if auth_cache_ttl > 0 else None
+    cached = cache is not None and cache.is_valid(token)
+    if not cached:
+        _validate_slack_token(sc, token, cache)
+
+    for m in msg_it:
+        r = _post_slack_message(sc, channel, m)
+        if not r['ok'] and r['error'] in AUTH_ERRORS and cached:
+            # the cached validation is out of date, so check the token again
+            logging.info('Slack auth error %r; revalidating token', r['error'])
+            cache.remove(token)
+            _validate_slack_token(sc, token, cache)
+            cached = False
+            r = _post_slack_message(sc, channel, m)
+
+        if not r['ok']:
+            reason = r['error']
+            raise SlackCfgError(f'ERROR: {reason}')
+
+
+def _validate_slack_token(sc, token, cache=None):
+    """Check the token of `sc` with `api.test`, recording success in `cache`.
+
+    Raises:
+        SlackCfgError: if the token is not valid.
+    """
     r = sc.api_call('api.test')
     if not r['ok']:
         reason = r['error']
         raise SlackCfgError(f'ERROR: {reason}')
 
-    for m in msg_it:
-        sc.api_call(
-            'chat.postMessage',
-            text=m,
-            channel=channel,
-            icon_emoji=':robot_face:',
-        )
+    if cache is not None:
+        cache.add(token)
+
+
+def _post_slack_message(sc, channel, text):
+    return sc.api_call(
+        'chat.postMessage',
+        text=text,
+        channel=channel,
+        icon_emoji=':robot_face:',
+    )
+
+
+def _build_client(indeed_cfg, use_cache=True):
+    """Return an `HTTPClient` configured from the `indeed` section.
+
+    Args:
+        indeed_cfg: `indeed` section of the configuration file.
+        use_cache: if False, never use the response cache.
+
+    Returns:
+        HTTPClient object.
+    """
+    # reuse connections across pages and searches if a pool is configured
+    pool_size = indeed_cfg.getint('pool_size', fallback=0)
+    if pool_size > 0:
+        idle_timeout = indeed_cfg.getfloat('idle_timeout', fallback=30.0)
+        pool = get_connection_pool(pool_size, idle_timeout)
+    else:
+        pool = None
+
+    # serve repeated identical requests from disk if a cache is configured
+    cache_ttl = indeed_cfg.getfloat('cache_ttl', fallback=0)
+    if use_cache and cache_ttl > 0:
+        cache_size = indeed_cfg.getint('cache_size', fallback=256)
+        cache = ResponseCache(CACHE_DIR, ttl=cache_ttl, max_entries=cache_size)
+    else:
+        cache = None
+
+    # the rate limiter is shared by every search run in this process
+    rate_limit = indeed_cfg.getfloat('rate_limit', fallback=0)
+    limiter = get_rate_limiter(rate_limit) if rate_limit > 0 else None
+
+    retry = RetryPolicy(
+        max_retries=indeed_cfg.getint('max_retries', fallback=3),
+        backoff=indeed_cfg.getfloat('backoff', fallback=1.0),
+    )
+
+    budget = indeed_cfg.getint('request_budget', fallback=0) or None
 
+    return HTTPClient(pool, cache, limiter, retry, budget)
 
-def jobnotify(cfg_filename=PATH_TO_CFG, database_dir=DB_DIR):
+
+def _log_client_stats(name, client):
+    """Log the statistics of the `HTTPClient` used by search `name`."""
+    logging.info('Search %r: HTTP client stats: %r', name, client.stats)
+    if client.pool is not None:
+        logging.info('Connection pool stats: %r', client.pool.stats)
+    if client.cache is not None:
+        logging.info('Response cache stats: %r', client.cache.stats)
+    if client.limiter is not None:
+        logging.info('Rate limiter stats: %r', client.limiter.stats)
+
+
+def jobnotify(cfg_filename=PATH_TO_CFG, database_dir=DB_DIR, use_cache=True):
     """Main entry point for the script"""
-    # TODO: if config does not exist perhaps populate with defaults
-    if not os.path.isfile(cfg_filename):
-        raise FileNotFoundError(f'Configuration file {repr(cfg_filename)} does not exist.')
+    _run(async_jobnotify(cfg_filename, database_dir, use_cache))
 
-    # load all configuration files
-    cfgs = get_section_configs(cfg_filename)
 
-    # the `indeed` section is the first section in the list
-    indeed_cfg = cfgs[0]
+async def _search(indeed_cfg, query, location, client, db, meta, now):
+    """Run a single search and return the postings found.
 
+    Args:
+        indeed_cfg: `indeed` section of the configuration file.
+        query: search term.
+        location: location to search for jobs.
+        client: `HTTPClient` used to make requests.
+        db: `Database` or other container of the jobkeys which have been seen.
+        meta: run metadata for this search.
+        now: time of this run (seconds since the epoch).
+
+    Returns:
+        tuple of a dictionary of all postings found, whether every
+        page was fetched, and whether this was a full crawl.
+    """
     params = {
         'publisher': indeed_cfg['key'],  # publisher ID
-        'q': indeed_cfg['query'],  # query
-        'l': indeed_cfg['location'],  # location (city, state, region)
+        'q': query,  # query
+        'l': location,  # location (city, state, region)
         'radius': indeed_cfg['radius'],  # distance from search location 'as the crow flies'
         'jt': 'fulltime',  # job-type: 'fulltime', 'parttime, 'contract', 'temporary', 'internship'
         'limit': 25,  # max number of results per query - max 25
-        'fromage': 10,  # number of days back to search
+        'fromage': indeed_cfg.getint('fromage', fallback=10),  # number of days back to search
         'start': 0,  # start results at this search number
         'highlight': 0,  # bold search term in snippet
         'latlong': 1,  # return latitude and longitude
@@ -308,52 +758,463 @@ def jobnotify(cfg_filename=PATH_TO_CFG, database_dir=DB_DIR):
         'format': 'json',  # response format
     }
 
+    # in incremental mode stop paging once we reach postings we have
+    # already seen, but still crawl every page now and then
+    seen = stop_after = None
+    full_crawl = True
+    incremental = indeed_cfg.getboolean('incremental', fallback=False)
+    if incremental:
+        params['sort'] = 'date'
+        full_crawl_every = indeed_cfg.getfloat('full_crawl_every', fallback=24.0)
+        if now - meta.get('last_full_crawl', 0) < full_crawl_every * 3600:
+            seen = db
+            stop_after = indeed_cfg.getint('stop_after', fallback=None)
+            full_crawl = False
+            logging.info('Incremental fetch (stop_after=%r)', stop_after)
+
+    # only search back as far as the last successful run, unless this is
+    # a scheduled full crawl, which always covers the whole window
+    if not (incremental and full_crawl):
+        params['fromage'] = get_fromage(
+            meta.get('last_success'),
+            now,
+            max_fromage=params['fromage'],
+            margin=indeed_cfg.getfloat('fromage_margin', fallback=1.0),
+        )
+
     logging.debug(params)
 
-    query, loc = get_sanitised_params(params['q'], params['l'])
+    # get all listings from the indeed API
+    workers = indeed_cfg.getint('workers', fallback=1)
+    all_posts = async_indeed_api_request(
+        params, workers=workers, client=client, seen=seen, stop_after=stop_after
+    )
+
+    # keep whatever was fetched if a request fails part way through
+    found = {}
+    complete = True
+    try:
+        async for d in all_posts:
+            found.update(d)
+    except IndeedRequestError as e:
+        complete = False
+        print(f'WARNING: {e} Continuing with the results fetched so far.')
+        logging.warning('Incomplete fetch: %s', e)
 
-    db_name = f'{query}_{loc}.json'
-    db_path = os.path.join(database_dir, db_name)
-    db = load_json_db(db_path)
-    logging.info('Load JSON database %r', db_path)
+    return found, complete, full_crawl
+
+
+async def async_jobnotify(cfg_filename=PATH_TO_CFG, database_dir=DB_DIR, use_cache=True):
+    """Asynchronous version of `jobnotify`.
+
+    Blocking file and network I/O is carried out in the default
+    executor, so many searches may be run concurrently in a single
+    event loop, e.g., with `asyncio.gather`.
+    """
+    # TODO: if config does not exist perhaps populate with defaults
+    if not os.path.isfile(cfg_filename):
+        raise FileNotFoundError(f'Configuration file {repr(cfg_filename)} does not exist.')
+
+    # load all configuration files
+    cfgs = get_section_configs(cfg_filename)
+
+    # the `indeed` section is the first section in the list
+    indeed_cfg = cfgs[0]
+
+    db_cfg = load_optional_cfg(cfg_filename, 'database')
+    backend = db_cfg.get('backend', fallback='json')
+
+    outbox = _build_outbox(cfg_filename, database_dir, db_cfg)
+    now = time.time()
+
+    searches = [
+        (query, location, '_'.join(get_sanitised_params(query, location)))
+        for query, location in get_searches(indeed_cfg)
+    ]
+
+    # with a shared database every search is stored once by jobkey,
+    # along with the searches which matched it
+    storages = {}
+    shared = matches = None
+    if db_cfg.getboolean('shared', fallback=False):
+        shared = await _open_storage(database_dir, SHARED_DB_NAME, backend, db_cfg)
+    else:
+        for _, _, name in searches:
+            if name not in storages:
+                storages[name] = await _open_storage(database_dir, name, backend, db_cfg)
+    databases = [shared] if shared is not None else list(storages.values())
+
+    try:
+        # fetch every search without holding any lock, so that overlapping
+        # runs only wait for each other while the new postings are added
+        results = []
+        for query, location, name in searches:
+            # only the jobkeys are needed to find new postings, so the
+            # postings themselves are never loaded
+            db = Database(shared or storages[name])
+            # the index may need to be rebuilt, which takes the lock
+            await _locked(db.storage.lock, db.storage.index)
+            logging.info('Open %r with index %r', db, db.index)
+
+            # run metadata is kept per search, even in a shared database
+            meta_path = os.path.join(database_dir, f'{name}.json')
+            meta = await _in_executor(load_run_metadata, meta_path)
+
+            # the request budget applies to each search, so every search has
+            # its own client, sharing the process-wide pool and rate limiter
+            client = _build_client(indeed_cfg, use_cache)
+            found, complete, full_crawl = await _search(
+                indeed_cfg, query, location, client, db, meta, now
+            )
+            _log_client_stats(name, client)
+
+            results.append((name, db, found, meta, meta_path, complete, full_crawl))
+
+        # hold the lock of every database until its new postings are added,
+        # so that overlapping runs neither lose nor re-notify postings. The
+        # locks are taken in a consistent order, so runs cannot deadlock.
+        for storage in sorted(databases, key=lambda storage: storage.path):
+            await storage.lock.acquire_async()
+            # another run may have added postings since the index was read
+            await _in_executor(storage.refresh)
+            await _in_executor(storage.index)
+
+        if shared is not None:
+            matches = await _in_executor(SearchMatches, search_matches_path(shared.path))
+            # matches of pruned postings are removed in the same transaction
+            shared.matches = matches
+
+        # postings not seen before by any search, so that a posting
+        # matched by several searches is only notified once
+        posts = {}
+        unseen_by_search = []
+
+        for name, db, found, meta, meta_path, complete, full_crawl in results:
+            unseen = {k: v for k, v in found.items() if k not in db}
+            posts.update(unseen)
+            logging.info('Search %r: len(found)=%d, len(unseen)=%d', name, len(found), len(unseen))
+            unseen_by_search.append(unseen)
+
+            if matches is not None:
+                await _in_executor(matches.add, name, found)
+
+        logging.info('len(posts)=%d', len(posts))
+
+        if not posts:
+            logging.info('No new positions since last notification.')
+        elif outbox is not None:
+            # queue the notification before the postings are added to the
+            # databases, so that they cannot be lost if this run fails
+            channels = _enabled_channels(cfgs[-1])
+            n = await _locked(outbox.lock, outbox.enqueue, posts, channels, now)
+            logging.info('Queued %d listing(s) for delivery via %s', n, ', '.join(channels))
+        else:
+            # send the notification
+            await async_notify(cfgs, posts)
+
+        # add the new postings to our existing databases
+        if shared is not None:
+            if posts:
+                logging.info('Write database %r', shared)
+                await _in_executor(Database(shared).update, posts)
+            await _in_executor(matches.save)
+
+        for (name, db, found, meta, meta_path, complete, full_crawl), unseen in zip(
+                results, unseen_by_search):
+            if shared is None and unseen:
+                logging.info('Write %r', db)
+                await _in_executor(db.update, unseen)
+
+            # an incomplete fetch may have missed postings, so the next run
+            # must search back at least as far as this one did
+            if complete:
+                meta['last_success'] = now
+                if full_crawl:
+                    meta['last_full_crawl'] = now
+                await _in_executor(write_run_metadata, meta, meta_path)
+    finally:
+        if matches is not None:
+            shared.matches = None
+            await _in_executor(matches.close)
+        for storage in databases:
+            await _in_executor(storage.close)
+
+    # deliver queued notifications once the databases are released, so
+    # that other runs may add postings while they are being sent
+    if outbox is not None:
+        await async_deliver(cfgs, outbox)
+
+
+def _build_outbox(cfg_filename, database_dir, db_cfg):
+    """Return the `Outbox` configured by the `outbox` section, or None if disabled."""
+    outbox_cfg = load_optional_cfg(cfg_filename, 'outbox')
+    if not outbox_cfg.getboolean('enabled', fallback=False):
+        return None
+
+    retry = RetryPolicy(
+        max_retries=outbox_cfg.getint('max_retries', fallback=10),
+        backoff=outbox_cfg.getfloat('backoff', fallback=60.0),
+        max_backoff=outbox_cfg.getfloat('max_backoff', fallback=6 * 3600.0),
+    )
+    lock_timeout = db_cfg.getfloat('lock_timeout', fallback=None)
+
+    return Outbox(outbox_path(database_dir), retry, lock_timeout)
+
+
+class ChannelResult:
+    """Outcome of sending a notification through one channel.
+
+    Attributes:
+        channel: name of the channel, e.g., `email`.
+        ok: True if the notification was sent.
+        latency: seconds taken to send the notification, or to fail.
+        error: exception raised by the channel, or None if `ok`.
+    """
+    def __init__(self, channel, ok, latency, error=None):
+        self.channel = channel
+        self.ok = ok
+        self.latency = latency
+        self.error = error
+
+    def __repr__(self):
+        return (
+            f'ChannelResult({self.channel!r}, ok={self.ok}, '
+            f'latency={self.latency:.3f}, error={self.error!r})'
+        )
+
+
+async def _notify_email(cfgs, posts, session=None):
+    queries, locations = zip(*get_searches(cfgs['indeed']))
+    query = ', '.join(dict.fromkeys(queries))
+    location = ', '.join(dict.fromkeys(locations))
+
+    await async_email_notify(cfgs['email'], posts, query, location, session)
+
+
+async def _notify_slack(cfgs, posts, session=None):
+    await async_slack_notify(cfgs['slack'], posts)
 
-    # get all listings from the indeed API
-    all_posts = indeed_api_request(params)
 
-    # build a list of posts that we haven't seen before
-    posts = {k: v for d in all_posts for k, v in d.items() if k not in db}
-    logging.info('len(posts)=%d', len(posts))
+# notification channels, keyed by their option in the `notify_via` section.
+# Each is a coroutine function taking the configuration sections, keyed
+# by name, the new postings and the channel's connection from
+# `_open_sessions`, if it has one.
+CHANNELS = {
+    'email': _notify_email,
+    'slack': _notify_slack,
+}
 
-    if posts:
-        # send the notification
-        notify(cfgs, posts)
 
-        # update our existing database
-        db.update(posts)
+def _open_sessions(cfgs, stack):
+    """Return the connections shared by the notifications of a run, keyed by channel.
 
-        logging.info('Write JSON database %r', db_path)
+    Every email sent during a run goes over a single SMTP connection,
+    which is closed along with `stack` at the end of the run. If
+    `idle_timeout` is set in the `email` section, the process-wide
+    session is used instead, and kept open for later runs.
 
-        write_json_db(db, db_path)
+    Args:
+        cfgs: configuration sections, as returned by `get_section_configs`.
+        stack: `contextlib.ExitStack` closed at the end of the run.
+    """
+    sessions = {}
+    email_cfg = next((cfg for cfg in cfgs if cfg.name == 'email'), None)
+    if email_cfg is None:
+        return sessions
+
+    user = email_cfg.get('email_from')
+    password = email_cfg.get('password')
+    # never wait on the server for longer than the notification itself
+    timeout = email_cfg.getfloat('timeout', fallback=NOTIFY_TIMEOUT) or SMTP_TIMEOUT
+    idle_timeout = email_cfg.getfloat('idle_timeout', fallback=0)
+
+    if idle_timeout > 0:
+        sessions['email'] = get_smtp_session(user, password, idle_timeout, timeout)
     else:
-        logging.info('No new positions since last notification.')
+        sessions['email'] = stack.enter_context(SMTPSession(user, password, timeout=timeout))
+
+    return sessions
+
+
+def _channel_timeout(cfgs, channel):
+    """Return the `timeout` set in the section of `channel`, 0 for none."""
+    section = cfgs.get(channel)
+    if section is None:
+        return NOTIFY_TIMEOUT
+    return section.getfloat('timeout', fallback=NOTIFY_TIMEOUT)
+
+
+async def _dispatch(channel, cfgs, posts, sessions=None):
+    """Send `posts` through `channel`, returning a `ChannelResult`.
+
+    The notification is abandoned after the `timeout` set in the
+    channel's section of the configuration file.
+    """
+    timeout = _channel_timeout(cfgs, channel)
+
+    start = time.monotonic()
+    try:
+        session = (sessions or {}).get(channel)
+        await asyncio.wait_for(CHANNELS[channel](cfgs, posts, session), timeout or None)
+    except asyncio.TimeoutError:
+        error = NotificationTimeoutError(
+            f'Notification via {channel} timed out after {timeout:g} seconds.'
+        )
+        return ChannelResult(channel, False, time.monotonic() - start, error)
+    except Exception as e:
+        return ChannelResult(channel, False, time.monotonic() - start, e)
+
+    return ChannelResult(channel, True, time.monotonic() - start)
+
+
+def _enabled_channels(notify_via):
+    """Return the names of the channels enabled in the `notify_via` section.
+
+    Raises:
+        ConfigurationFileError: if an unknown channel is enabled.
+    """
+    channels = [name for name in notify_via if notify_via.getboolean(name)]
+    for name in channels:
+        if name not in CHANNELS:
+            raise ConfigurationFileError(
+                f'Unknown notification channel {name!r} in `notify_via` section.'
+            )
+    return channels
 
 
 def notify(cfgs, posts):
     """Generic notification function."""
-    # assuming cfgs is a list of configs
-    # if someone modifies the layout of the cfg file we're in trouble!
-    indeed, email, slack, notify_via = cfgs
+    return _run(async_notify(cfgs, posts))
+
+
+async def async_notify(cfgs, posts):
+    """Asynchronous version of `notify`.
 
-    if notify_via.getboolean('slack'):
-        slack_notify(slack, posts)
-        logging.info('Slack message sent with %d listings(s)', len(posts))
+    The notification is sent through every channel enabled in the
+    `notify_via` section at once, so a slow or failing channel
+    neither delays nor prevents sending through the others.
+
+    Args:
+        cfgs: configuration sections, as returned by `get_section_configs`.
+        posts: dictionary containing new job listings.
+
+    Raises:
+        ConfigurationFileError: if an unknown channel is enabled.
+        NotificationError: once every channel has finished, if any
+            channel failed. Its `results` hold the outcome of every
+            channel, and it is raised from the first error.
+
+    Returns:
+        list of `ChannelResult`, one per enabled channel.
+    """
+    stack = contextlib.ExitStack()
+    sessions = _open_sessions(cfgs, stack)
+
+    cfgs = {cfg.name: cfg for cfg in cfgs}
+    try:
+        channels = _enabled_channels(cfgs['notify_via'])
+        results = await asyncio.gather(
+            *(_dispatch(name, cfgs, posts, sessions) for name in channels)
+        )
+    finally:
+        await _in_executor(stack.close)
+
+    for r in results:
+        if r.ok:
+            logging.info('Sent %d listing(s) via %s in %.3fs', len(posts), r.channel, r.latency)
+        else:
+            logging.error('Failed to notify via %s after %.3fs: %r', r.channel, r.latency, r.error)
+
+    failed = [r for r in results if not r.ok]
+    if failed:
+        summary = '; '.join(f'{r.channel}: {r.error}' for r in failed)
+        raise NotificationError(f'Notification failed ({summary})', results) from failed[0].error
+
+    return results
 
-    if notify_via.getboolean('email'):
-        query = indeed.get('query')
-        location = indeed.get('location')
-        email_notify(email, posts, query, location)
-        logging.info('Email sent with %d listings(s).', len(posts))
 
+def deliver(cfgs, outbox, drain=False):
+    """Deliver the notifications queued in `outbox`."""
+    return _run(async_deliver(cfgs, outbox, drain))
+
+
+async def async_deliver(cfgs, outbox, drain=False):
+    """Asynchronous version of `deliver`.
+
+    Every delivery which is due is attempted, through all channels at
+    once. A failed delivery is recorded in the outbox and retried by a
+    later call once its backoff has passed, so errors are logged
+    rather than raised.
+
+    The outbox is only locked while it is read and written, not while
+    sending, so other runs may queue notifications in the meantime.
+    Deliveries are claimed for the `timeout` of their channel before
+    they are sent, so that no other process sends them as well.
+
+    Args:
+        cfgs: configuration sections, as returned by `get_section_configs`.
+        outbox: `Outbox` of queued notifications.
+        drain: if True, wait for and attempt each retry in turn until
+            no deliveries are pending.
+
+    Returns:
+        number of deliveries still pending.
+    """
+    # every delivery made by this call shares one connection per channel
+    stack = contextlib.ExitStack()
+    sessions = _open_sessions(cfgs, stack)
+
+    cfgs = {cfg.name: cfg for cfg in cfgs}
+    try:
+        while True:
+            await outbox.lock.acquire_async()
+            try:
+                await _in_executor(outbox.load)
+                now = time.time()
+                due = outbox.due(now)
+                for batch, channel in due:
+                    until = now + (_channel_timeout(cfgs, channel) or NOTIFY_TIMEOUT)
+                    outbox.claim(batch, channel, until)
+                if due:
+                    await _in_executor(outbox.save)
+            finally:
+                outbox.lock.release()
+
+            results = await asyncio.gather(*(
+                _dispatch(channel, cfgs, batch['posts'], sessions)
+                for batch, channel in due
+            ))
+            for (batch, channel), r in zip(due, results):
+                if r.ok:
+                    logging.info(
+                        'Sent %d listing(s) via %s in %.3fs',
+                        len(batch['posts']), r.channel, r.latency,
+                    )
+                else:
+                    print(f'WARNING: Notification via {r.channel} failed: {r.error}')
+                    logging.warning('Failed to notify via %s: %r', r.channel, r.error)
+
+            await outbox.lock.acquire_async()
+            try:
+                # other runs may have changed the outbox while sending
+                await _in_executor(outbox.load)
+                for (batch, channel), r in zip(due, results):
+                    batch = outbox.get(batch['id'])
+                    if batch is not None:
+                        outbox.record(batch, channel, r.error, now)
+
+                pending = await _in_executor(outbox.save)
+                next_attempt = outbox.next_attempt()
+            finally:
+                outbox.lock.release()
+
+            logging.info('Outbox: %d delivery(s) pending', pending)
+            if not drain or next_attempt is None:
+                return pending
+
+            await asyncio.sleep(max(0.0, next_attempt - time.time()))
+    finally:
+        await _in_executor(stack.close)
 
 
 def main():
@@ -387,12 +1248,32 @@ def main():
         initial_setup(app_data_dir)
         logging.info('Created app data directory: %r', app_data_dir)
 
+    if args.reshard is not None:
+        compression = load_optional_cfg(args.file, 'database').get('compression', fallback='none')
+        compression = None if compression == 'none' else compression
+        for fname in sorted(os.listdir(DB_DIR)):
+            if fname.endswith(ShardedStorage.extension):
+                n = reshard(os.path.join(DB_DIR, fname), args.reshard, compression=compression)
+                print(f'Resharded {fname}: {n} postings in {args.reshard} shards.')
+        sys.exit()
+
     try:
-        jobnotify(args.file, DB_DIR)
+        if args.deliver:
+            cfgs = get_section_configs(args.file)
+            outbox = _build_outbox(args.file, DB_DIR, load_optional_cfg(args.file, 'database'))
+            if outbox is None:
+                print('The outbox is not enabled in the `outbox` section of the configuration file.')
+            else:
+                pending = deliver(cfgs, outbox, drain=args.drain)
+                print(f'{pending} notification(s) still pending.')
+        else:
+            jobnotify(args.file, DB_DIR, use_cache=not args.no_cache)
     except (
             ConfigurationFileError,
+            DatabaseLockedError,
             DuplicateOptionError,
             FileNotFoundError,
+            NotificationError,
             json.decoder.JSONDecodeError,
             ) as e:
         print(f'ERROR: {e}')
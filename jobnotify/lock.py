@@ -0,0 +1,149 @@
+import asyncio
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from .exceptions import DatabaseLockedError
+
+
+def lock_path(path_to_db):
+    """Return the path of the lock file kept beside `path_to_db`."""
+    return f'{os.path.splitext(path_to_db)[0]}.lock'
+
+
+def _try_lock(f):
+    """Take an exclusive lock on `f` without blocking.
+
+    Raises:
+        OSError: if another process holds the lock.
+    """
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """Advisory lock, shared between processes through a lock file.
+
+    The lock may be acquired again by the process which holds it, and
+    is released once it has been released as many times as it was
+    acquired. The lock file itself is never removed, since removing it
+    would let two processes lock different files of the same name.
+
+    Args:
+        path: path to the lock file.
+        timeout: seconds to wait for another process to release the
+            lock, or None to wait indefinitely.
+        poll_interval: seconds between attempts to take the lock.
+    """
+    def __init__(self, path, timeout=None, poll_interval=0.1):
+        self.path = path
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._file = None
+        self._count = 0
+        # guards the count, as the lock may be shared by threads
+        self._thread_lock = threading.Lock()
+
+    @property
+    def locked(self):
+        """True if this process holds the lock."""
+        return self._count > 0
+
+    def acquire(self):
+        """Take the lock, waiting for another process to release it.
+
+        Raises:
+            DatabaseLockedError: if the lock is not released within `timeout`.
+        """
+        deadline = self._deadline()
+        while not self._try_acquire():
+            self._check_deadline(deadline)
+            time.sleep(self.poll_interval)
+
+    async def acquire_async(self):
+        """Asynchronous version of `acquire`.
+
+        The lock is polled from the event loop rather than waited for
+        in an executor thread, so tasks waiting for the lock never take
+        the threads needed by the task which holds it.
+
+        Raises:
+            DatabaseLockedError: if the lock is not released within `timeout`.
+        """
+        deadline = self._deadline()
+        while not self._try_acquire():
+            self._check_deadline(deadline)
+            await asyncio.sleep(self.poll_interval)
+
+    def _deadline(self):
+        return None if self.timeout is None else time.monotonic() + self.timeout
+
+    def _check_deadline(self, deadline):
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DatabaseLockedError(f'Database is locked by another process ({self.path!r}).')
+
+    def _try_acquire(self):
+        """Take the lock if no other process holds it, returning True if taken."""
+        with self._thread_lock:
+            if self._count:
+                self._count += 1
+                return True
+
+            f = open(self.path, 'a+')
+            try:
+                _try_lock(f)
+            except OSError:
+                f.close()
+                return False
+
+            self._file = f
+            self._count = 1
+            return True
+
+    def release(self):
+        """Release the lock once."""
+        with self._thread_lock:
+            if not self._count:
+                raise RuntimeError('Cannot release a lock which is not held.')
+            self._count -= 1
+            if not self._count:
+                self._release()
+
+    def _release(self):
+        _unlock(self._file)
+        self._file.close()
+        self._file = None
+
+    def close(self):
+        """Release the lock, however many times it was acquired."""
+        with self._thread_lock:
+            if self._count:
+                self._count = 0
+                self._release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def __repr__(self):
+        return f'FileLock({self.path!r}, locked={self.locked})'
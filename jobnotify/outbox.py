@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import time
+import uuid
+
+from .client import RetryPolicy
+from .lock import FileLock, lock_path
+from .posting import as_posting, to_json
+
+OUTBOX_NAME = 'outbox.json'
+
+PENDING = 'pending'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+def outbox_path(database_dir):
+    """Return the path of the notification outbox kept in `database_dir`."""
+    return os.path.join(database_dir, OUTBOX_NAME)
+
+
+class Outbox:
+    """Notifications waiting to be delivered, kept on disk.
+
+    Each batch of new postings is queued once, along with the channels
+    it must be delivered through, and the delivery of each channel is
+    tracked separately: a batch delivered through one channel is never
+    sent through it again because another channel failed. A failed
+    delivery is retried after a delay drawn from `retry`, and given up
+    once it has been retried `retry.max_retries` times.
+
+    Batches are dictionaries with the keys `id`, `created`, `posts` and
+    `channels`, which maps each channel to its delivery state: its
+    `status` (pending, sent or failed), the number of `attempts`, the
+    time of the `next_attempt` and the last `error`.
+
+    Hold `lock` while loading, changing and saving the outbox, but not
+    while sending: `claim` the due deliveries and save the outbox, send
+    them with the lock released, then load the outbox again and `record`
+    each attempt in the batch returned by `get`.
+
+    Args:
+        path: path to the outbox file.
+        retry: `RetryPolicy` used to delay failed deliveries.
+        lock_timeout: seconds to wait for another process to release
+            the outbox, or None to wait indefinitely.
+    """
+    def __init__(self, path, retry=None, lock_timeout=None):
+        self.path = path
+        self.retry = retry if retry is not None else RetryPolicy(
+            max_retries=10, backoff=60.0, max_backoff=6 * 3600.0
+        )
+        self.lock = FileLock(lock_path(path), lock_timeout)
+        self.batches = []
+
+    def load(self):
+        """Read the queued batches from file."""
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                self.batches = json.load(f, object_hook=as_posting)
+        else:
+            self.batches = []
+
+    def save(self):
+        """Write the queued batches to file, dropping those which are finished.
+
+        Returns:
+            number of deliveries still pending.
+        """
+        batches = []
+        for batch in self.batches:
+            states = batch['channels'].values()
+            if any(state['status'] == PENDING for state in states):
+                batches.append(batch)
+        self.batches = batches
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(batches, f, separators=(',', ':'), default=to_json)
+        os.replace(tmp_path, self.path)
+
+        return len(self)
+
+    def enqueue(self, posts, channels, now=None):
+        """Queue `posts` for delivery through each of `channels`.
+
+        Postings which are already queued are left out, so postings
+        queued by a run which failed before writing its database are
+        not queued twice.
+
+        Returns:
+            number of postings queued.
+        """
+        now = time.time() if now is None else now
+
+        with self.lock:
+            self.load()
+            queued = set()
+            for batch in self.batches:
+                queued.update(batch['posts'])
+            posts = {k: p for k, p in posts.items() if k not in queued}
+
+            if posts and channels:
+                self.batches.append({
+                    'id': uuid.uuid4().hex,
+                    'created': now,
+                    'posts': posts,
+                    'channels': {
+                        c: {'status': PENDING, 'attempts': 0, 'next_attempt': now, 'error': None}
+                        for c in channels
+                    },
+                })
+                self.save()
+
+        return len(posts)
+
+    def due(self, now):
+        """Return `(batch, channel)` pairs whose delivery is due at `now`."""
+        return [
+            (batch, channel)
+            for batch in self.batches
+            for channel, state in batch['channels'].items()
+            if state['status'] == PENDING and state['next_attempt'] <= now
+        ]
+
+    def get(self, batch_id):
+        """Return the queued batch with `batch_id`, or None if it is finished."""
+        for batch in self.batches:
+            if batch['id'] == batch_id:
+                return batch
+        return None
+
+    def claim(self, batch, channel, until):
+        """Hold back the delivery of `batch` through `channel` until `until`.
+
+        A delivery claimed by one process is not due for any other until
+        it is recorded or, if that process dies first, until its claim
+        runs out.
+        """
+        batch['channels'][channel]['next_attempt'] = until
+
+    def record(self, batch, channel, error, now):
+        """Record an attempt to deliver `batch` through `channel`.
+
+        Args:
+            batch: batch which was delivered.
+            channel: name of the channel.
+            error: exception raised by the channel, or None if the
+                batch was delivered.
+            now: time of the attempt.
+        """
+        state = batch['channels'][channel]
+        state['attempts'] += 1
+
+        if error is None:
+            state['status'] = SENT
+            state['error'] = None
+            return
+
+        state['error'] = repr(error)
+        if state['attempts'] > self.retry.max_retries:
+            state['status'] = FAILED
+            logging.error(
+                'Giving up on delivering %d listing(s) via %s after %d attempts: %r',
+                len(batch['posts']), channel, state['attempts'], error,
+            )
+        else:
+            state['next_attempt'] = now + self.retry.delay(state['attempts'] - 1)
+
+    def next_attempt(self):
+        """Return the time of the next pending delivery, or None."""
+        times = [
+            state['next_attempt']
+            for batch in self.batches
+            for state in batch['channels'].values()
+            if state['status'] == PENDING
+        ]
+        return min(times, default=None)
+
+    def __len__(self):
+        return sum(
+            state['status'] == PENDING
+            for batch in self.batches
+            for state in batch['channels'].values()
+        )
+
+    def __repr__(self):
+        return f'Outbox({self.path!r}, {len(self.batches)} batches)'
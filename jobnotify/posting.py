@@ -0,0 +1,68 @@
+from collections.abc import Mapping
+import sys
+
+FIELDS = ('jobtitle', 'company', 'date_created', 'location', 'url', 'lat', 'lon', 'desc')
+_FIELD_SET = frozenset(FIELDS)
+
+
+class Posting(Mapping):
+    """A single job posting.
+
+    Postings are stored in `__slots__` rather than a per-instance
+    dict, and the company and location strings, which repeat across
+    many postings, are interned. A `Posting` is a read-only mapping
+    with the same keys as the JSON database layout, so it can be
+    used anywhere the nested dicts were, e.g., `str.format(**p)`.
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, jobtitle, company, date_created, location, url, lat, lon, desc):
+        self.jobtitle = jobtitle
+        self.company = sys.intern(company)
+        self.date_created = date_created
+        self.location = sys.intern(location)
+        self.url = url
+        self.lat = float(lat) if lat is not None else None
+        self.lon = float(lon) if lon is not None else None
+        self.desc = desc
+
+    @classmethod
+    def from_dict(cls, d):
+        """Return a `Posting` from a dictionary in the JSON layout."""
+        return cls(**{k: d[k] for k in FIELDS})
+
+    def to_dict(self):
+        """Return the posting as a dictionary in the JSON layout."""
+        return {k: getattr(self, k) for k in FIELDS}
+
+    def __getitem__(self, key):
+        if key not in FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __repr__(self):
+        return f'Posting({self.jobtitle!r} @ {self.company!r})'
+
+
+def as_posting(d):
+    """`object_hook` for `json.load` which decodes postings.
+
+    Dictionaries with every posting field become `Posting` objects;
+    any other dictionary is returned unchanged.
+    """
+    if d.keys() >= _FIELD_SET:
+        return Posting.from_dict(d)
+    return d
+
+
+def to_json(obj):
+    """`default` hook for `json.dump` which encodes postings."""
+    if isinstance(obj, Posting):
+        return obj.to_dict()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
@@ -0,0 +1,159 @@
+import json
+import math
+import struct
+
+from .posting import as_posting, Posting, to_json
+
+
+class Serializer:
+    """Base class for the formats in which a whole database is written.
+
+    Subclasses implement `dump`, which writes a dictionary of postings
+    keyed by jobkey to a file, and `load`, which reads it back.
+    """
+    #: file extension used for databases in this format
+    extension = None
+    #: mode in which files are opened, 't' or 'b'
+    mode = 't'
+
+    def dump(self, db, f):
+        raise NotImplementedError
+
+    def load(self, f):
+        raise NotImplementedError
+
+
+class PrettyJSONSerializer(Serializer):
+    """Indented JSON with sorted keys, the original database format.
+
+    This is the slowest format, but is easy to read and diff.
+    """
+    extension = '.json'
+
+    def dump(self, db, f):
+        json.dump(db, f, indent=2, sort_keys=True, default=to_json)
+
+    def load(self, f):
+        return json.load(f, object_hook=as_posting)
+
+
+class CompactJSONSerializer(Serializer):
+    """JSON without whitespace or key sorting."""
+    extension = '.json'
+
+    def dump(self, db, f):
+        json.dump(db, f, separators=(',', ':'), default=to_json)
+
+    def load(self, f):
+        return json.load(f, object_hook=as_posting)
+
+
+class BinarySerializer(Serializer):
+    """Length-prefixed binary format with string interning.
+
+    Every distinct string is written once, in a table of
+    length-prefixed UTF-8 strings, and each posting is a fixed-size
+    record of indexes into the table followed by its coordinates.
+    Company names, locations and dates repeat across many postings,
+    so the file is small, and loading decodes each string only once.
+
+    Layout (little-endian)::
+
+        magic             4 bytes, b'JNDB'
+        version           uint8
+        string count      uint32
+        strings           uint32 length + UTF-8 bytes, each
+        record count      uint32
+        records           7 uint32 string indexes + 2 float64, each
+
+    A missing string is stored as index 0xffffffff, and a missing
+    coordinate as NaN.
+    """
+    extension = '.jnb'
+    mode = 'b'
+
+    MAGIC = b'JNDB'
+    VERSION = 1
+    NONE = 0xffffffff
+
+    _header = struct.Struct('<4sBI')
+    _count = struct.Struct('<I')
+    _record = struct.Struct('<7I2d')
+    _strings = ('jobtitle', 'company', 'date_created', 'location', 'url', 'desc')
+
+    def dump(self, db, f):
+        table = {}
+        records = bytearray()
+
+        def intern(s):
+            if s is None:
+                return self.NONE
+            try:
+                return table[s]
+            except KeyError:
+                i = table[s] = len(table)
+                return i
+
+        for k, p in db.items():
+            lat, lon = p['lat'], p['lon']
+            records += self._record.pack(
+                intern(k),
+                *(intern(p[name]) for name in self._strings),
+                math.nan if lat is None else lat,
+                math.nan if lon is None else lon,
+            )
+
+        f.write(self._header.pack(self.MAGIC, self.VERSION, len(table)))
+        for s in table:
+            b = s.encode('utf-8')
+            f.write(self._count.pack(len(b)))
+            f.write(b)
+        f.write(self._count.pack(len(db)))
+        f.write(records)
+
+    def load(self, f):
+        data = f.read()
+        if not data:
+            return {}
+
+        magic, version, nstrings = self._header.unpack_from(data)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f'Not a version {self.VERSION} binary database.')
+
+        pos = self._header.size
+        strings = []
+        for _ in range(nstrings):
+            n, = self._count.unpack_from(data, pos)
+            pos += self._count.size
+            strings.append(data[pos:pos + n].decode('utf-8'))
+            pos += n
+
+        nrecords, = self._count.unpack_from(data, pos)
+        pos += self._count.size
+        end = pos + nrecords * self._record.size
+
+        def get(i):
+            return None if i == self.NONE else strings[i]
+
+        db = {}
+        for key, jobtitle, company, date, location, url, desc, lat, lon in \
+                self._record.iter_unpack(data[pos:end]):
+            db[strings[key]] = Posting(
+                jobtitle=get(jobtitle),
+                company=get(company),
+                date_created=get(date),
+                location=get(location),
+                url=get(url),
+                lat=None if math.isnan(lat) else lat,
+                lon=None if math.isnan(lon) else lon,
+                desc=get(desc),
+            )
+
+        return db
+
+
+SERIALIZERS = {
+    'pretty': PrettyJSONSerializer,
+    'compact': CompactJSONSerializer,
+    'binary': BinarySerializer,
+}
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from slackclient import SlackClient
+
+# https://api.slack.com/methods/chat.postMessage
+# errors which mean that the token itself is no longer valid
+AUTH_ERRORS = frozenset({
+    'account_inactive',
+    'invalid_auth',
+    'not_authed',
+    'token_expired',
+    'token_revoked',
+})
+
+
+class SlackAuthCache:
+    """On-disk record of Slack tokens which passed validation.
+
+    A token validated with `api.test` is trusted for `ttl` seconds, so
+    the round-trip is not repeated on every run. Tokens are stored as
+    SHA-256 digests, never in the clear.
+
+    Args:
+        path: path to the cache file.
+        ttl: number of seconds a validation remains valid.
+    """
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+        return entries if isinstance(entries, dict) else {}
+
+    def _save(self, entries):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    def is_valid(self, token):
+        """Return True if `token` was validated less than `ttl` seconds ago."""
+        validated = self._load().get(self._key(token))
+        return validated is not None and time.time() - validated < self.ttl
+
+    def add(self, token):
+        """Record that `token` has just been validated."""
+        now = time.time()
+        with self._lock:
+            entries = {k: t for k, t in self._load().items() if now - t < self.ttl}
+            entries[self._key(token)] = now
+            self._save(entries)
+
+    def remove(self, token):
+        """Forget the validation of `token`, e.g., after an auth error."""
+        with self._lock:
+            entries = self._load()
+            if entries.pop(self._key(token), None) is not None:
+                self._save(entries)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_slack_client(token):
+    """Return a process-wide `SlackClient` for `token`.
+
+    Every search notified within the same process shares the client.
+    """
+    with _clients_lock:
+        if token not in _clients:
+            _clients[token] = SlackClient(token)
+        return _clients[token]
@@ -0,0 +1,145 @@
+import contextlib
+import logging
+import smtplib
+import threading
+import time
+
+SMTP_HOST = 'smtp.gmail.com'
+SMTP_PORT = 587
+SMTP_TIMEOUT = 60.0
+
+
+class SMTPSession:
+    """An authenticated SMTP connection which is reused for many messages.
+
+    The connection is opened, upgraded with STARTTLS and logged into
+    when the first message is sent, and kept open for the messages
+    which follow. A connection which has been idle for `idle_timeout`
+    seconds is closed before the next message is sent, as the server
+    will have dropped it by then, and a connection dropped by the
+    server while sending is replaced once, transparently.
+
+    Args:
+        user: account of sender.
+        password: password of sender.
+        host: SMTP server.
+        port: SMTP server port.
+        idle_timeout: seconds after which an idle connection is closed.
+        timeout: seconds to wait for the server on each blocking
+            operation, so that a server which stops responding fails
+            the send instead of holding the session indefinitely.
+
+    Attributes:
+        stats: counters for connections `created`, messages `sent` and
+            `reconnects` after the server dropped the connection.
+    """
+    def __init__(self, user, password, host=SMTP_HOST, port=SMTP_PORT, idle_timeout=60.0,
+                 timeout=SMTP_TIMEOUT):
+        self.user = user
+        self.password = password
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.stats = {'created': 0, 'sent': 0, 'reconnects': 0}
+        self._stack = None
+        self._smtp = None
+        self._last_used = 0.0
+        # guards the connection, as a session may be shared by threads
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Open and authenticate a new connection.
+
+        Raises:
+            smtplib.SMTPAuthenticationError: for a bad user or password.
+        """
+        stack = contextlib.ExitStack()
+        try:
+            smtp = stack.enter_context(smtplib.SMTP(self.host, self.port, timeout=self.timeout))
+            smtp.ehlo()  # success 250
+            smtp.starttls()  # success 220
+            smtp.login(self.user, self.password)  # success 235
+        except BaseException:
+            stack.close()
+            raise
+
+        self._stack = stack
+        self._smtp = smtp
+        self.stats['created'] += 1
+
+    def _disconnect(self):
+        if self._stack is None:
+            return
+
+        try:
+            self._stack.close()
+        except (smtplib.SMTPException, OSError) as e:
+            logging.debug('Error closing SMTP connection to %s: %r', self.host, e)
+
+        self._stack = None
+        self._smtp = None
+
+    def send(self, msg):
+        """Send the email.message.Message `msg`.
+
+        Raises:
+            smtplib.SMTPAuthenticationError: for a bad user or password.
+        """
+        with self._lock:
+            if self._smtp is not None and time.monotonic() - self._last_used >= self.idle_timeout:
+                self._disconnect()
+
+            reused = self._smtp is not None
+            if not reused:
+                self._connect()
+
+            try:
+                self._smtp.send_message(msg)  # empty dict is a success
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                self._disconnect()
+                if not reused:
+                    raise
+                # the server closed the connection; retry on a new one
+                logging.debug('Stale SMTP connection to %s: %r', self.host, e)
+                self.stats['reconnects'] += 1
+                self._connect()
+                self._smtp.send_message(msg)
+
+            self._last_used = time.monotonic()
+            self.stats['sent'] += 1
+
+    def close(self):
+        """Close the connection, if it is open."""
+        with self._lock:
+            self._disconnect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f'SMTPSession({self.user!r}, {self.host!r}, {self.port})'
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_smtp_session(user, password, idle_timeout, timeout=SMTP_TIMEOUT):
+    """Return a process-wide `SMTPSession` for `user`.
+
+    Runs within the same process share the returned session, so a
+    long-running process sends every notification over one connection
+    until it has been idle for `idle_timeout` seconds.
+    """
+    key = (user, password, idle_timeout, timeout)
+
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = SMTPSession(
+                user, password, idle_timeout=idle_timeout, timeout=timeout
+            )
+        return _sessions[key]
@@ -0,0 +1,1063 @@
+from email.utils import parsedate_to_datetime
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+
+from .compression import COMPRESSIONS, open_file
+from .exceptions import DatabaseCfgError
+from .index import index_path, JobkeyIndex
+from .lock import FileLock, lock_path
+from .posting import FIELDS, Posting
+from .serializers import SERIALIZERS
+
+
+class Storage:
+    """Base class for databases of postings which have been seen.
+
+    A storage backend maps jobkeys to `Posting` objects. Subclasses
+    implement `load`, which returns every posting, and `_add`, which
+    stores new postings. Checking whether a posting has been seen
+    should use `index`, which does not load the postings. Storage
+    objects may be used as context managers, in which case they are
+    closed on exit.
+
+    Changes are made while holding `lock`, an advisory lock shared with
+    other processes, after discarding anything read earlier, so that
+    postings written by another process are merged rather than lost.
+    To keep other processes from also notifying the same postings,
+    take `lock`, call `refresh` and hold the lock from checking the
+    index until the new postings are added. Slow work, such as
+    fetching postings, may be done beforehand without the lock.
+
+    Postings pruned from a shared database are also removed from its
+    `SearchMatches`. Set `matches` to a `SearchMatches` which is already
+    open, so that they are removed in its transaction rather than
+    through a second connection, which would wait on the first.
+    """
+    #: file extension used for databases of this type
+    extension = None
+
+    def __init__(self, path, retention_days=None, tombstone_days=90, lock_timeout=None):
+        self.path = path
+        self.retention_days = retention_days
+        self.tombstone_days = tombstone_days
+        self.tombstones = Tombstones(tombstones_path(path))
+        self.lock = FileLock(lock_path(path), timeout=lock_timeout)
+        self.matches = None
+        self._index = None
+
+    @classmethod
+    def _cfg_options(cls, cfg):
+        """Return keyword arguments for `__init__` read from `cfg`."""
+        return {
+            'retention_days': cfg.getfloat('retention_days', fallback=None),
+            'tombstone_days': cfg.getfloat('tombstone_days', fallback=90),
+            'lock_timeout': cfg.getfloat('lock_timeout', fallback=None),
+        }
+
+    @classmethod
+    def _extension(cls, options):
+        """Return the file extension for a database created with `options`."""
+        return cls.extension
+
+    def exists(self):
+        """Return True if the database has been created."""
+        return os.path.exists(self.path)
+
+    def load(self):
+        """Return a dictionary of all stored postings, keyed by jobkey."""
+        raise NotImplementedError
+
+    def keys(self):
+        """Return the set of stored jobkeys."""
+        return set(self.load())
+
+    def get(self, jobkey, default=None):
+        """Return the posting stored for `jobkey`, or `default`."""
+        return self.load().get(jobkey, default)
+
+    def index(self):
+        """Return the `JobkeyIndex` of the database.
+
+        The index is rebuilt if it is missing or out of date. Once
+        opened, it is kept up to date by `add`.
+        """
+        if self._index is None:
+            # the index is never built from a database which is being written
+            with self.lock:
+                # pruned postings stay in the index while they are tombstoned
+                self._index = JobkeyIndex.open(
+                    self.path, lambda: self.keys() | self.tombstones.keys()
+                )
+        return self._index
+
+    def refresh(self):
+        """Discard anything read from the database if another process has changed it.
+
+        Call while holding `lock`; the index is then reopened on next use.
+        """
+        if self._index is not None and self._index.is_stale(self.path):
+            self._index.close()
+            self._index = None
+        self._invalidate()
+
+    def add(self, posts):
+        """Store the postings in `posts`, a dictionary keyed by jobkey.
+
+        If a retention period is set, old postings are then pruned.
+        """
+        with self.lock:
+            # another process may have changed the database since the
+            # index was read
+            stale = self._index is not None and self._index.is_stale(self.path)
+
+            self._invalidate()
+            self._add(posts)
+
+            if stale:
+                self._index.close()
+                self._index = None
+                self.index()
+            elif self._index is not None:
+                self._index.add(posts, self.path)
+
+            # the lock is held and the database was just read, so prune
+            # without discarding it
+            if self.retention_days is not None:
+                self._prune(None, posts)
+
+    def _invalidate(self):
+        """Discard anything read from the database, which may have changed."""
+        self.tombstones = Tombstones(tombstones_path(self.path))
+
+    def _add(self, posts):
+        raise NotImplementedError
+
+    def _older_than(self, timestamp, added=None):
+        """Return a dictionary of the posting times of postings older than `timestamp`.
+
+        Args:
+            timestamp: seconds since the epoch.
+            added: jobkeys which have just been added, or None. A
+                backend may then only look at the part of the database
+                which was written.
+        """
+        return _older_than(self.load(), timestamp)
+
+    def _size(self):
+        """Return the number of bytes used by the database."""
+        return os.path.getsize(self.path) if self.exists() else 0
+
+    def _remove(self, keys):
+        raise NotImplementedError
+
+    def prune(self, now=None):
+        """Remove postings older than the retention period.
+
+        The jobkeys of removed postings are kept as tombstones until
+        `tombstone_days` after they were posted, so that a posting
+        which is seen again in that time is not treated as new.
+
+        Args:
+            now: current time (seconds since the epoch).
+
+        Returns:
+            dictionary of statistics about the postings pruned.
+        """
+        with self.lock:
+            self._invalidate()
+            return self._prune(now)
+
+    def _prune(self, now, added=None):
+        now = time.time() if now is None else now
+        size = self._size()
+
+        old = self._older_than(now - self.retention_days * 86400, added)
+        if old:
+            self._remove(old)
+            self._forget_matches(old)
+
+        expired = self.tombstones.expire(now)
+        self.tombstones.add(
+            (k, created + self.tombstone_days * 86400) for k, created in old.items()
+        )
+        if old or expired:
+            self.tombstones.save()
+            # rebuild the index without the expired tombstones
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+            if os.path.exists(index_path(self.path)):
+                os.remove(index_path(self.path))
+
+        stats = {
+            'pruned': len(old),
+            'tombstones': len(self.tombstones),
+            'expired_tombstones': expired,
+            'reclaimed_bytes': size - self._size(),
+        }
+        logging.info('Pruned %r: %r', self, stats)
+
+        return stats
+
+    def _forget_matches(self, keys):
+        """Remove the search matches of `keys` from a shared database."""
+        if self.matches is not None:
+            # saved along with the matches of the new postings
+            self.matches.remove(keys)
+            return
+
+        path = search_matches_path(self.path)
+        legacy_path = f'{os.path.splitext(path)[0]}.json'
+        if not (os.path.exists(path) or os.path.exists(legacy_path)):
+            return
+
+        matches = SearchMatches(path)
+        matches.remove(keys)
+        matches.save()
+        matches.close()
+
+    def close(self):
+        """Release any resources held by the database, including the lock."""
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        self.lock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.path!r})'
+
+
+def _write_atomic(path, mode, write, compression=None):
+    """Write a file by calling `write` with a temporary file, then renaming it to `path`."""
+    tmp_path = f'{path}.tmp'
+    with open_file(tmp_path, 'w' + mode, compression) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+class JSONStorage(Storage):
+    """Database kept in a single file, by default pretty-printed JSON.
+
+    This is the original database format. Every call to `add`
+    rewrites the whole file, in the format of `serializer`.
+
+    Args:
+        path: path to the database.
+        serializer: name of the file format, a key of `SERIALIZERS`.
+        compression: name of the compression used when writing, a key
+            of `COMPRESSIONS`, or None. Compressed files are detected
+            when reading, whatever the setting.
+    """
+    extension = '.json'
+
+    def __init__(self, path, serializer='pretty', compression=None, **kwargs):
+        super().__init__(path, **kwargs)
+        self.serializer = SERIALIZERS[serializer]()
+        self.compression = compression
+        self._db = None
+
+    @classmethod
+    def _cfg_options(cls, cfg):
+        options = super()._cfg_options(cfg)
+        serializer = cfg.get('serializer', fallback='pretty')
+        if serializer not in SERIALIZERS:
+            raise DatabaseCfgError(
+                f'Unknown database serializer {serializer!r}. '
+                f'Choose one of: {", ".join(sorted(SERIALIZERS))}.'
+            )
+        options['serializer'] = serializer
+
+        compression = cfg.get('compression', fallback='none')
+        if compression != 'none' and compression not in COMPRESSIONS:
+            raise DatabaseCfgError(
+                f'Unknown database compression {compression!r}. '
+                f'Choose one of: none, {", ".join(sorted(COMPRESSIONS))}.'
+            )
+        options['compression'] = None if compression == 'none' else compression
+
+        return options
+
+    @classmethod
+    def _extension(cls, options):
+        return SERIALIZERS[options.get('serializer', 'pretty')].extension
+
+    def load(self):
+        if self._db is None:
+            if self.exists():
+                with open_file(self.path, 'r' + self.serializer.mode) as f:
+                    self._db = self.serializer.load(f)
+            else:
+                self._db = {}
+        return self._db
+
+    def _invalidate(self):
+        super()._invalidate()
+        self._db = None
+
+    def _write(self, db):
+        # readers never see a partly written file
+        _write_atomic(
+            self.path,
+            self.serializer.mode,
+            lambda f: self.serializer.dump(db, f),
+            self.compression,
+        )
+
+    def _add(self, posts):
+        db = self.load()
+        db.update(posts)
+        self._write(db)
+
+    def _remove(self, keys):
+        db = self.load()
+        for k in keys:
+            db.pop(k, None)
+        self._write(db)
+
+
+def _older_than(db, timestamp):
+    """Return a dictionary of the posting times of postings in `db` older than `timestamp`."""
+    old = {}
+    for k, p in db.items():
+        created = _timestamp(p['date_created']) if p else None
+        if created is not None and created < timestamp:
+            old[k] = created
+    return old
+
+
+def _timestamp(date_created):
+    """Return `date_created` in seconds since the epoch, or None."""
+    try:
+        return parsedate_to_datetime(date_created).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class SQLiteStorage(Storage):
+    """Database kept in an SQLite file.
+
+    Postings are stored one per row with the jobkey as the primary
+    key, so adding postings only writes the new rows. The posting date
+    (as a timestamp) and company are indexed.
+    """
+    extension = '.sqlite3'
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS postings (
+            jobkey TEXT PRIMARY KEY,
+            jobtitle TEXT,
+            company TEXT,
+            date_created TEXT,
+            created REAL,
+            location TEXT,
+            url TEXT,
+            lat REAL,
+            lon REAL,
+            desc TEXT
+        );
+        CREATE INDEX IF NOT EXISTS postings_created ON postings (created);
+        CREATE INDEX IF NOT EXISTS postings_company ON postings (company);
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        self._conn = None
+
+    @property
+    def conn(self):
+        """Connection to the database, opened on first use."""
+        if self._conn is None:
+            # a run may use the database from more than one executor
+            # thread, but never from two threads at once
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(self._schema)
+        return self._conn
+
+    def load(self):
+        columns = ', '.join(FIELDS)
+        rows = self.conn.execute(f'SELECT jobkey, {columns} FROM postings')
+        return {row[0]: Posting(*row[1:]) for row in rows}
+
+    def keys(self):
+        return {row[0] for row in self.conn.execute('SELECT jobkey FROM postings')}
+
+    def get(self, jobkey, default=None):
+        columns = ', '.join(FIELDS)
+        row = self.conn.execute(
+            f'SELECT {columns} FROM postings WHERE jobkey = ?', (jobkey,)
+        ).fetchone()
+        return default if row is None else Posting(*row)
+
+    def _add(self, posts):
+        rows = (
+            (
+                k, p['jobtitle'], p['company'], p['date_created'], _timestamp(p['date_created']),
+                p['location'], p['url'], p['lat'], p['lon'], p['desc'],
+            )
+            for k, p in posts.items()
+        )
+        # all postings are inserted in a single transaction
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO postings '
+                '(jobkey, jobtitle, company, date_created, created, location, url, lat, lon, desc) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows,
+            )
+
+    def _older_than(self, timestamp, added=None):
+        rows = self.conn.execute('SELECT jobkey, created FROM postings WHERE created < ?', (timestamp,))
+        return dict(rows)
+
+    def _remove(self, keys):
+        with self.conn:
+            self.conn.executemany('DELETE FROM postings WHERE jobkey = ?', ((k,) for k in keys))
+        # return the free pages to the file system
+        self.conn.execute('VACUUM')
+
+    def close(self):
+        super().close()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class JSONLStorage(Storage):
+    """Append-only database kept as one JSON object per line.
+
+    Each call to `add` appends a line per new posting, so the cost of a
+    write depends only on the number of new postings. When a posting is
+    stored more than once the last line wins. Once the number of stale
+    lines (superseded or unreadable) reaches `compact_threshold`, the
+    file is compacted in a background thread, which rewrites it with a
+    single line per posting.
+
+    Args:
+        path: path to the database.
+        compact_threshold: number of stale lines which triggers compaction.
+    """
+    extension = '.jsonl'
+
+    def __init__(self, path, compact_threshold=1000, **kwargs):
+        super().__init__(path, **kwargs)
+        self.compact_threshold = compact_threshold
+        self.stale = 0
+        self._lock = threading.Lock()
+        self._compactor = None
+
+    @classmethod
+    def _cfg_options(cls, cfg):
+        options = super()._cfg_options(cfg)
+        options['compact_threshold'] = cfg.getint('compact_threshold', fallback=1000)
+        return options
+
+    def _iter_records(self):
+        """Yield `(jobkey, record)` pairs from the log, one line at a time."""
+        if not self.exists():
+            return
+
+        with open(self.path, 'rb') as f:
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    jobkey = record.pop('jobkey')
+                except (ValueError, KeyError, AttributeError):
+                    # most likely a write cut short by a crash
+                    logging.warning('Skip unreadable line %d of %r', n, self.path)
+                    yield None, None
+                    continue
+                yield jobkey, record
+
+    def _read(self):
+        """Return the latest record for each jobkey, and count stale lines."""
+        db = {}
+        lines = 0
+        for jobkey, record in self._iter_records():
+            lines += 1
+            if jobkey is not None:
+                db[jobkey] = record
+        self.stale = lines - len(db)
+        return db
+
+    def load(self):
+        return {k: Posting.from_dict(v) for k, v in self._read().items()}
+
+    def keys(self):
+        return set(self._read())
+
+    def get(self, jobkey, default=None):
+        # scan the log without keeping it, the last line for `jobkey` wins
+        found = None
+        for k, record in self._iter_records():
+            if k == jobkey:
+                found = record
+        return default if found is None else Posting.from_dict(found)
+
+    def _add(self, posts):
+        if not posts:
+            return
+
+        data = ''.join(
+            json.dumps({'jobkey': k, **p}, separators=(',', ':')) + '\n'
+            for k, p in posts.items()
+        ).encode('utf-8')
+
+        with self._lock:
+            with open(self.path, 'a+b') as f:
+                # make sure a line cut short earlier is not continued
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        data = b'\n' + data
+                        self.stale += 1
+                f.write(data)
+
+        if self.stale >= self.compact_threshold:
+            self.compact_in_background()
+
+    def _remove(self, keys):
+        self.compact(exclude=keys)
+
+    def compact(self, exclude=()):
+        """Rewrite the log with a single line per posting.
+
+        Args:
+            exclude: jobkeys of postings to leave out.
+        """
+        with self.lock, self._lock:
+            db = self._read()
+            stale = self.stale
+            for k in exclude:
+                db.pop(k, None)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for k in sorted(db):
+                    f.write(json.dumps({'jobkey': k, **db[k]}, separators=(',', ':')) + '\n')
+            os.replace(tmp_path, self.path)
+            self.stale = 0
+
+        logging.info('Compacted %r: removed %d stale lines', self.path, stale)
+
+    def compact_in_background(self):
+        """Start compacting the log in a background thread."""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self.compact, name='jsonl-compactor')
+        self._compactor.start()
+
+    def close(self):
+        """Wait for any background compaction to finish."""
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
+        super().close()
+
+
+class Database:
+    """Lazily loaded view of a database.
+
+    Opening a `Database` reads nothing. Membership tests use the
+    jobkey index of the database, `get` reads only what the storage
+    backend needs to find a single posting, and `update` adds new
+    postings to the database without reading the postings already
+    stored. The cost of a run which finds no new postings therefore
+    does not grow with the size of the database.
+
+    Jobkeys which are tombstoned (see `Storage.prune`) are reported
+    as present, but `get` finds no posting for them.
+
+    Args:
+        storage: `Storage` object holding the postings.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+
+    @property
+    def index(self):
+        """`JobkeyIndex` of the database, opened on first use."""
+        return self.storage.index()
+
+    def __contains__(self, jobkey):
+        return jobkey in self.index
+
+    def get(self, jobkey, default=None):
+        """Return the posting stored for `jobkey`, or `default`."""
+        if jobkey not in self.index:
+            return default
+        return self.storage.get(jobkey, default)
+
+    def __getitem__(self, jobkey):
+        posting = self.get(jobkey)
+        if posting is None:
+            raise KeyError(jobkey)
+        return posting
+
+    def update(self, posts):
+        """Add the new postings in `posts`, a dictionary keyed by jobkey."""
+        if posts:
+            self.storage.add(posts)
+
+    def close(self):
+        """Close the underlying storage."""
+        self.storage.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f'Database({self.storage!r})'
+
+
+def tombstones_path(path_to_db):
+    """Return the path of the tombstones file kept beside `path_to_db`."""
+    return f'{os.path.splitext(path_to_db)[0]}.tombstones.json'
+
+
+class Tombstones:
+    """Jobkeys of pruned postings, each with a time at which it expires.
+
+    Args:
+        path: path to the tombstones file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._expires = None
+
+    @property
+    def expires(self):
+        """Dictionary of expiry times keyed by jobkey, loaded on first use."""
+        if self._expires is None:
+            if os.path.isfile(self.path):
+                with open(self.path, 'r') as f:
+                    self._expires = json.load(f)
+            else:
+                self._expires = {}
+        return self._expires
+
+    def keys(self):
+        """Return the set of tombstoned jobkeys."""
+        return set(self.expires)
+
+    def add(self, items):
+        """Add `(jobkey, expiry time)` pairs."""
+        self.expires.update(items)
+
+    def expire(self, now):
+        """Remove tombstones which expire before `now`.
+
+        Returns:
+            number of tombstones removed.
+        """
+        expired = [k for k, t in self.expires.items() if t < now]
+        for k in expired:
+            del self.expires[k]
+        return len(expired)
+
+    def save(self):
+        """Write the tombstones to file."""
+        # a truncated file would break every later `add` and `index`
+        _write_atomic(
+            self.path,
+            't',
+            lambda f: json.dump(self.expires, f, separators=(',', ':'), sort_keys=True),
+        )
+
+    def __len__(self):
+        return len(self.expires)
+
+
+def search_matches_path(path_to_db):
+    """Return the path of the search matches database kept beside `path_to_db`."""
+    return f'{os.path.splitext(path_to_db)[0]}.matches.sqlite'
+
+
+class SearchMatches:
+    """Record of which searches matched each posting in a shared database.
+
+    Matches are kept in an SQLite database, one row per jobkey and
+    search, so a run only reads and writes the rows of the postings it
+    found, and the rows of pruned postings can be deleted. A
+    `.matches.json` file written by earlier versions is imported, then
+    removed, when the record is opened.
+
+    Changes are only written by `save`.
+
+    Args:
+        path: path to the search matches database.
+    """
+    def __init__(self, path):
+        self.path = path
+        # the record may be used from the executor and the event loop
+        # thread, but never from two threads at once
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS matches ('
+            'jobkey TEXT NOT NULL, search TEXT NOT NULL, UNIQUE (jobkey, search))'
+        )
+        self.conn.commit()
+        self._changed = False
+
+        legacy_path = f'{os.path.splitext(path)[0]}.json'
+        if os.path.isfile(legacy_path):
+            with open(legacy_path, 'r') as f:
+                data = json.load(f)
+            searches = data['searches']
+            for k, ids in data['matches'].items():
+                for i in ids:
+                    self.add(searches[i], [k])
+            self.save()
+            os.remove(legacy_path)
+
+    def add(self, search, jobkeys):
+        """Record that `search` matched each of `jobkeys`.
+
+        Returns:
+            number of matches which were not already recorded.
+        """
+        cur = self.conn.executemany(
+            'INSERT OR IGNORE INTO matches (jobkey, search) VALUES (?, ?)',
+            ((k, search) for k in jobkeys),
+        )
+        if cur.rowcount > 0:
+            self._changed = True
+        return max(cur.rowcount, 0)
+
+    def remove(self, jobkeys):
+        """Forget the matches of `jobkeys`, e.g., once they are pruned."""
+        cur = self.conn.executemany('DELETE FROM matches WHERE jobkey = ?', ((k,) for k in jobkeys))
+        if cur.rowcount > 0:
+            self._changed = True
+
+    def __getitem__(self, jobkey):
+        """Return the names of the searches which matched `jobkey`, in the order they matched."""
+        rows = self.conn.execute(
+            'SELECT search FROM matches WHERE jobkey = ? ORDER BY rowid', (jobkey,)
+        ).fetchall()
+        if not rows:
+            raise KeyError(jobkey)
+        return [search for search, in rows]
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(DISTINCT jobkey) FROM matches').fetchone()[0]
+
+    def save(self):
+        """Write any changes to the search matches."""
+        if self._changed:
+            self.conn.commit()
+            self._changed = False
+        else:
+            self.conn.rollback()
+
+    def close(self):
+        """Discard unsaved changes and close the database."""
+        self.conn.rollback()
+        self.conn.close()
+
+
+class ShardedStorage(Storage):
+    """Database split across shard files by a hash of the jobkey.
+
+    The database is a directory holding `shards` files, each in the
+    format of `serializer`, and a manifest recording the layout.
+    Adding postings only rewrites the shards they belong to, so the
+    amount written depends on the size of the history divided by
+    the number of shards. The layout in an existing manifest takes
+    precedence over the arguments; use `reshard` to change it.
+
+    Args:
+        path: path to the database directory.
+        shards: number of shard files.
+        serializer: name of the file format, a key of `SERIALIZERS`.
+        compression: name of the compression used when writing shards,
+            a key of `COMPRESSIONS`, or None.
+    """
+    extension = '.shards'
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, path, shards=16, serializer='pretty', compression=None, **kwargs):
+        super().__init__(path, **kwargs)
+        self.compression = compression
+        manifest = self._read_manifest()
+        if manifest is not None:
+            if manifest['shards'] != shards or manifest['serializer'] != serializer:
+                logging.info('Using layout of existing database %r: %r', path, manifest)
+            shards, serializer = manifest['shards'], manifest['serializer']
+        self.shards = shards
+        self.serializer_name = serializer
+        self.serializer = SERIALIZERS[serializer]()
+        self._cache = {}
+
+    @classmethod
+    def _cfg_options(cls, cfg):
+        options = JSONStorage._cfg_options(cfg)
+        options['shards'] = cfg.getint('shards', fallback=16)
+        return options
+
+    def _read_manifest(self):
+        path = os.path.join(self.path, self.MANIFEST)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _write_manifest(self):
+        manifest = {
+            'version': 1,
+            'shards': self.shards,
+            'serializer': self.serializer_name,
+        }
+        _write_atomic(
+            os.path.join(self.path, self.MANIFEST),
+            't',
+            lambda f: json.dump(manifest, f, indent=2, sort_keys=True),
+        )
+
+    def shard(self, jobkey):
+        """Return the number of the shard which holds `jobkey`."""
+        return zlib.crc32(jobkey.encode('utf-8')) % self.shards
+
+    def shard_path(self, i):
+        """Return the path of shard `i`."""
+        return os.path.join(self.path, f'{i:04d}{self.serializer.extension}')
+
+    def _load_shard(self, i):
+        if i not in self._cache:
+            path = self.shard_path(i)
+            if os.path.isfile(path):
+                with open_file(path, 'r' + self.serializer.mode) as f:
+                    self._cache[i] = self.serializer.load(f)
+            else:
+                self._cache[i] = {}
+        return self._cache[i]
+
+    def _write_shard(self, i):
+        _write_atomic(
+            self.shard_path(i),
+            self.serializer.mode,
+            lambda f: self.serializer.dump(self._cache[i], f),
+            self.compression,
+        )
+
+    def load(self):
+        db = {}
+        for i in range(self.shards):
+            db.update(self._load_shard(i))
+        return db
+
+    def get(self, jobkey, default=None):
+        # only the shard which would hold `jobkey` is read
+        return self._load_shard(self.shard(jobkey)).get(jobkey, default)
+
+    def _invalidate(self):
+        super()._invalidate()
+        self._cache.clear()
+
+    def _group(self, keys):
+        """Return a dictionary of the shard of each of `keys`, keyed by shard."""
+        groups = {}
+        for k in keys:
+            groups.setdefault(self.shard(k), []).append(k)
+        return groups
+
+    def _add(self, posts):
+        if not posts:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        for i, keys in self._group(posts).items():
+            shard = self._load_shard(i)
+            shard.update((k, posts[k]) for k in keys)
+            self._write_shard(i)
+
+        # the manifest is written last, which also marks the database
+        # as changed for the jobkey index
+        self._write_manifest()
+
+    def _older_than(self, timestamp, added=None):
+        # after adding postings only the shards which were written are
+        # pruned, so that writes stay proportional to a shard; other
+        # shards are pruned when they are next written, or by `prune`
+        shards = range(self.shards) if added is None else self._group(added)
+
+        old = {}
+        for i in shards:
+            shard_old = _older_than(self._load_shard(i), timestamp)
+            if shard_old:
+                old.update(shard_old)
+            elif added is None:
+                # only shards with postings to remove are kept in memory
+                del self._cache[i]
+        return old
+
+    def _size(self):
+        if not os.path.isdir(self.path):
+            return 0
+        return sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file())
+
+    def _remove(self, keys):
+        for i, group in self._group(keys).items():
+            shard = self._load_shard(i)
+            for k in group:
+                shard.pop(k, None)
+            self._write_shard(i)
+
+        self._write_manifest()
+
+
+def reshard(path, shards, serializer=None, compression=None):
+    """Rewrite the sharded database at `path` with a new layout.
+
+    The new layout is written to a temporary directory, which then
+    replaces the database.
+
+    Args:
+        path: path to the database directory.
+        shards: new number of shard files.
+        serializer: name of the new file format, or None to keep the
+            current format.
+        compression: name of the compression used for the new shards,
+            or None.
+
+    Returns:
+        number of postings rewritten.
+    """
+    old = ShardedStorage(path)
+    with old.lock:
+        db = old.load()
+        serializer = serializer or old.serializer_name
+
+        tmp_path = f'{path}.tmp'
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+
+        new = ShardedStorage(tmp_path, shards=shards, serializer=serializer, compression=compression)
+        # the new layout is written under the lock of the database it replaces
+        new.lock = old.lock
+        os.makedirs(tmp_path)
+        new.add(db)
+        new._write_manifest()
+
+        old_path = f'{path}.old'
+        os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path)
+
+    old.close()
+
+    logging.info('Resharded %r into %d shards (%s)', path, shards, serializer)
+
+    return len(db)
+
+
+STORAGE_BACKENDS = {
+    'json': JSONStorage,
+    'jsonl': JSONLStorage,
+    'sharded': ShardedStorage,
+    'sqlite': SQLiteStorage,
+}
+
+
+def migrate(source, destination):
+    """Copy every posting from the `source` storage to `destination`.
+
+    Returns:
+        number of postings copied.
+    """
+    db = source.load()
+    if db:
+        destination.add(db)
+    return len(db)
+
+
+def storage_for(database_dir, name, backend='json', cfg=None):
+    """Return the `Storage` of the database `name` in `database_dir`.
+
+    Nothing is read or written; see `open_storage`.
+
+    Raises:
+        DatabaseCfgError: if `backend` is not a known storage backend.
+    """
+    try:
+        cls = STORAGE_BACKENDS[backend]
+    except KeyError:
+        raise DatabaseCfgError(
+            f'Unknown database backend {backend!r}. '
+            f'Choose one of: {", ".join(sorted(STORAGE_BACKENDS))}.'
+        ) from None
+
+    options = {} if cfg is None else cls._cfg_options(cfg)
+    path = os.path.join(database_dir, f'{name}{cls._extension(options)}')
+    return cls(path, **options)
+
+
+def migrate_legacy(storage, database_dir, name):
+    """Migrate the JSON database `name` to `storage` if it has not been created yet.
+
+    Call while holding the lock of `storage`. If the migration fails,
+    the partial database is removed and `storage` is closed.
+    """
+    legacy = JSONStorage(os.path.join(database_dir, f'{name}{JSONStorage.extension}'))
+    if storage.path == legacy.path or storage.exists() or not legacy.exists():
+        return
+
+    try:
+        n = migrate(legacy, storage)
+    except BaseException:
+        # do not leave a partial database behind, so that the
+        # migration is attempted again next time
+        if storage.exists():
+            os.remove(storage.path)
+        storage.close()
+        raise
+    logging.info('Migrated %d postings from %r to %r', n, legacy.path, storage.path)
+
+
+def open_storage(database_dir, name, backend='json', cfg=None):
+    """Open the database `name` in `database_dir`.
+
+    If the database does not exist yet, but a JSON database of the
+    same name does, the postings in the JSON database are migrated
+    to the new database.
+
+    Args:
+        database_dir: directory containing the databases.
+        name: name of the database, without a file extension.
+        backend: name of the storage backend, a key of `STORAGE_BACKENDS`.
+        cfg: `database` section of the configuration file, used to
+            configure the backend.
+
+    Raises:
+        DatabaseCfgError: if `backend` is not a known storage backend.
+
+    Returns:
+        a `Storage` object.
+    """
+    storage = storage_for(database_dir, name, backend, cfg)
+
+    storage.lock.acquire()
+    try:
+        migrate_legacy(storage, database_dir, name)
+    finally:
+        # closing the storage after a failed migration releases the lock
+        if storage.lock.locked:
+            storage.lock.release()
+
+    return storage
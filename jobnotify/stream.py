@@ -0,0 +1,132 @@
+import codecs
+import json
+import re
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DELIMITERS = frozenset(',}] \t\n\r')
+_decoder = json.JSONDecoder()
+
+
+class _Buffer:
+    """Decoded text read incrementally from a binary file object."""
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read another chunk into the buffer.
+
+        Text before the current position is discarded, so the buffer
+        never holds much more than the value being decoded.
+
+        Returns:
+            False if the end of the file has been reached.
+        """
+        if self.eof:
+            return False
+
+        data = self.fp.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            self.text += self.decoder.decode(b'', final=True)
+            return False
+
+        self.text = self.text[self.pos:] + self.decoder.decode(data)
+        self.pos = 0
+
+        return True
+
+    def error(self, msg):
+        return json.JSONDecodeError(msg, self.text, self.pos)
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                raise self.error('Unexpected end of data')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise self.error(f'Expecting {char!r}')
+        self.pos += 1
+
+    def value(self):
+        """Decode and return the next complete JSON value."""
+        self.peek()
+
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+
+            # a number may continue in the next chunk, e.g., `1.` may be
+            # the start of `1.5e10`, so only accept a number which is
+            # followed by a delimiter
+            if end < len(self.text) and (
+                    self.text[self.pos] in '"[{' or self.text[end] in _DELIMITERS):
+                self.pos = end
+                return value
+            if not self.fill():
+                self.pos = end
+                return value
+
+
+def iter_json_object(fp, stream_key, chunk_size=16384):
+    """Incrementally decode the JSON object read from `fp`.
+
+    The members of the top-level object are yielded as `(key, value)`
+    pairs as soon as they have been read. The elements of the array
+    member `stream_key` are yielded one at a time as
+    `(stream_key, element)` pairs, so that the array is never held
+    in memory as a whole. Reading stops at the end of the object.
+
+    Args:
+        fp: binary file-like object containing UTF-8 encoded JSON.
+        stream_key: name of the array member to stream.
+        chunk_size: number of bytes to read at a time.
+
+    Returns:
+        generator of `(key, value)` pairs.
+
+    Raises:
+        json.decoder.JSONDecodeError: if the document is malformed.
+    """
+    buf = _Buffer(fp, chunk_size)
+
+    buf.expect('{')
+    if buf.peek() == '}':
+        return
+
+    while True:
+        if buf.peek() != '"':
+            raise buf.error('Expecting property name enclosed in double quotes')
+        key = buf.value()
+        buf.expect(':')
+
+        if key == stream_key and buf.peek() == '[':
+            buf.pos += 1
+            if buf.peek() == ']':
+                buf.pos += 1
+            else:
+                while True:
+                    yield key, buf.value()
+                    if buf.peek() == ']':
+                        buf.pos += 1
+                        break
+                    buf.expect(',')
+        else:
+            yield key, buf.value()
+
+        if buf.peek() == '}':
+            return
+        buf.expect(',')
@@ -3,16 +3,19 @@ import base64
 import configparser
 import json
 import logging
+import math
 import os
 from pkg_resources import resource_filename
 import shutil
 
+from .compression import open_file
 from .exceptions import (
     BlankKeyError,
     NotificationsNotConfiguredError,
     RequiredKeyMissingError,
     SectionNotFoundError,
 )
+from .serializers import PrettyJSONSerializer
 
 
 class EmailMatch:
@@ -50,11 +53,31 @@ def get_sanitised_params(q, l):
     return query, loc
 
 
+def get_searches(indeed_cfg):
+    """Return the searches configured in the `indeed` section.
+
+    The `query` and `location` keys may each hold several values, one
+    per line, in which case every query is searched in every location.
+
+    Args:
+        indeed_cfg: `indeed` section from configuration file.
+
+    Returns:
+        list of `(query, location)` tuples.
+    """
+    queries = [q.strip() for q in indeed_cfg['query'].splitlines() if q.strip()]
+    locations = [l.strip() for l in indeed_cfg['location'].splitlines() if l.strip()]
+
+    # a search listed twice is only run once
+    return list(dict.fromkeys((q, l) for q in queries for l in locations))
+
+
 def load_json_db(path_to_db):
     """Load and return a JSON database.
 
     Return a JSON database if it exists, otherwise return
-    an empty dict.
+    an empty dict. Postings are decoded as `Posting` objects.
+    Compressed databases are detected and decompressed.
 
     Args:
         path_to_db: path to the database.
@@ -66,8 +89,8 @@ def load_json_db(path_to_db):
     if not os.path.isfile(path_to_db):
         db = {}
     else:
-        with open(path_to_db, 'r') as f:
-            db = json.load(f)
+        with open_file(path_to_db, 'rt') as f:
+            db = PrettyJSONSerializer().load(f)
 
     return db
 
@@ -119,6 +142,26 @@ def load_cfg(fname, section, required):
     return cfg_section
 
 
+def load_optional_cfg(fname, section):
+    """Load an optional `section` from configuration file.
+
+    Args:
+        fname: configuration filename
+        section: the section from the configuration file to return
+
+    Returns:
+        dict-like section from configuration file, which is empty
+        if `section` is missing from the file.
+    """
+    cfg = configparser.ConfigParser()
+    cfg.read(fname)
+
+    if not cfg.has_section(section):
+        cfg.add_section(section)
+
+    return cfg[section]
+
+
 def get_section_configs(filename):
     """Returns sections from configuration file.
 
@@ -177,7 +220,69 @@ def get_section_configs(filename):
 def write_json_db(db, path_to_db):
     """Write `db` to file."""
     with open(path_to_db, 'w') as f:
-        json.dump(db, f, indent=2, sort_keys=True)
+        PrettyJSONSerializer().dump(db, f)
+
+
+def get_fromage(last_success, now, max_fromage=10, margin=1.0):
+    """Return the number of days back to search.
+
+    The window covers the time since the last successful run plus
+    a safety `margin`, rounded up to whole days, and is capped at
+    `max_fromage`.
+
+    Args:
+        last_success: time of the last successful run (seconds since
+            the epoch), or None if there has not been one.
+        now: current time (seconds since the epoch).
+        max_fromage: largest window to return, in days.
+        margin: safety margin added to the window, in days.
+
+    Returns:
+        number of days back to search, between 1 and `max_fromage`.
+    """
+    if last_success is None:
+        return max_fromage
+
+    days = math.ceil((now - last_success) / 86400 + margin)
+
+    return max(1, min(max_fromage, days))
+
+
+def run_metadata_path(path_to_db):
+    """Return the path of the run metadata file kept beside `path_to_db`."""
+    return f'{os.path.splitext(path_to_db)[0]}.meta.json'
+
+
+def load_run_metadata(path_to_db):
+    """Load metadata about previous runs against a database.
+
+    Args:
+        path_to_db: path to the database the metadata belongs to.
+
+    Returns:
+        meta: dictionary of run metadata, or empty dict
+    """
+    path = run_metadata_path(path_to_db)
+
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_run_metadata(meta, path_to_db):
+    """Write run metadata for the database at `path_to_db`.
+
+    The metadata is written to a temporary file which then replaces
+    the previous metadata, so an interrupted write never leaves a
+    truncated file behind.
+    """
+    path = run_metadata_path(path_to_db)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
 
 
 def initial_setup(app_data_dir):
@@ -240,5 +345,26 @@ def process_args(
         help='path to configuration file',
         default=path_to_cfg,
     )
+    parser.add_argument(
+        '--reshard',
+        help='rewrite every sharded database with this number of shards, then exit',
+        type=int,
+        metavar='N',
+    )
+    parser.add_argument(
+        '--deliver',
+        help='deliver notifications queued in the outbox, without searching, then exit',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--drain',
+        help='with --deliver, keep retrying until no notifications are pending',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--no-cache',
+        help='do not serve API responses from the response cache',
+        action='store_true',
+    )
 
     return parser.parse_args(args)
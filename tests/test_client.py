@@ -0,0 +1,288 @@
+import gzip
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+from socketserver import ThreadingMixIn
+from tempfile import TemporaryDirectory
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+import urllib.error
+import zlib
+
+from jobnotify.client import (
+    ConnectionPool,
+    HTTPClient,
+    ResponseCache,
+    RetryPolicy,
+    TokenBucket,
+)
+from jobnotify.exceptions import IndeedRequestError, RequestBudgetExceededError
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """Request handler which supports persistent connections."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.startswith('/missing'):
+            self.send_error(404)
+            return
+
+        body = self.path.encode('utf-8')
+        encoding = None
+        accept_encoding = self.headers.get('Accept-Encoding', '')
+
+        if self.path.startswith('/compressed'):
+            body *= 100
+            if 'gzip' in accept_encoding:
+                body, encoding = gzip.compress(body), 'gzip'
+        elif self.path.startswith('/deflate') and 'deflate' in accept_encoding:
+            compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            body = compressor.compress(body * 100) + compressor.flush()
+            encoding = 'deflate'
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    """Test case for the keep-alive connection pool."""
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    def test_connection_reused(self):
+        """Test that sequential requests share a single connection."""
+        pool = ConnectionPool(maxsize=2, idle_timeout=30)
+        client = HTTPClient(pool)
+
+        for i in range(3):
+            with client.open(f'{self.base_url}/page?start={i}') as u:
+                self.assertEqual(f'/page?start={i}'.encode('utf-8'), u.read())
+
+        pool.close()
+        self.assertEqual({'created': 1, 'reused': 2, 'discarded': 0}, pool.stats)
+
+    def test_idle_connection_discarded(self):
+        """Test that connections idle for longer than the timeout are closed."""
+        pool = ConnectionPool(maxsize=2, idle_timeout=0)
+
+        for _ in range(2):
+            with pool.request(f'{self.base_url}/page') as u:
+                u.read()
+
+        pool.close()
+        self.assertEqual({'created': 2, 'reused': 0, 'discarded': 1}, pool.stats)
+
+    def test_http_error(self):
+        """Test that we raise for an error status."""
+        pool = ConnectionPool()
+        with self.assertRaises(urllib.error.HTTPError):
+            pool.request(f'{self.base_url}/missing')
+        pool.close()
+
+    def test_gzip_response(self):
+        """Test that a gzip response is decompressed as it is read."""
+        pool = ConnectionPool()
+
+        for client in (HTTPClient(), HTTPClient(pool), HTTPClient(pool)):
+            with client.open(f'{self.base_url}/compressed') as u:
+                chunks = iter(lambda: u.read(64), b'')
+                self.assertEqual(b'/compressed' * 100, b''.join(chunks))
+
+        pool.close()
+        # the compressed body was read to the end, so the connection was reused
+        self.assertEqual(1, pool.stats['reused'])
+
+    def test_raw_deflate_response(self):
+        """Test that a raw deflate response is decompressed."""
+        with HTTPClient().open(f'{self.base_url}/deflate') as u:
+            self.assertEqual(b'/deflate' * 100, u.read())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    """Test case for the on-disk response cache."""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.url = 'http://api.indeed.com/ads/apisearch?publisher=4815162342&q=scientist&start=0'
+
+    def test_round_trip(self):
+        """Test that a stored response is served back."""
+        cache = ResponseCache(self.tmpdir.name, ttl=60)
+        self.assertIsNone(cache.get(self.url))
+        cache.put(self.url, b'{"results": []}')
+        self.assertEqual(b'{"results": []}', cache.get(self.url))
+        self.assertEqual({'hits': 1, 'misses': 1, 'evictions': 0}, cache.stats)
+
+    def test_key_ignores_publisher_and_order(self):
+        """Test that the publisher key and parameter order do not affect the key."""
+        cache = ResponseCache(self.tmpdir.name)
+        other_url = 'http://api.indeed.com/ads/apisearch?start=0&q=scientist&publisher=42'
+        self.assertEqual(cache.key(self.url), cache.key(other_url))
+
+    def test_expired_response(self):
+        """Test that we do not serve responses older than the TTL."""
+        cache = ResponseCache(self.tmpdir.name, ttl=60)
+        cache.put(self.url, b'{}')
+        path = os.path.join(self.tmpdir.name, cache.key(self.url))
+        stale = time.time() - 120
+        os.utime(path, (stale, stale))
+        self.assertIsNone(cache.get(self.url))
+
+    def test_lru_eviction(self):
+        """Test that the least recently used response is evicted."""
+        cache = ResponseCache(self.tmpdir.name, ttl=60, max_entries=2)
+        urls = [f'{self.url}&page={i}' for i in range(3)]
+        cache.put(urls[0], b'0')
+        cache.put(urls[1], b'1')
+        # make the second response the least recently used
+        path = os.path.join(self.tmpdir.name, cache.key(urls[1]))
+        st = os.stat(path)
+        os.utime(path, (st.st_atime - 10, st.st_mtime))
+        cache.get(urls[0])
+        cache.put(urls[2], b'2')
+
+        self.assertEqual(b'0', cache.get(urls[0]))
+        self.assertIsNone(cache.get(urls[1]))
+        self.assertEqual(1, cache.stats['evictions'])
+
+    @patch('urllib.request.urlopen')
+    def test_client_serves_from_cache(self, mock_urlopen):
+        """Test that the client only goes to the network on a miss."""
+        instance = mock_urlopen.return_value.__enter__.return_value
+        instance.read.return_value = b'{"results": []}'
+        client = HTTPClient(cache=ResponseCache(self.tmpdir.name, ttl=60))
+
+        for _ in range(2):
+            with client.open(self.url) as u:
+                self.assertEqual(b'{"results": []}', u.read())
+
+        self.assertEqual(1, mock_urlopen.call_count)
+
+    @patch('urllib.request.urlopen')
+    def test_client_does_not_cache_rejected_response(self, mock_urlopen):
+        """Test that a response rejected inside the `with` block is not cached."""
+        instance = mock_urlopen.return_value.__enter__.return_value
+        instance.read.return_value = b'{"error": "Invalid publisher number provided."}'
+        cache = ResponseCache(self.tmpdir.name, ttl=60)
+        client = HTTPClient(cache=cache)
+
+        with self.assertRaises(ValueError):
+            with client.open(self.url) as u:
+                u.read()
+                raise ValueError
+
+        self.assertIsNone(cache.get(self.url))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class RetryTestCase(unittest.TestCase):
+    """Test case for retrying failed requests."""
+    def setUp(self):
+        self.url = 'http://api.indeed.com/ads/apisearch?q=scientist'
+        self.ok = MagicMock()
+        self.ok.headers = {}
+
+    def http_error(self, code, headers=None):
+        return urllib.error.HTTPError(self.url, code, 'error', headers or {}, None)
+
+    @patch('time.sleep')
+    @patch('urllib.request.urlopen')
+    def test_retry_transient_error(self, mock_urlopen, mock_sleep):
+        """Test that we retry after a transient error."""
+        mock_urlopen.side_effect = [self.http_error(503), self.ok]
+        client = HTTPClient(retry=RetryPolicy(max_retries=2, backoff=0))
+        self.assertIs(self.ok, client.open(self.url))
+        self.assertEqual({'requests': 2, 'retried': 1}, client.stats)
+
+    @patch('time.sleep')
+    @patch('urllib.request.urlopen')
+    def test_retry_after_header(self, mock_urlopen, mock_sleep):
+        """Test that we wait as long as the `Retry-After` header asks."""
+        mock_urlopen.side_effect = [self.http_error(429, {'Retry-After': '7'}), self.ok]
+        HTTPClient().open(self.url)
+        mock_sleep.assert_called_once_with(7.0)
+
+    @patch('time.sleep')
+    @patch('urllib.request.urlopen')
+    def test_retries_exhausted(self, mock_urlopen, mock_sleep):
+        """Test that we raise once all retries have failed."""
+        mock_urlopen.side_effect = urllib.error.URLError('connection refused')
+        client = HTTPClient(retry=RetryPolicy(max_retries=2, backoff=0))
+        with self.assertRaises(IndeedRequestError):
+            client.open(self.url)
+        self.assertEqual(3, mock_urlopen.call_count)
+
+    @patch('urllib.request.urlopen')
+    def test_no_retry_for_client_error(self, mock_urlopen):
+        """Test that we do not retry a request which can never succeed."""
+        mock_urlopen.side_effect = self.http_error(400)
+        with self.assertRaises(urllib.error.HTTPError):
+            HTTPClient().open(self.url)
+        self.assertEqual(1, mock_urlopen.call_count)
+
+    @patch('urllib.request.urlopen')
+    def test_request_budget(self, mock_urlopen):
+        """Test that we stop once the request budget is spent."""
+        mock_urlopen.return_value = self.ok
+        client = HTTPClient(budget=2)
+        client.open(self.url)
+        client.open(self.url)
+        with self.assertRaises(RequestBudgetExceededError):
+            client.open(self.url)
+
+    def test_backoff_bounds(self):
+        """Test that the jittered delay is bounded by the backoff."""
+        policy = RetryPolicy(backoff=1.0, max_backoff=5.0)
+        for attempt in range(6):
+            self.assertLessEqual(policy.delay(attempt), min(5.0, 2 ** attempt))
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    """Test case for the token bucket rate limiter."""
+    @patch('time.sleep')
+    def test_throttled_once_empty(self, mock_sleep):
+        """Test that we wait once the burst capacity is used up."""
+        bucket = TokenBucket(rate=2, capacity=2)
+        for _ in range(3):
+            bucket.acquire()
+
+        self.assertEqual({'acquired': 3, 'throttled': 1}, bucket.stats)
+        wait, = mock_sleep.call_args[0]
+        self.assertAlmostEqual(0.5, wait, places=1)
+
+    @patch('time.sleep')
+    def test_block(self, mock_sleep):
+        """Test that blocking the bucket delays the next request."""
+        bucket = TokenBucket(rate=100)
+        bucket.block(3)
+        bucket.acquire()
+        wait, = mock_sleep.call_args[0]
+        self.assertAlmostEqual(3, wait, places=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
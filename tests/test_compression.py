@@ -0,0 +1,70 @@
+from configparser import ConfigParser
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+from jobnotify.compression import COMPRESSIONS, detect_compression, open_file
+from jobnotify.exceptions import DatabaseCfgError
+from jobnotify.storage import JSONStorage, open_storage, ShardedStorage
+from jobnotify.utils import load_json_db, write_json_db
+
+from .test_storage import make_posting
+
+
+class CompressionTestCase(unittest.TestCase):
+    """Test case for compressed databases."""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'db.json')
+        self.posts = {f'{i:016x}': make_posting(i) for i in range(50)}
+
+    def test_detected_by_magic(self):
+        """Test that each compression is detected from the file contents."""
+        for name in COMPRESSIONS:
+            with self.subTest(compression=name):
+                with open_file(self.path, 'wt', name) as f:
+                    f.write('{}')
+                self.assertEqual(name, detect_compression(self.path))
+                with open_file(self.path, 'rt') as f:
+                    self.assertEqual('{}', f.read())
+
+    def test_load_uncompressed(self):
+        """Test that an uncompressed database still loads."""
+        write_json_db(self.posts, self.path)
+        self.assertIsNone(detect_compression(self.path))
+        self.assertEqual(self.posts, load_json_db(self.path))
+
+    def test_compressed_storage(self):
+        """Test that compressed databases are smaller, and load with any setting."""
+        write_json_db(self.posts, self.path)
+        size = os.path.getsize(self.path)
+
+        for name in COMPRESSIONS:
+            with self.subTest(compression=name):
+                JSONStorage(self.path, compression=name)._write(self.posts)
+                self.assertLess(os.path.getsize(self.path), size)
+                self.assertEqual(self.posts, JSONStorage(self.path).load())
+                self.assertEqual(self.posts, load_json_db(self.path))
+
+    def test_compressed_shards(self):
+        """Test that shards are compressed as they are written."""
+        path = os.path.join(self.tmpdir.name, 'db.shards')
+        storage = ShardedStorage(path, shards=2, serializer='binary', compression='lzma')
+        storage.add(self.posts)
+
+        self.assertEqual('lzma', detect_compression(storage.shard_path(0)))
+        self.assertEqual(self.posts, ShardedStorage(path).load())
+
+    def test_unknown_compression(self):
+        """Test that we raise for an unknown compression."""
+        cfg = ConfigParser()
+        cfg['database'] = {'compression': 'zip'}
+        with self.assertRaises(DatabaseCfgError):
+            open_storage(self.tmpdir.name, 'db', 'json', cfg['database'])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
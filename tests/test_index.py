@@ -0,0 +1,91 @@
+import os
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import MagicMock, patch
+
+from jobnotify.index import _PackedKeys, index_path, JobkeyIndex, pack_jobkey
+from jobnotify.storage import SQLiteStorage
+
+from .test_storage import make_posting
+
+
+class JobkeyIndexTestCase(unittest.TestCase):
+    """Test case for the memory-mapped jobkey index."""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'db.json')
+        with open(self.db_path, 'w') as f:
+            f.write('{}')
+        self.keys = {f'{i * 7919:016x}' for i in range(1000)}
+
+    def test_membership(self):
+        """Test that indexed keys are found, and others are not."""
+        index = JobkeyIndex.open(self.db_path, lambda: self.keys | {'not-a-jobkey'})
+
+        self.assertEqual(1001, len(index))
+        for k in self.keys:
+            self.assertIn(k, index)
+        self.assertIn('not-a-jobkey', index)
+        self.assertNotIn(f'{3:016x}', index)
+        self.assertNotIn('ffffffffffffffff', index)
+        index.close()
+
+    def test_packed_on_disk(self):
+        """Test that jobkeys are stored as 8 bytes each."""
+        JobkeyIndex.open(self.db_path, lambda: self.keys).close()
+        self.assertEqual(40 + 8 * len(self.keys), os.path.getsize(index_path(self.db_path)))
+
+    def test_reused_until_stale(self):
+        """Test that the index is only rebuilt once the database changes."""
+        keys = MagicMock(return_value=self.keys)
+        JobkeyIndex.open(self.db_path, keys).close()
+        JobkeyIndex.open(self.db_path, keys).close()
+        self.assertEqual(1, keys.call_count)
+
+        with open(self.db_path, 'w') as f:
+            f.write('{"a": 1}')
+        JobkeyIndex.open(self.db_path, keys).close()
+        self.assertEqual(2, keys.call_count)
+
+    def test_add_merges_keys(self):
+        """Test that added keys are merged in order without unpacking each key."""
+        index = JobkeyIndex.open(self.db_path, lambda: self.keys)
+        added = {f'{i:016x}' for i in (0, 1, 7919, 7920, 2 ** 64 - 1)} | {'not-a-jobkey'}
+
+        with patch.object(_PackedKeys, '__getitem__', side_effect=AssertionError):
+            index.add(added, self.db_path)
+
+        self.assertEqual(self.keys | added, index.keys())
+        self.assertEqual(sorted(index._keys), list(index._keys))
+        self.assertFalse(index.is_stale(self.db_path))
+        index.close()
+
+    def test_pack_jobkey(self):
+        """Test that only 16 lowercase hex characters are packed."""
+        self.assertEqual(0x90feaf6e79c08d5f, pack_jobkey('90feaf6e79c08d5f'))
+        for jobkey in ('90FEAF6E79C08D5F', '90feaf6e79c08d5', ' 90feaf6e79c08d5f'):
+            self.assertIsNone(pack_jobkey(jobkey))
+
+    def test_storage_keeps_index_up_to_date(self):
+        """Test that adding postings updates an open index."""
+        storage = SQLiteStorage(os.path.join(self.tmpdir.name, 'db.sqlite3'))
+        storage.add({'0000000000000001': make_posting(1)})
+        index = storage.index()
+        storage.add({'0000000000000002': make_posting(2)})
+
+        self.assertIn('0000000000000002', index)
+        storage.close()
+
+        # the index written by `add` is not stale
+        keys = MagicMock()
+        index = JobkeyIndex.open(storage.path, keys)
+        self.assertEqual({'0000000000000001', '0000000000000002'}, index.keys())
+        keys.assert_not_called()
+        index.close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,18 @@
+import asyncio
 from configparser import ConfigParser
 import email
 import json
 import os
+import threading
 import unittest
-from unittest.mock import call, patch
+from unittest.mock import call, MagicMock, patch
+import urllib.error
+from urllib.parse import parse_qs, urlparse
 
 from .context import SAMPLE_CFG_FILE_PATH, TEST_DB_DIR
 from jobnotify import (
+    async_email_notify,
+    async_indeed_api_request,
     build_url,
     construct_email,
     construct_slack_message,
@@ -17,14 +23,28 @@ from jobnotify import (
     send_email,
     slack_notify,
 )
+from jobnotify.client import HTTPClient, RetryPolicy
 from jobnotify.exceptions import (
     EmailAuthenticationError,
     IndeedAuthenticationError,
+    IndeedRequestError,
+    NotificationError,
+    NotificationTimeoutError,
     SlackCfgError,
 )
+from jobnotify.smtp import get_smtp_session
 from jobnotify.utils import EmailMatch
 
 
+def run(coro):
+    """Run `coro` on a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
 class BuildURLTestCase(unittest.TestCase):
     """Test case for contstructing valid URLs."""
     @classmethod
@@ -151,6 +171,50 @@ class SlackTestCase(unittest.TestCase):
         msg_it = construct_slack_message(self.large_db)
         self.assertEqual(expected_result, list(msg_it))
 
+    def make_posts(self, n, desc='Snippet text.'):
+        return {
+            f'{i:016x}': {
+                'url': f'http://ie.indeed.com/viewjob?jk={i:016x}',
+                'jobtitle': f'Scientist {i}',
+                'company': 'ACME',
+                'desc': desc,
+            }
+            for i in range(n)
+        }
+
+    def test_many_listings(self):
+        """Test that every listing is sent once, in order, beyond 100 listings."""
+        posts = self.make_posts(250, desc='Requires 11. years of experience.')
+        msgs = list(construct_slack_message(posts))
+
+        self.assertEqual(25, len(msgs))
+        listings = ''.join(msgs).split('\n\n')
+        self.assertEqual(250, len(listings))
+        for i, listing in enumerate(listings, 1):
+            self.assertTrue(listing.startswith(f'{i}. <'))
+        self.assertTrue(msgs[10].startswith('101. <'))
+
+    def test_byte_budget(self):
+        """Test that messages are packed greedily within the byte budget."""
+        posts = self.make_posts(50, desc='\u00e9' * 100)
+        msgs = list(construct_slack_message(posts, max_bytes=1000, max_listings=50))
+
+        self.assertGreater(len(msgs), 1)
+        for m in msgs:
+            self.assertLessEqual(len(m.encode('utf-8')), 1000)
+        # each listing is about 330 bytes, so three fit in each message
+        self.assertTrue(all(m.count('\nSnippet: ') == 3 for m in msgs[:-1]))
+        self.assertEqual(50, ''.join(msgs).count('\nSnippet: '))
+
+    def test_oversized_listing(self):
+        """Test that a listing larger than the budget is sent alone."""
+        posts = self.make_posts(3)
+        posts['0000000000000001']['desc'] = 'x' * 5000
+        msgs = list(construct_slack_message(posts))
+
+        self.assertEqual(3, len(msgs))
+        self.assertTrue(msgs[1].startswith('2. <'))
+
     @patch('slackclient.SlackClient.api_call')
     def test_notify_short_message(self, mock_sc):
         """Test for notification via Slack for short message."""
@@ -423,6 +487,13 @@ class NotifyTestCase(unittest.TestCase):
         instance = mock_smtp.return_value.__enter__.return_value
         instance.send_message.assert_called_with(EmailMatch(expected))
 
+    @patch('smtplib.SMTP')
+    def test_async_email_notify(self, mock_smtp):
+        """Test that the asynchronous email notification sends a message."""
+        run(async_email_notify(self.email_cfg, self.posts, self.query, self.location))
+        instance = mock_smtp.return_value.__enter__.return_value
+        self.assertEqual(1, instance.send_message.call_count)
+
     @patch('smtplib.SMTP')
     def test_general_notify_email_route(self, mock_smtp):
         message = (
@@ -526,6 +597,76 @@ class NotifyTestCase(unittest.TestCase):
         mock_sc.assert_has_calls(calls, any_order=True)
 
 
+    @patch('slackclient.SlackClient.api_call')
+    @patch('smtplib.SMTP')
+    def test_notify_results(self, mock_smtp, mock_sc):
+        """Test that a result is returned for each enabled channel."""
+        results = notify(self.cfgs_all_routes, self.posts)
+
+        self.assertEqual(['email', 'slack'], [r.channel for r in results])
+        for r in results:
+            self.assertTrue(r.ok)
+            self.assertIsNone(r.error)
+            self.assertGreaterEqual(r.latency, 0)
+
+    @patch('slackclient.SlackClient.api_call')
+    @patch('smtplib.SMTP')
+    def test_failed_channel_does_not_stop_others(self, mock_smtp, mock_sc):
+        """Test that email is still sent when Slack fails."""
+        mock_sc.return_value = {'ok': False, 'error': 'invalid_auth'}
+
+        with self.assertRaises(NotificationError) as cm:
+            notify(self.cfgs_all_routes, self.posts)
+
+        instance = mock_smtp.return_value.__enter__.return_value
+        self.assertEqual(1, instance.send_message.call_count)
+
+        # the error reports the outcome of every channel
+        email_result, slack_result = cm.exception.results
+        self.assertTrue(email_result.ok)
+        self.assertFalse(slack_result.ok)
+        self.assertIsInstance(slack_result.error, SlackCfgError)
+        self.assertIs(slack_result.error, cm.exception.__cause__)
+
+    @patch('smtplib.SMTP')
+    def test_channel_timeout(self, mock_smtp):
+        """Test that a slow channel times out without delaying the others."""
+        async def slow(cfgs, posts, session=None):
+            await asyncio.sleep(10)
+
+        c = ConfigParser()
+        c.read(self.sample_cfg_path)
+        c['notify_via']['slack'] = 'true'
+        c['slack']['timeout'] = '0.05'
+        cfgs = [c['indeed'], c['email'], c['slack'], c['notify_via']]
+
+        with patch.dict('jobnotify.jobnotify.CHANNELS', {'slack': slow}):
+            with self.assertRaises(NotificationError) as cm:
+                notify(cfgs, self.posts)
+
+        self.assertEqual([True, False], [r.ok for r in cm.exception.results])
+        self.assertIsInstance(cm.exception.results[1].error, NotificationTimeoutError)
+
+        instance = mock_smtp.return_value.__enter__.return_value
+        self.assertEqual(1, instance.send_message.call_count)
+
+    @patch('smtplib.SMTP')
+    def test_notify_reuses_smtp_session(self, mock_smtp):
+        """Test that an SMTP connection is kept open between runs if configured."""
+        c = ConfigParser()
+        c.read(self.sample_cfg_path)
+        c['email']['idle_timeout'] = '120'
+        cfgs = [c['indeed'], c['email'], c['slack'], c['notify_via']]
+
+        notify(cfgs, self.posts)
+        notify(cfgs, self.posts)
+
+        instance = mock_smtp.return_value.__enter__.return_value
+        self.assertEqual(1, mock_smtp.call_count)
+        self.assertEqual(2, instance.send_message.call_count)
+
+        get_smtp_session(c['email']['email_from'], c['email']['password'], 120).close()
+
 class IndeedAPITestCase(unittest.TestCase):
     """Test case for the Indeed API."""
     @classmethod
@@ -565,6 +706,133 @@ class IndeedAPITestCase(unittest.TestCase):
             {k: v for d in all_posts for k, v in d.items()},
         )
 
+    def paged_urlopen(self, npages):
+        """Return a fake `urlopen` serving `npages` pages of results.
+
+        The jobkeys on page `i` are prefixed with `i`.
+        """
+        results = self.rawdb['results']
+        total = npages * 25
+        pages = {}
+        for i, start in enumerate(range(0, total, 25)):
+            page = dict(self.rawdb, totalResults=total, end=start+25)
+            page['results'] = [dict(r, jobkey=f'{i}{r["jobkey"]}') for r in results]
+            pages[start] = json.dumps(page).encode('utf-8')
+
+        def urlopen(request):
+            start = int(parse_qs(urlparse(request.full_url).query)['start'][0])
+            response = MagicMock()
+            response.__enter__.return_value.read.return_value = pages[start]
+            return response
+
+        return urlopen
+
+    @patch('urllib.request.urlopen')
+    def test_parallel_indeed_request(self, mock_urlopen):
+        """Test that pages requested concurrently are yielded in order."""
+        mock_urlopen.side_effect = self.paged_urlopen(3)
+        all_posts = indeed_api_request(dict(self.params), workers=3)
+        jobkeys = [k for d in all_posts for k in d]
+
+        self.assertEqual(3, mock_urlopen.call_count)
+        self.assertEqual(
+            [f'{i}{r["jobkey"]}' for i in range(3) for r in self.rawdb['results']],
+            jobkeys,
+        )
+
+    @patch('urllib.request.urlopen')
+    def test_postings_yielded_while_reading(self, mock_urlopen):
+        """Test that a posting is yielded before the rest of its page is read."""
+        first = json.dumps(self.rawdb['results'][0])
+        split = self.dbs.index(first) + len(first) + 1
+        received = threading.Event()
+        body_read = []
+
+        def read(size=-1):
+            if not body_read:
+                body_read.append(False)
+                return self.dbs[:split].encode('utf-8')
+            if not body_read[-1]:
+                # the rest of the body only arrives once a posting is received
+                received.wait(5)
+                body_read.append(True)
+                return self.dbs[split:].encode('utf-8')
+            return b''
+
+        mock_urlopen.return_value.__enter__.return_value.read.side_effect = read
+        all_posts = indeed_api_request(dict(self.params))
+
+        post = next(all_posts)
+        self.assertEqual([False], body_read)
+        received.set()
+
+        self.assertEqual([self.rawdb['results'][0]['jobkey']], list(post))
+        self.assertEqual(len(self.rawdb['results']) - 1, len(list(all_posts)))
+        self.assertTrue(body_read[-1])
+
+    @patch('urllib.request.urlopen')
+    def test_sync_request_closed_early(self, mock_urlopen):
+        """Test that the remaining page requests are abandoned when iteration stops."""
+        mock_urlopen.side_effect = self.paged_urlopen(3)
+        all_posts = indeed_api_request(dict(self.params), workers=3)
+        first = next(all_posts)
+        all_posts.close()
+
+        self.assertEqual([f'0{self.rawdb["results"][0]["jobkey"]}'], list(first))
+
+    @patch('urllib.request.urlopen')
+    def test_incremental_stops_at_seen_page(self, mock_urlopen):
+        """Test that we stop paging after a page of known postings."""
+        mock_urlopen.side_effect = self.paged_urlopen(4)
+        seen = {f'1{r["jobkey"]}' for r in self.rawdb['results']}
+        all_posts = indeed_api_request(dict(self.params), seen=seen)
+        jobkeys = [k for d in all_posts for k in d]
+
+        self.assertEqual(2, mock_urlopen.call_count)
+        self.assertEqual(4, len(jobkeys))
+
+    @patch('urllib.request.urlopen')
+    def test_incremental_stop_after(self, mock_urlopen):
+        """Test that we stop paging after a run of known postings."""
+        mock_urlopen.side_effect = self.paged_urlopen(4)
+        seen = {f'0{self.rawdb["results"][-1]["jobkey"]}'}
+        all_posts = indeed_api_request(dict(self.params), seen=seen, stop_after=1)
+        list(all_posts)
+
+        self.assertEqual(1, mock_urlopen.call_count)
+
+    @patch('urllib.request.urlopen')
+    def test_failed_page_raises_after_earlier_pages(self, mock_urlopen):
+        """Test that postings from earlier pages are yielded before a failure."""
+        paged_urlopen = self.paged_urlopen(3)
+
+        def urlopen(request):
+            if 'start=25' in request.full_url:
+                raise urllib.error.URLError('connection reset')
+            return paged_urlopen(request)
+
+        mock_urlopen.side_effect = urlopen
+        client = HTTPClient(retry=RetryPolicy(max_retries=0))
+        jobkeys = []
+
+        with self.assertRaises(IndeedRequestError):
+            for d in indeed_api_request(dict(self.params), client=client):
+                jobkeys.extend(d)
+
+        self.assertEqual(2, len(jobkeys))
+
+    @patch('urllib.request.urlopen')
+    def test_async_indeed_request(self, mock_urlopen):
+        """Test that the asynchronous request yields the same postings."""
+        instance = mock_urlopen.return_value.__enter__.return_value
+        instance.read.return_value = self.dbs.encode('utf-8')
+
+        async def collect():
+            all_posts = async_indeed_api_request(dict(self.params))
+            return {k: v async for d in all_posts for k, v in d.items()}
+
+        self.assertEqual(self.db, run(collect()))
+
     @patch('urllib.request.urlopen')
     def test_malformed_json_response(self, mock_urlopen):
         """Test that we get a good response for a good API call."""
@@ -574,8 +842,9 @@ class IndeedAPITestCase(unittest.TestCase):
 
         with self.assertRaises(json.decoder.JSONDecodeError):
             all_posts = indeed_api_request(self.params)
-            # exception won't be raised until we iterate the generator
-            next(all_posts)
+            # postings are yielded as they are decoded, so the exception
+            # won't be raised until we reach the end of the response
+            list(all_posts)
 
     @patch('urllib.request.urlopen')
     def test_indeed_bad_publisher_key(self, mock_urlopen):
@@ -0,0 +1,121 @@
+import asyncio
+import multiprocessing
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+from jobnotify.exceptions import DatabaseLockedError
+from jobnotify.lock import FileLock
+from jobnotify.storage import JSONStorage, ShardedStorage
+
+from .test_storage import make_posting
+
+
+def add_postings(path, start, n):
+    """Add `n` postings to the database at `path`, one at a time."""
+    storage = JSONStorage(path, serializer='compact')
+    for i in range(start, start + n):
+        storage.add({f'{i:016x}': make_posting(i)})
+    storage.close()
+
+
+class FileLockTestCase(unittest.TestCase):
+    """Test case for the advisory file lock."""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'db.lock')
+
+    def test_reentrant(self):
+        """Test that the lock is held until it is released as often as it was acquired."""
+        lock = FileLock(self.path)
+        with lock:
+            with lock:
+                self.assertTrue(lock.locked)
+            self.assertTrue(lock.locked)
+        self.assertFalse(lock.locked)
+
+    def test_timeout(self):
+        """Test that we raise if the lock is held elsewhere for too long."""
+        with FileLock(self.path):
+            with self.assertRaises(DatabaseLockedError):
+                FileLock(self.path, timeout=0.2, poll_interval=0.05).acquire()
+
+        # the lock can be taken once it is released
+        with FileLock(self.path, timeout=0):
+            pass
+
+    def test_acquire_async(self):
+        """Test that the lock is waited for on the event loop."""
+        holder = FileLock(self.path)
+        waiter = FileLock(self.path, timeout=1, poll_interval=0.01)
+
+        async def wait():
+            holder.acquire()
+            task = asyncio.ensure_future(waiter.acquire_async())
+            await asyncio.sleep(0.05)
+            # the event loop is free while the lock is waited for
+            self.assertFalse(task.done())
+            holder.release()
+            await task
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(wait())
+        finally:
+            loop.close()
+        self.assertTrue(waiter.locked)
+        waiter.release()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class ConcurrentUpdateTestCase(unittest.TestCase):
+    """Test case for databases updated by more than one process."""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'db.json')
+
+    def test_read_merge_write(self):
+        """Test that postings added by another writer are merged, not lost."""
+        first = JSONStorage(self.path)
+        index = first.index()
+        self.assertEqual(0, len(index))
+
+        JSONStorage(self.path).add({'0000000000000001': make_posting(1)})
+        first.add({'0000000000000002': make_posting(2)})
+
+        self.assertEqual({'0000000000000001', '0000000000000002'}, set(JSONStorage(self.path).load()))
+        self.assertEqual({'0000000000000001', '0000000000000002'}, first.index().keys())
+        first.close()
+
+    def test_sharded_read_merge_write(self):
+        """Test that a sharded database rereads shards changed by another writer."""
+        path = os.path.join(self.tmpdir.name, 'db.shards')
+        first = ShardedStorage(path, shards=1)
+        first.load()
+
+        ShardedStorage(path, shards=1).add({'0000000000000001': make_posting(1)})
+        first.add({'0000000000000002': make_posting(2)})
+
+        self.assertEqual(2, len(ShardedStorage(path).load()))
+
+    def test_parallel_processes(self):
+        """Test that no postings are lost when processes write at the same time."""
+        processes = [
+            multiprocessing.Process(target=add_postings, args=(self.path, i * 100, 20))
+            for i in range(4)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+
+        self.assertEqual(80, len(JSONStorage(self.path).load()))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
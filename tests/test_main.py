@@ -1,10 +1,25 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from contextlib import redirect_stdout
+from email.utils import parsedate_to_datetime
+import io
 import json
 import os
+from tempfile import TemporaryDirectory
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
+import urllib.error
 
 from .context import jobnotify, SAMPLE_CFG_FILE_PATH, TEST_DB_DIR
-from jobnotify.utils import EmailMatch
+from jobnotify.index import index_path
+from jobnotify.lock import lock_path
+from jobnotify.outbox import Outbox, outbox_path
+from jobnotify.storage import JSONStorage, SearchMatches, tombstones_path
+from jobnotify.utils import EmailMatch, load_run_metadata, run_metadata_path
+
+from .test_storage import make_posting
 
 
 class MainTestCase(unittest.TestCase):
@@ -79,9 +94,231 @@ class MainTestCase(unittest.TestCase):
         jobnotify.jobnotify(self.cfg_filename, TEST_DB_DIR)
         self.assertFalse(mock_notify.called)
 
+    @patch('time.sleep')
+    @patch('smtplib.SMTP')
+    @patch('urllib.request.urlopen')
+    def test_jobnotify_partial_fetch(self, mock_urlopen, mock_smtp, mock_sleep):
+        """Test that postings fetched before a failed request are kept."""
+        first_page = dict(self.rawdb, totalResults=50)
+        response = MagicMock()
+        response.__enter__.return_value.read.return_value = json.dumps(first_page).encode('utf-8')
+        mock_urlopen.side_effect = [response] + 4*[urllib.error.URLError('timed out')]
+
+        with redirect_stdout(io.StringIO()):
+            jobnotify.jobnotify(self.cfg_filename, TEST_DB_DIR)
+
+        smtp_instance = mock_smtp.return_value.__enter__.return_value
+        self.assertEqual(1, smtp_instance.send_message.call_count)
+        with open(self.expected_db_filename) as f:
+            self.assertEqual({'90feaf6e79c08d5f', 'aa39943da620729a'}, set(json.load(f)))
+        # the next run must search back as far as this one did
+        self.assertNotIn('last_success', load_run_metadata(self.expected_db_filename))
+
+    @patch('smtplib.SMTP')
+    @patch('urllib.request.urlopen')
+    def test_jobnotify_shared_database(self, mock_urlopen, mock_smtp):
+        """Test that postings matched by several searches are notified and stored once."""
+        urlopen_instance = mock_urlopen.return_value.__enter__.return_value
+        urlopen_instance.read.return_value = self.dbs.encode('utf-8')
+
+        with TemporaryDirectory() as tmpdir:
+            cfg = ConfigParser()
+            cfg.read(self.cfg_filename)
+            cfg['indeed']['query'] = 'scientist\ndata scientist'
+            cfg['database'] = {'shared': 'true'}
+            cfg_filename = os.path.join(tmpdir, 'jobnotify.config')
+            with open(cfg_filename, 'w') as f:
+                cfg.write(f)
+
+            jobnotify.jobnotify(cfg_filename, tmpdir)
+
+            smtp_instance = mock_smtp.return_value.__enter__.return_value
+            self.assertEqual(1, smtp_instance.send_message.call_count)
+            self.assertEqual(2, mock_urlopen.call_count)
+
+            with open(os.path.join(tmpdir, 'shared.json')) as f:
+                self.assertEqual({'90feaf6e79c08d5f', 'aa39943da620729a'}, set(json.load(f)))
+            matches = SearchMatches(os.path.join(tmpdir, 'shared.matches.sqlite'))
+            self.assertEqual(['scientist_dublin', 'data_scientist_dublin'], matches['90feaf6e79c08d5f'])
+            matches.close()
+
+            # each search keeps its own run metadata
+            for name in ('scientist_dublin', 'data_scientist_dublin'):
+                self.assertIn('last_success', load_run_metadata(os.path.join(tmpdir, f'{name}.json')))
+
+    @patch('smtplib.SMTP')
+    @patch('urllib.request.urlopen')
+    def test_jobnotify_shared_database_retention(self, mock_urlopen, mock_smtp):
+        """Test that postings pruned while adding to a shared database lose their matches."""
+        urlopen_instance = mock_urlopen.return_value.__enter__.return_value
+        urlopen_instance.read.return_value = self.dbs.encode('utf-8')
+
+        # keep the postings in the response, but not one from years before
+        oldest = min(parsedate_to_datetime(r['date']).timestamp() for r in self.rawdb['results'])
+        retention_days = (time.time() - oldest) / 86400 + 365
+        old_posting = make_posting(0, date_created='Mon, 02 Oct 2000 10:00:00 GMT')
+
+        with TemporaryDirectory() as tmpdir:
+            cfg = ConfigParser()
+            cfg.read(self.cfg_filename)
+            cfg['database'] = {'shared': 'true', 'retention_days': str(retention_days)}
+            cfg_filename = os.path.join(tmpdir, 'jobnotify.config')
+            with open(cfg_filename, 'w') as f:
+                cfg.write(f)
+
+            shared_path = os.path.join(tmpdir, 'shared.json')
+            with JSONStorage(shared_path) as storage:
+                storage.add({'0000000000000000': old_posting})
+            matches = SearchMatches(os.path.join(tmpdir, 'shared.matches.sqlite'))
+            matches.add('scientist_dublin', ['0000000000000000'])
+            matches.save()
+            matches.close()
+
+            jobnotify.jobnotify(cfg_filename, tmpdir)
+
+            smtp_instance = mock_smtp.return_value.__enter__.return_value
+            self.assertEqual(1, smtp_instance.send_message.call_count)
+            with open(shared_path) as f:
+                self.assertEqual({'90feaf6e79c08d5f', 'aa39943da620729a'}, set(json.load(f)))
+            with open(tombstones_path(shared_path)) as f:
+                self.assertEqual({'0000000000000000'}, set(json.load(f)))
+
+            matches = SearchMatches(os.path.join(tmpdir, 'shared.matches.sqlite'))
+            self.assertEqual(2, len(matches))
+            with self.assertRaises(KeyError):
+                matches['0000000000000000']
+            matches.close()
+            self.assertIn('last_success', load_run_metadata(os.path.join(tmpdir, 'scientist_dublin.json')))
+
+    @patch('smtplib.SMTP')
+    @patch('urllib.request.urlopen')
+    def test_more_concurrent_runs_than_threads(self, mock_urlopen, mock_smtp):
+        """Test that runs waiting for a shared database do not starve the run holding it."""
+        urlopen_instance = mock_urlopen.return_value.__enter__.return_value
+        urlopen_instance.read.return_value = self.dbs.encode('utf-8')
+
+        with TemporaryDirectory() as tmpdir:
+            cfg = ConfigParser()
+            cfg.read(self.cfg_filename)
+            cfg['database'] = {'shared': 'true', 'lock_timeout': '5'}
+            cfg_filename = os.path.join(tmpdir, 'jobnotify.config')
+            with open(cfg_filename, 'w') as f:
+                cfg.write(f)
+
+            async def run_all():
+                asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2))
+                await asyncio.gather(
+                    *(jobnotify.async_jobnotify(cfg_filename, tmpdir) for _ in range(6))
+                )
+
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(run_all())
+            finally:
+                loop.close()
+
+            # only the first run to take the lock finds new postings
+            smtp_instance = mock_smtp.return_value.__enter__.return_value
+            self.assertEqual(1, smtp_instance.send_message.call_count)
+            with open(os.path.join(tmpdir, 'shared.json')) as f:
+                self.assertEqual({'90feaf6e79c08d5f', 'aa39943da620729a'}, set(json.load(f)))
+
+    @patch('smtplib.SMTP')
+    @patch('urllib.request.urlopen')
+    def test_postings_added_during_fetch(self, mock_urlopen, mock_smtp):
+        """Test that the database is not locked while fetching, and is re-read afterwards."""
+        with TemporaryDirectory() as tmpdir:
+            cfg = ConfigParser()
+            cfg.read(self.cfg_filename)
+            cfg['database'] = {'lock_timeout': '0.1'}
+            cfg_filename = os.path.join(tmpdir, 'jobnotify.config')
+            with open(cfg_filename, 'w') as f:
+                cfg.write(f)
+
+            def urlopen(request):
+                # another run stores one of the postings while this one fetches
+                with JSONStorage(os.path.join(tmpdir, 'scientist_dublin.json')) as storage:
+                    storage.add({'90feaf6e79c08d5f': make_posting(0)})
+                response = MagicMock()
+                response.__enter__.return_value.read.return_value = self.dbs.encode('utf-8')
+                return response
+
+            mock_urlopen.side_effect = urlopen
+
+            jobnotify.jobnotify(cfg_filename, tmpdir)
+
+            smtp_instance = mock_smtp.return_value.__enter__.return_value
+            msg = smtp_instance.send_message.call_args[0][0]
+            self.assertEqual('Job opportunities: 1 new job posted', msg['Subject'])
+            with open(os.path.join(tmpdir, 'scientist_dublin.json')) as f:
+                self.assertEqual({'90feaf6e79c08d5f', 'aa39943da620729a'}, set(json.load(f)))
+
+    @patch('smtplib.SMTP')
+    @patch('urllib.request.urlopen')
+    def test_request_budget_per_search(self, mock_urlopen, mock_smtp):
+        """Test that each search has its own request budget."""
+        urlopen_instance = mock_urlopen.return_value.__enter__.return_value
+        urlopen_instance.read.return_value = self.dbs.encode('utf-8')
+
+        with TemporaryDirectory() as tmpdir:
+            cfg = ConfigParser()
+            cfg.read(self.cfg_filename)
+            cfg['indeed']['query'] = 'scientist\ndata scientist'
+            cfg['indeed']['request_budget'] = '1'
+            cfg_filename = os.path.join(tmpdir, 'jobnotify.config')
+            with open(cfg_filename, 'w') as f:
+                cfg.write(f)
+
+            jobnotify.jobnotify(cfg_filename, tmpdir)
+
+            self.assertEqual(2, mock_urlopen.call_count)
+            for name in ('scientist_dublin', 'data_scientist_dublin'):
+                self.assertIn('last_success', load_run_metadata(os.path.join(tmpdir, f'{name}.json')))
+
+    @patch('smtplib.SMTP')
+    @patch('urllib.request.urlopen')
+    def test_jobnotify_outbox(self, mock_urlopen, mock_smtp):
+        """Test that postings are stored even if the notification fails, and sent later."""
+        urlopen_instance = mock_urlopen.return_value.__enter__.return_value
+        urlopen_instance.read.return_value = self.dbs.encode('utf-8')
+        smtp_instance = mock_smtp.return_value.__enter__.return_value
+        smtp_instance.send_message.side_effect = ConnectionRefusedError()
+
+        with TemporaryDirectory() as tmpdir:
+            cfg = ConfigParser()
+            cfg.read(self.cfg_filename)
+            cfg['outbox'] = {'enabled': 'true', 'backoff': '0'}
+            cfg_filename = os.path.join(tmpdir, 'jobnotify.config')
+            with open(cfg_filename, 'w') as f:
+                cfg.write(f)
+
+            with redirect_stdout(io.StringIO()) as stdout:
+                jobnotify.jobnotify(cfg_filename, tmpdir)
+            self.assertIn('WARNING: Notification via email failed', stdout.getvalue())
+
+            # the postings are stored, and the email is still queued
+            with open(os.path.join(tmpdir, 'scientist_dublin.json')) as f:
+                self.assertEqual({'90feaf6e79c08d5f', 'aa39943da620729a'}, set(json.load(f)))
+            outbox = Outbox(outbox_path(tmpdir))
+            outbox.load()
+            self.assertEqual(1, len(outbox))
+
+            # the next run sends the queued email without new postings
+            smtp_instance.send_message.side_effect = None
+            jobnotify.jobnotify(cfg_filename, tmpdir)
+            self.assertEqual(2, smtp_instance.send_message.call_count)
+            outbox.load()
+            self.assertEqual(0, len(outbox))
+
     def tearDown(self):
-        if os.path.isfile(self.expected_db_filename):
-            os.remove(self.expected_db_filename)
+        for path in (
+            self.expected_db_filename,
+            run_metadata_path(self.expected_db_filename),
+            index_path(self.expected_db_filename),
+            lock_path(self.expected_db_filename),
+        ):
+            if os.path.isfile(path):
+                os.remove(path)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,187 @@
+from configparser import ConfigParser
+import os
+from tempfile import TemporaryDirectory
+import time
+import unittest
+from unittest.mock import patch
+
+from .context import SAMPLE_CFG_FILE_PATH
+from jobnotify.client import RetryPolicy
+from jobnotify.jobnotify import _notify_email, deliver
+from jobnotify.outbox import FAILED, Outbox, SENT
+from jobnotify.posting import Posting
+
+from .test_storage import make_posting
+
+
+def make_posts(start, n):
+    return {f'{i:016x}': make_posting(i) for i in range(start, start + n)}
+
+
+class OutboxTestCase(unittest.TestCase):
+    """Test case for the on-disk queue of notifications."""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'outbox.json')
+        # retry after exactly `backoff * 2**n` seconds
+        self.retry = RetryPolicy(max_retries=2, backoff=10.0, max_backoff=100.0)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_enqueue(self):
+        """Test that queued postings are written to file with a state per channel."""
+        outbox = Outbox(self.path, self.retry)
+        self.assertEqual(3, outbox.enqueue(make_posts(0, 3), ['email', 'slack'], now=100.0))
+
+        outbox = Outbox(self.path, self.retry)
+        outbox.load()
+        self.assertEqual(1, len(outbox.batches))
+        batch = outbox.batches[0]
+        self.assertIsInstance(batch['posts']['0000000000000000'], Posting)
+        self.assertEqual({'email', 'slack'}, set(batch['channels']))
+        self.assertEqual(2, len(outbox))
+        self.assertEqual(100.0, outbox.next_attempt())
+
+    def test_enqueue_skips_queued_postings(self):
+        """Test that postings which are already queued are not queued again."""
+        outbox = Outbox(self.path, self.retry)
+        outbox.enqueue(make_posts(0, 3), ['email'])
+        self.assertEqual(2, outbox.enqueue(make_posts(1, 4), ['email']))
+        self.assertEqual(0, outbox.enqueue(make_posts(0, 2), ['email']))
+
+        outbox.load()
+        self.assertEqual([3, 2], [len(b['posts']) for b in outbox.batches])
+
+    def test_backoff(self):
+        """Test that failed deliveries are retried with backoff, then given up."""
+        outbox = Outbox(self.path, self.retry)
+        outbox.enqueue(make_posts(0, 1), ['email', 'slack'], now=0.0)
+        outbox.load()
+        batch = outbox.batches[0]
+
+        with patch('random.uniform', side_effect=lambda a, b: b):
+            outbox.record(batch, 'slack', None, 0.0)
+            outbox.record(batch, 'email', OSError('down'), 0.0)
+            self.assertEqual(SENT, batch['channels']['slack']['status'])
+            self.assertEqual(10.0, batch['channels']['email']['next_attempt'])
+            self.assertEqual([], outbox.due(5.0))
+            self.assertEqual([(batch, 'email')], outbox.due(10.0))
+
+            outbox.record(batch, 'email', OSError('down'), 10.0)
+            self.assertEqual(30.0, batch['channels']['email']['next_attempt'])
+
+            with self.assertLogs(level='ERROR'):
+                outbox.record(batch, 'email', OSError('down'), 30.0)
+        self.assertEqual(FAILED, batch['channels']['email']['status'])
+        self.assertEqual(3, batch['channels']['email']['attempts'])
+
+        # finished batches are dropped when saved
+        self.assertEqual(0, outbox.save())
+        outbox.load()
+        self.assertEqual([], outbox.batches)
+
+
+class DeliverTestCase(unittest.TestCase):
+    """Test case for delivering queued notifications."""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.outbox = Outbox(
+            os.path.join(self.tmpdir.name, 'outbox.json'),
+            RetryPolicy(max_retries=3, backoff=0.0),
+        )
+
+        c = ConfigParser()
+        c.read(SAMPLE_CFG_FILE_PATH)
+        c['notify_via']['slack'] = 'true'
+        self.cfgs = [c['indeed'], c['email'], c['slack'], c['notify_via']]
+
+        self.sent = {'email': [], 'slack': []}
+        self.failures = {'email': 0, 'slack': 0}
+
+        def channel(name):
+            async def send(cfgs, posts, session=None):
+                if self.failures[name]:
+                    self.failures[name] -= 1
+                    raise OSError(f'{name} is down')
+                self.sent[name].append(sorted(posts))
+            return send
+
+        patcher = patch.dict(
+            'jobnotify.jobnotify.CHANNELS', {'email': channel('email'), 'slack': channel('slack')}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_failed_channel_retried_alone(self):
+        """Test that only the channel which failed is retried."""
+        self.outbox.enqueue(make_posts(0, 2), ['email', 'slack'])
+        self.failures['slack'] = 1
+
+        with patch('builtins.print'):
+            self.assertEqual(1, deliver(self.cfgs, self.outbox))
+        self.assertEqual(1, len(self.sent['email']))
+        self.assertEqual(0, len(self.sent['slack']))
+
+        self.assertEqual(0, deliver(self.cfgs, self.outbox))
+        self.assertEqual(1, len(self.sent['email']))
+        self.assertEqual(1, len(self.sent['slack']))
+        self.assertFalse(self.outbox.batches)
+
+    def test_drain(self):
+        """Test that draining retries until every delivery is made."""
+        self.outbox.enqueue(make_posts(0, 2), ['email', 'slack'])
+        self.failures['email'] = 2
+
+        with patch('builtins.print'):
+            self.assertEqual(0, deliver(self.cfgs, self.outbox, drain=True))
+        self.assertEqual([['0000000000000000', '0000000000000001']], self.sent['email'])
+        self.assertEqual(1, len(self.sent['slack']))
+
+    def test_give_up(self):
+        """Test that draining stops once a delivery has failed too often."""
+        self.outbox.enqueue(make_posts(0, 1), ['email'])
+        self.failures['email'] = 10
+
+        with patch('builtins.print'), self.assertLogs(level='ERROR'):
+            self.assertEqual(0, deliver(self.cfgs, self.outbox, drain=True))
+        self.assertEqual(6, self.failures['email'])
+
+    def test_outbox_unlocked_while_sending(self):
+        """Test that other runs can queue notifications while deliveries are sent."""
+        self.outbox.enqueue(make_posts(0, 1), ['email'])
+        other = Outbox(self.outbox.path, self.outbox.retry, lock_timeout=0.1)
+
+        async def send(cfgs, posts, session=None):
+            # the delivery being sent is claimed by this process
+            other.load()
+            self.assertEqual([], other.due(time.time()))
+            other.enqueue(make_posts(1, 1), ['email'])
+            self.sent['email'].append(sorted(posts))
+
+        with patch.dict('jobnotify.jobnotify.CHANNELS', {'email': send}):
+            self.assertEqual(1, deliver(self.cfgs, self.outbox))
+
+        self.assertEqual([['0000000000000000']], self.sent['email'])
+        # the delivery is recorded in the outbox as it was after sending
+        self.assertEqual(
+            [{'0000000000000001'}], [set(b['posts']) for b in self.outbox.batches]
+        )
+
+    @patch('smtplib.SMTP')
+    def test_deliveries_share_smtp_connection(self, mock_smtp):
+        """Test that every email delivered in one pass is sent over one connection."""
+        self.outbox.enqueue(make_posts(0, 1), ['email'])
+        self.outbox.enqueue(make_posts(1, 1), ['email'])
+
+        with patch.dict('jobnotify.jobnotify.CHANNELS', {'email': _notify_email}):
+            self.assertEqual(0, deliver(self.cfgs, self.outbox))
+
+        instance = mock_smtp.return_value.__enter__.return_value
+        self.assertEqual(1, mock_smtp.call_count)
+        self.assertEqual(2, instance.send_message.call_count)
+        # the connection is closed at the end of the pass
+        self.assertEqual(1, mock_smtp.return_value.__exit__.call_count)
@@ -0,0 +1,63 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+from jobnotify.posting import as_posting, Posting, to_json
+from jobnotify.utils import load_json_db, write_json_db
+
+
+class PostingTestCase(unittest.TestCase):
+    """Test case for the `Posting` record type."""
+    def setUp(self):
+        self.d = {
+            'jobtitle': 'Data Scientist',
+            'company': 'Acme',
+            'date_created': 'Mon, 02 Oct 2017 10:00:00 GMT',
+            'location': 'Dublin',
+            'url': 'http://ie.indeed.com/viewjob?jk=abc',
+            'lat': 53.35,
+            'lon': -6.26,
+            'desc': 'A job',
+        }
+
+    def test_mapping(self):
+        """Test that a posting behaves like the dict it replaces."""
+        posting = Posting.from_dict(self.d)
+        self.assertEqual(self.d, dict(posting))
+        self.assertEqual(self.d, posting)
+        self.assertEqual('Acme', '{company}'.format(**posting))
+        with self.assertRaises(KeyError):
+            posting['jobkey']
+
+    def test_no_instance_dict(self):
+        """Test that postings do not carry a per-instance dict."""
+        self.assertFalse(hasattr(Posting.from_dict(self.d), '__dict__'))
+
+    def test_strings_interned(self):
+        """Test that repeated company and location strings are shared."""
+        a = Posting.from_dict(self.d)
+        b = Posting.from_dict(json.loads(json.dumps(self.d)))
+        self.assertIs(a.company, b.company)
+        self.assertIs(a.location, b.location)
+
+    def test_json_hooks(self):
+        """Test that postings survive a JSON round trip."""
+        s = json.dumps({'abc': Posting.from_dict(self.d)}, default=to_json)
+        db = json.loads(s, object_hook=as_posting)
+        self.assertIsInstance(db['abc'], Posting)
+        self.assertEqual(self.d, db['abc'])
+
+    def test_database_format_unchanged(self):
+        """Test that the database file is written exactly as before."""
+        with TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'db.json')
+            write_json_db({'abc': Posting.from_dict(self.d)}, path)
+            with open(path) as f:
+                written = f.read()
+            self.assertEqual(json.dumps({'abc': self.d}, indent=2, sort_keys=True), written)
+            self.assertIsInstance(load_json_db(path)['abc'], Posting)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+from configparser import ConfigParser
+import io
+import os
+from tempfile import TemporaryDirectory
+import unittest
+
+from jobnotify.exceptions import DatabaseCfgError
+from jobnotify.serializers import BinarySerializer, SERIALIZERS
+from jobnotify.storage import JSONStorage, open_storage
+
+from .test_storage import make_posting
+
+
+class SerializerTestCase(unittest.TestCase):
+    """Test case for the database file formats."""
+    def round_trip(self, serializer, db):
+        f = io.BytesIO() if serializer.mode == 'b' else io.StringIO()
+        serializer.dump(db, f)
+        f.seek(0)
+        return serializer.load(f), len(f.getvalue())
+
+    def test_round_trip(self):
+        """Test that every serializer loads the postings it dumped."""
+        db = {f'{i:016x}': make_posting(i) for i in range(100)}
+        for name, cls in SERIALIZERS.items():
+            with self.subTest(serializer=name):
+                loaded, _ = self.round_trip(cls(), db)
+                self.assertEqual(db, loaded)
+
+    def test_binary_missing_values(self):
+        """Test that missing strings and coordinates survive the binary format."""
+        posting = make_posting(0)
+        db = {'abc': dict(posting, lat=None, lon=None, desc=None)}
+        loaded, _ = self.round_trip(BinarySerializer(), db)
+        self.assertEqual(db['abc'], loaded['abc'])
+
+    def test_binary_interns_strings(self):
+        """Test that repeated strings are only written once."""
+        db = {f'{i:016x}': make_posting(i) for i in range(100)}
+        f = io.BytesIO()
+        BinarySerializer().dump(db, f)
+        self.assertEqual(1, f.getvalue().count(b'Acme'))
+
+    def test_binary_smaller_than_json(self):
+        """Test that the binary format is smaller than either JSON format."""
+        db = {f'{i:016x}': make_posting(i) for i in range(100)}
+        sizes = {name: self.round_trip(cls(), db)[1] for name, cls in SERIALIZERS.items()}
+        self.assertLess(sizes['binary'], sizes['compact'])
+        self.assertLess(sizes['compact'], sizes['pretty'])
+
+    def test_binary_bad_magic(self):
+        """Test that we refuse to load a file which is not a binary database."""
+        with self.assertRaises(ValueError):
+            BinarySerializer().load(io.BytesIO(b'{"not": "binary"}'))
+
+
+class StorageSerializerTestCase(unittest.TestCase):
+    """Test case for selecting a serializer in the configuration file."""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.cfg = ConfigParser()
+        self.cfg['database'] = {'serializer': 'binary'}
+
+    def test_binary_database(self):
+        """Test that a JSON database is migrated to the configured format."""
+        posts = {f'{i:016x}': make_posting(i) for i in range(3)}
+        JSONStorage(os.path.join(self.tmpdir.name, 'scientist_dublin.json')).add(posts)
+
+        with open_storage(self.tmpdir.name, 'scientist_dublin', 'json', self.cfg['database']) as storage:
+            self.assertEqual(os.path.join(self.tmpdir.name, 'scientist_dublin.jnb'), storage.path)
+            self.assertEqual(posts, storage.load())
+
+        with open(storage.path, 'rb') as f:
+            self.assertEqual(b'JNDB', f.read(4))
+
+    def test_unknown_serializer(self):
+        """Test that we raise for an unknown serializer."""
+        self.cfg['database']['serializer'] = 'xml'
+        with self.assertRaises(DatabaseCfgError):
+            open_storage(self.tmpdir.name, 'scientist_dublin', 'json', self.cfg['database'])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+from email.message import Message
+import smtplib
+import unittest
+from unittest.mock import patch
+
+from jobnotify.smtp import get_smtp_session, SMTP_HOST, SMTP_PORT, SMTPSession
+
+
+@patch('smtplib.SMTP')
+class SMTPSessionTestCase(unittest.TestCase):
+    """Test case for the reusable SMTP connection."""
+    def setUp(self):
+        self.msg = Message()
+        self.msg['Subject'] = 'Job opportunities: 2 new jobs posted'
+
+    def test_connection_reused(self, mock_smtp):
+        """Test that several messages are sent over one authenticated connection."""
+        with SMTPSession('test.sender@gmail.com', 'test1234') as session:
+            for _ in range(3):
+                session.send(self.msg)
+
+        instance = mock_smtp.return_value.__enter__.return_value
+        self.assertEqual(1, mock_smtp.call_count)
+        instance.login.assert_called_once_with('test.sender@gmail.com', 'test1234')
+        self.assertEqual(3, instance.send_message.call_count)
+        self.assertEqual({'created': 1, 'sent': 3, 'reconnects': 0}, session.stats)
+        # the connection is closed with the session
+        self.assertEqual(1, mock_smtp.return_value.__exit__.call_count)
+
+    def test_idle_connection_closed(self, mock_smtp):
+        """Test that a connection idle for too long is replaced."""
+        session = SMTPSession('test.sender@gmail.com', 'test1234', idle_timeout=60)
+
+        with patch('time.monotonic', return_value=1000.0):
+            session.send(self.msg)
+        with patch('time.monotonic', return_value=1030.0):
+            session.send(self.msg)
+        self.assertEqual(1, mock_smtp.call_count)
+
+        with patch('time.monotonic', return_value=1100.0):
+            session.send(self.msg)
+        self.assertEqual(2, mock_smtp.call_count)
+        self.assertEqual(1, mock_smtp.return_value.__exit__.call_count)
+        session.close()
+
+    def test_reconnect(self, mock_smtp):
+        """Test that a dropped connection is replaced transparently."""
+        instance = mock_smtp.return_value.__enter__.return_value
+        session = SMTPSession('test.sender@gmail.com', 'test1234')
+        session.send(self.msg)
+
+        instance.send_message.side_effect = [smtplib.SMTPServerDisconnected(), {}]
+        session.send(self.msg)
+
+        self.assertEqual(2, mock_smtp.call_count)
+        self.assertEqual(2, instance.login.call_count)
+        self.assertEqual({'created': 2, 'sent': 2, 'reconnects': 1}, session.stats)
+        session.close()
+
+    def test_new_connection_not_retried(self, mock_smtp):
+        """Test that a failure on a new connection is raised."""
+        instance = mock_smtp.return_value.__enter__.return_value
+        instance.send_message.side_effect = smtplib.SMTPServerDisconnected()
+
+        session = SMTPSession('test.sender@gmail.com', 'test1234')
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            session.send(self.msg)
+        self.assertEqual(1, mock_smtp.call_count)
+
+    def test_bad_login(self, mock_smtp):
+        """Test that an authentication error closes the connection."""
+        instance = mock_smtp.return_value.__enter__.return_value
+        instance.login.side_effect = smtplib.SMTPAuthenticationError(535, b'5.7.8')
+
+        session = SMTPSession('test.sender@gmail.com', 'bad')
+        with self.assertRaises(smtplib.SMTPAuthenticationError):
+            session.send(self.msg)
+        self.assertEqual(1, mock_smtp.return_value.__exit__.call_count)
+        self.assertFalse(instance.send_message.called)
+
+    def test_timeout(self, mock_smtp):
+        """Test that the connection gives up on a server which stops responding."""
+        with SMTPSession('test.sender@gmail.com', 'test1234', timeout=5.0) as session:
+            session.send(self.msg)
+        mock_smtp.assert_called_once_with(SMTP_HOST, SMTP_PORT, timeout=5.0)
+
+    def test_shared_session(self, mock_smtp):
+        """Test that the same process-wide session is returned for the same settings."""
+        session = get_smtp_session('test.sender@gmail.com', 'test1234', 60)
+        self.assertIs(session, get_smtp_session('test.sender@gmail.com', 'test1234', 60))
+        self.assertIsNot(session, get_smtp_session('test.sender@gmail.com', 'test1234', 30))
@@ -0,0 +1,425 @@
+import json
+import os
+import sqlite3
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+from jobnotify.exceptions import DatabaseCfgError
+from jobnotify.posting import Posting
+from jobnotify.storage import (
+    Database,
+    JSONLStorage,
+    JSONStorage,
+    open_storage,
+    reshard,
+    search_matches_path,
+    SearchMatches,
+    ShardedStorage,
+    SQLiteStorage,
+    tombstones_path,
+    Tombstones,
+)
+
+
+def make_posting(i, company='Acme', date_created='Mon, 02 Oct 2017 10:00:00 GMT'):
+    return Posting(
+        jobtitle=f'Job {i}',
+        company=company,
+        date_created=date_created,
+        location='Dublin',
+        url=f'http://ie.indeed.com/viewjob?jk={i:016x}',
+        lat=53.35,
+        lon=-6.26,
+        desc='A job',
+    )
+
+
+class StorageTestCase(unittest.TestCase):
+    """Test case for the database storage backends."""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.posts = {f'{i:016x}': make_posting(i) for i in range(3)}
+
+    def test_round_trip(self):
+        """Test that every backend returns the postings it stored."""
+        for backend in ('json', 'jsonl', 'sharded', 'sqlite'):
+            with self.subTest(backend=backend):
+                with open_storage(self.tmpdir.name, backend, backend) as storage:
+                    self.assertEqual({}, storage.load())
+                    storage.add(self.posts)
+
+                with open_storage(self.tmpdir.name, backend, backend) as storage:
+                    db = storage.load()
+                    self.assertEqual(self.posts, db)
+                    self.assertIsInstance(db['0000000000000000'], Posting)
+                    self.assertEqual(set(self.posts), storage.keys())
+
+    def test_sqlite_adds_rows(self):
+        """Test that adding postings inserts rows for new postings only."""
+        path = os.path.join(self.tmpdir.name, 'db.sqlite3')
+        with SQLiteStorage(path) as storage:
+            storage.add(self.posts)
+            storage.add({'ffffffffffffffff': make_posting(255, company='Other')})
+
+        conn = sqlite3.connect(path)
+        rows = conn.execute('SELECT company, COUNT(*) FROM postings GROUP BY company').fetchall()
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        created, = conn.execute('SELECT DISTINCT created FROM postings').fetchone()
+        conn.close()
+
+        self.assertEqual([('Acme', 3), ('Other', 1)], rows)
+        self.assertLessEqual({'postings_created', 'postings_company'}, indexes)
+        self.assertEqual(1506938400.0, created)
+
+    def test_migrate_from_json(self):
+        """Test that an existing JSON database is migrated on first use."""
+        JSONStorage(os.path.join(self.tmpdir.name, 'scientist_dublin.json')).add(self.posts)
+
+        with open_storage(self.tmpdir.name, 'scientist_dublin', 'sqlite') as storage:
+            self.assertEqual(os.path.join(self.tmpdir.name, 'scientist_dublin.sqlite3'), storage.path)
+            self.assertEqual(self.posts, storage.load())
+
+    def test_failed_migration(self):
+        """Test that a failed migration does not leave a partial database behind."""
+        with open(os.path.join(self.tmpdir.name, 'scientist_dublin.json'), 'w') as f:
+            json.dump({'abc': {'jobtitle': 'Missing fields'}}, f)
+
+        with self.assertRaises(KeyError):
+            open_storage(self.tmpdir.name, 'scientist_dublin', 'sqlite')
+
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir.name, 'scientist_dublin.sqlite3')))
+
+    def test_jsonl_appends(self):
+        """Test that adding postings appends a line per new posting."""
+        path = os.path.join(self.tmpdir.name, 'db.jsonl')
+        storage = JSONLStorage(path)
+        storage.add(self.posts)
+        storage.add({'ffffffffffffffff': make_posting(255)})
+
+        with open(path) as f:
+            lines = f.readlines()
+        self.assertEqual(4, len(lines))
+        self.assertEqual('ffffffffffffffff', json.loads(lines[-1])['jobkey'])
+
+    def test_jsonl_last_line_wins(self):
+        """Test that a posting stored twice is loaded once, with its latest value."""
+        storage = JSONLStorage(os.path.join(self.tmpdir.name, 'db.jsonl'))
+        storage.add(self.posts)
+        storage.add({'0000000000000000': make_posting(0, company='Other')})
+
+        db = storage.load()
+        self.assertEqual(3, len(db))
+        self.assertEqual('Other', db['0000000000000000']['company'])
+        self.assertEqual(1, storage.stale)
+
+    def test_jsonl_torn_line(self):
+        """Test that a line cut short by a crash is skipped, and not continued."""
+        path = os.path.join(self.tmpdir.name, 'db.jsonl')
+        storage = JSONLStorage(path)
+        storage.add(self.posts)
+        with open(path, 'a') as f:
+            f.write('{"jobkey": "torn", "jobti')
+
+        storage.add({'ffffffffffffffff': make_posting(255)})
+
+        self.assertEqual(set(self.posts) | {'ffffffffffffffff'}, storage.keys())
+        self.assertEqual(1, storage.stale)
+
+    def test_jsonl_compaction(self):
+        """Test that the log is compacted once enough lines are stale."""
+        path = os.path.join(self.tmpdir.name, 'db.jsonl')
+        storage = JSONLStorage(path, compact_threshold=2)
+        storage.add(self.posts)
+        storage.load()
+        storage.add(self.posts)
+        storage.load()
+        self.assertEqual(3, storage.stale)
+
+        # the log is compacted once the stale lines have been counted
+        storage.add({'ffffffffffffffff': make_posting(255)})
+        storage.close()
+
+        with open(path) as f:
+            self.assertEqual(4, len(f.readlines()))
+        self.assertEqual(4, len(storage.load()))
+        self.assertEqual(0, storage.stale)
+
+    def test_sharded_rewrites_affected_shards(self):
+        """Test that adding postings only rewrites the shards they belong to."""
+        path = os.path.join(self.tmpdir.name, 'db.shards')
+        posts = {f'{i:016x}': make_posting(i) for i in range(64)}
+        storage = ShardedStorage(path, shards=8)
+        storage.add(posts)
+        self.assertEqual(9, len(os.listdir(path)))
+
+        new = {'ffffffffffffffff': make_posting(255)}
+        before = {f: os.stat(os.path.join(path, f)).st_mtime_ns for f in os.listdir(path)}
+        with patch('os.replace', wraps=os.replace) as mock_replace:
+            storage.add(new)
+
+        written = {os.path.basename(call[0][1]) for call in mock_replace.call_args_list}
+        shard = os.path.basename(storage.shard_path(storage.shard('ffffffffffffffff')))
+        self.assertEqual({shard, 'manifest.json'}, written)
+        self.assertEqual(set(before), set(os.listdir(path)))
+
+        self.assertEqual({**posts, **new}, ShardedStorage(path).load())
+
+    def test_sharded_manifest_layout_wins(self):
+        """Test that an existing database keeps the layout in its manifest."""
+        path = os.path.join(self.tmpdir.name, 'db.shards')
+        ShardedStorage(path, shards=4).add(self.posts)
+        self.assertEqual(4, ShardedStorage(path, shards=16).shards)
+
+    def test_reshard(self):
+        """Test that resharding changes the layout but keeps the postings."""
+        path = os.path.join(self.tmpdir.name, 'db.shards')
+        posts = {f'{i:016x}': make_posting(i) for i in range(64)}
+        ShardedStorage(path, shards=4).add(posts)
+
+        self.assertEqual(64, reshard(path, 8, serializer='binary'))
+
+        storage = ShardedStorage(path)
+        self.assertEqual((8, 'binary'), (storage.shards, storage.serializer_name))
+        self.assertEqual(posts, storage.load())
+        self.assertFalse(os.path.exists(f'{path}.tmp'))
+        self.assertFalse(os.path.exists(f'{path}.old'))
+
+    def test_unknown_backend(self):
+        """Test that we raise for an unknown backend."""
+        with self.assertRaises(DatabaseCfgError):
+            open_storage(self.tmpdir.name, 'scientist_dublin', 'csv')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """Test case for the lazily loaded database view."""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.posts = {f'{i:016x}': make_posting(i) for i in range(3)}
+
+    def test_lookups(self):
+        """Test membership and lookups against every backend."""
+        for backend in ('json', 'jsonl', 'sharded', 'sqlite'):
+            with self.subTest(backend=backend):
+                with open_storage(self.tmpdir.name, backend, backend) as storage:
+                    storage.add(self.posts)
+
+                with Database(open_storage(self.tmpdir.name, backend, backend)) as db:
+                    self.assertIn('0000000000000001', db)
+                    self.assertNotIn('ffffffffffffffff', db)
+                    self.assertEqual(self.posts['0000000000000001'], db['0000000000000001'])
+                    self.assertIsNone(db.get('ffffffffffffffff'))
+                    with self.assertRaises(KeyError):
+                        db['ffffffffffffffff']
+
+    def test_membership_does_not_load(self):
+        """Test that membership tests do not load the postings."""
+        # the index is kept up to date by adding postings once it is open
+        with open_storage(self.tmpdir.name, 'db') as storage:
+            storage.index()
+            storage.add(self.posts)
+
+        storage = open_storage(self.tmpdir.name, 'db')
+        with patch.object(storage, 'load') as mock_load:
+            db = Database(storage)
+            self.assertIn('0000000000000001', db)
+            mock_load.assert_not_called()
+        db.close()
+
+    def test_update_is_a_delta(self):
+        """Test that updating a sharded database only reads the shards written."""
+        path = os.path.join(self.tmpdir.name, 'db.shards')
+        with ShardedStorage(path, shards=8) as storage:
+            storage.add({f'{i:016x}': make_posting(i) for i in range(64)})
+
+        storage = ShardedStorage(path)
+        with Database(storage) as db:
+            db.update({'ffffffffffffffff': make_posting(255)})
+            self.assertEqual([storage.shard('ffffffffffffffff')], list(storage._cache))
+            self.assertIn('ffffffffffffffff', db)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+class SearchMatchesTestCase(unittest.TestCase):
+    """Test case for the record of searches matching postings in a shared database."""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'shared.matches.sqlite')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_add(self):
+        matches = SearchMatches(self.path)
+        self.assertEqual(2, matches.add('scientist_dublin', ['a', 'b']))
+        self.assertEqual(1, matches.add('data_scientist_dublin', ['b']))
+        self.assertEqual(0, matches.add('scientist_dublin', ['a']))
+        matches.save()
+        matches.close()
+
+        matches = SearchMatches(self.path)
+        self.assertEqual(['scientist_dublin', 'data_scientist_dublin'], matches['b'])
+        self.assertEqual(2, len(matches))
+        with self.assertRaises(KeyError):
+            matches['c']
+        matches.close()
+
+    def test_unsaved_changes_discarded(self):
+        matches = SearchMatches(self.path)
+        matches.add('scientist_dublin', ['a'])
+        matches.close()
+
+        matches = SearchMatches(self.path)
+        self.assertEqual(0, len(matches))
+        matches.close()
+
+    def test_import_json(self):
+        """Test that a record written by earlier versions is imported."""
+        legacy_path = os.path.join(self.tmpdir.name, 'shared.matches.json')
+        with open(legacy_path, 'w') as f:
+            json.dump({'searches': ['s1', 's2'], 'matches': {'a': [1, 0], 'b': [1]}}, f)
+
+        matches = SearchMatches(self.path)
+        self.assertEqual(['s2', 's1'], matches['a'])
+        self.assertEqual(['s2'], matches['b'])
+        self.assertFalse(os.path.exists(legacy_path))
+        matches.close()
+
+    def test_pruned_matches_removed(self):
+        """Test that pruning a shared database forgets the matches of pruned postings."""
+        path = os.path.join(self.tmpdir.name, 'shared.json')
+        old = make_posting(0, date_created='Sat, 02 Sep 2017 10:00:00 GMT')
+        matches = SearchMatches(search_matches_path(path))
+        matches.add('scientist_dublin', ['0000000000000000', '0000000000000001'])
+        matches.save()
+        matches.close()
+
+        with JSONStorage(path, retention_days=10) as storage:
+            with patch('time.time', return_value=1506938400.0):
+                storage.add({'0000000000000000': old, '0000000000000001': make_posting(1)})
+
+        matches = SearchMatches(search_matches_path(path))
+        self.assertEqual(['scientist_dublin'], matches['0000000000000001'])
+        with self.assertRaises(KeyError):
+            matches['0000000000000000']
+        matches.close()
+
+
+class RetentionTestCase(unittest.TestCase):
+    """Test case for pruning old postings."""
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        # 2 Oct 2017 10:00 UTC
+        self.now = 1506938400.0
+        self.old = {
+            f'{i:016x}': make_posting(i, date_created='Sat, 02 Sep 2017 10:00:00 GMT')
+            for i in range(3)
+        }
+        self.new = {f'{i:016x}': make_posting(i) for i in range(3, 5)}
+
+    def test_prune(self):
+        """Test that every backend removes postings older than the retention period."""
+        for cls in (JSONStorage, JSONLStorage, ShardedStorage, SQLiteStorage):
+            with self.subTest(backend=cls.__name__):
+                path = os.path.join(self.tmpdir.name, f'{cls.__name__}{cls.extension}')
+                with cls(path, retention_days=10, tombstone_days=60) as storage:
+                    with patch('time.time', return_value=self.now):
+                        storage.add(self.old)
+                        storage.add(self.new)
+
+                with cls(path) as storage:
+                    self.assertEqual(self.new, storage.load())
+                    # pruned jobkeys are still seen
+                    self.assertEqual(set(self.old) | set(self.new), storage.index().keys())
+
+    def test_add_reads_database_once(self):
+        """Test that pruning after adding reuses the database read by `add`."""
+        path = os.path.join(self.tmpdir.name, 'db.json')
+        JSONStorage(path)._add(self.old)
+
+        storage = JSONStorage(path, retention_days=10)
+        with patch.object(storage.serializer, 'load', wraps=storage.serializer.load) as load:
+            with patch('time.time', return_value=self.now):
+                storage.add(self.new)
+        storage.close()
+
+        self.assertEqual(1, load.call_count)
+        self.assertEqual(self.new, JSONStorage(path).load())
+
+    def test_prune_stats(self):
+        """Test that pruning reports what was removed."""
+        path = os.path.join(self.tmpdir.name, 'db.json')
+        storage = JSONStorage(path, retention_days=10)
+        storage._add({**self.old, **self.new})
+
+        stats = storage.prune(now=self.now)
+
+        self.assertEqual(3, stats['pruned'])
+        self.assertEqual(3, stats['tombstones'])
+        self.assertEqual(0, stats['expired_tombstones'])
+        self.assertGreater(stats['reclaimed_bytes'], 0)
+
+    def test_sharded_prune_per_shard(self):
+        """Test that adding to a sharded database only prunes the shards written."""
+        path = os.path.join(self.tmpdir.name, 'db.shards')
+        ShardedStorage(path, shards=4)._add(self.old)
+
+        storage = ShardedStorage(path, shards=4, retention_days=10)
+        old_shards = {storage.shard(k) for k in self.old}
+        new = {k: p for k, p in self.new.items() if storage.shard(k) not in old_shards}
+        self.assertTrue(new)
+        with patch.object(storage, '_load_shard', wraps=storage._load_shard) as load_shard:
+            with patch('time.time', return_value=self.now):
+                storage.add(new)
+        storage.close()
+
+        loaded = {c[0][0] for c in load_shard.call_args_list}
+        self.assertEqual({storage.shard(k) for k in new}, loaded)
+        # the old postings are in other shards, so are kept until pruned
+        self.assertEqual({**self.old, **new}, ShardedStorage(path).load())
+
+        storage = ShardedStorage(path, retention_days=10)
+        stats = storage.prune(now=self.now)
+        storage.close()
+        self.assertEqual(3, stats['pruned'])
+        self.assertGreater(stats['reclaimed_bytes'], 0)
+        self.assertEqual(new, ShardedStorage(path).load())
+
+    def test_tombstones_expire(self):
+        """Test that tombstones are dropped once they expire."""
+        path = os.path.join(self.tmpdir.name, 'db.json')
+        storage = JSONStorage(path, retention_days=10, tombstone_days=60)
+        storage._add(self.old)
+        storage.prune(now=self.now)
+        self.assertIn('0000000000000000', storage.index())
+
+        stats = storage.prune(now=self.now + 60 * 86400)
+        self.assertEqual(3, stats['expired_tombstones'])
+        self.assertNotIn('0000000000000000', storage.index())
+        with open(tombstones_path(path)) as f:
+            self.assertEqual({}, json.load(f))
+        storage.close()
+
+    def test_tombstones_failed_save(self):
+        """Test that a failed save leaves the previous tombstones intact."""
+        tombstones = Tombstones(os.path.join(self.tmpdir.name, 'db.tombstones.json'))
+        tombstones.add({'0000000000000000': self.now})
+        tombstones.save()
+
+        tombstones.add({'0000000000000001': object()})
+        with self.assertRaises(TypeError):
+            tombstones.save()
+        tombstones = Tombstones(tombstones.path)
+        self.assertEqual({'0000000000000000': self.now}, tombstones.expires)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
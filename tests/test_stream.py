@@ -0,0 +1,102 @@
+import io
+import json
+import os
+import unittest
+
+from .context import TEST_DB_DIR
+from jobnotify.stream import iter_json_object
+
+
+class ChunkedReader(io.BytesIO):
+    """Binary stream which returns at most `size` bytes per read."""
+    def __init__(self, data, size):
+        super().__init__(data)
+        self.size = size
+        self.reads = 0
+
+    def read(self, n=-1):
+        self.reads += 1
+        return super().read(min(n, self.size))
+
+
+class StreamingDecodeTestCase(unittest.TestCase):
+    """Test case for incrementally decoding API responses."""
+    @classmethod
+    def setUpClass(cls):
+        with open(os.path.join(TEST_DB_DIR, '.rawresponsefull.json'), 'rb') as f:
+            cls.raw = f.read()
+        cls.expected = json.loads(cls.raw)
+
+    def decode(self, fp, chunk_size):
+        response = {'results': []}
+        for key, value in iter_json_object(fp, 'results', chunk_size=chunk_size):
+            if key == 'results':
+                response['results'].append(value)
+            else:
+                response[key] = value
+        return response
+
+    def test_decode_all_chunk_sizes(self):
+        """Test that we decode the same response whatever the chunk size."""
+        for chunk_size in (1, 2, 3, 7, 100, 4096, len(self.raw)):
+            with self.subTest(chunk_size=chunk_size):
+                fp = ChunkedReader(self.raw, chunk_size)
+                self.assertEqual(self.expected, self.decode(fp, chunk_size))
+
+    def test_multibyte_character_split(self):
+        """Test that a UTF-8 sequence split between chunks is decoded."""
+        raw = json.dumps({'results': [{'snippet': 'Ireland’s'}]}, ensure_ascii=False)
+        fp = ChunkedReader(raw.encode('utf-8'), 1)
+        self.assertEqual(
+            [('results', {'snippet': 'Ireland’s'})],
+            list(iter_json_object(fp, 'results', chunk_size=1)),
+        )
+
+    def test_split_at_every_offset(self):
+        """Test that numbers are decoded wherever the data is split."""
+        raw = b'{"results":[{"x":"e"}], "n": 1.5e10, "m": -2.25E-3, "k": 10}'
+        expected = [('results', {'x': 'e'}), ('n', 1.5e10), ('m', -2.25e-3), ('k', 10)]
+
+        for offset in range(1, len(raw)):
+            with self.subTest(offset=offset):
+                fp = io.BytesIO(raw)
+                read = fp.read
+                # the first read ends at `offset`, the second reads the rest
+                fp.read = lambda n=-1: read(offset if fp.tell() == 0 else n)
+                self.assertEqual(expected, list(iter_json_object(fp, 'results')))
+
+        for chunk_size in (1, 2, 3):
+            with self.subTest(chunk_size=chunk_size):
+                fp = ChunkedReader(raw, chunk_size)
+                self.assertEqual(expected, list(iter_json_object(fp, 'results', chunk_size)))
+
+    def test_number_split(self):
+        """Test that a number split between chunks is not truncated."""
+        fp = ChunkedReader(b'{"totalResults": 12345, "results": []}', 2)
+        self.assertEqual(
+            [('totalResults', 12345)],
+            list(iter_json_object(fp, 'results', chunk_size=2)),
+        )
+
+    def test_results_yielded_before_end(self):
+        """Test that results are yielded before the whole body is read."""
+        fp = ChunkedReader(self.raw, 512)
+        it = iter_json_object(fp, 'results', chunk_size=512)
+        next(key for key, _ in it if key == 'results')
+        self.assertLess(fp.tell(), len(self.raw))
+
+    def test_stops_at_end_of_object(self):
+        """Test that we do not read beyond the end of the object."""
+        fp = ChunkedReader(b'{"end": 2}   ', 100)
+        self.assertEqual([('end', 2)], list(iter_json_object(fp, 'results')))
+        self.assertEqual(1, fp.reads)
+
+    def test_truncated_response(self):
+        """Test that we raise for a truncated response."""
+        fp = ChunkedReader(self.raw[:-2], 100)
+        with self.assertRaises(json.decoder.JSONDecodeError):
+            self.decode(fp, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
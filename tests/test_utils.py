@@ -10,13 +10,18 @@ import unittest
 from .context import jobnotify, SAMPLE_CFG_FILE_PATH, TEST_DB_DIR
 from jobnotify.utils import (
     EmailMatch,
+    get_fromage,
     get_sanitised_params,
+    get_searches,
     get_section_configs,
     initial_setup,
     load_cfg,
     load_json_db,
+    load_optional_cfg,
+    load_run_metadata,
     process_args,
     write_json_db,
+    write_run_metadata,
 )
 from jobnotify.exceptions import (
     BlankKeyError,
@@ -83,6 +88,21 @@ class ConfigFileTestCase(unittest.TestCase):
         with self.assertRaises(BlankKeyError):
             load_cfg(self.blank_key_filename, section='indeed', required=self.indeed_reqs)
 
+    def test_multiple_searches(self):
+        """Test that every query is searched in every location."""
+        c = ConfigParser()
+        c.read_string('[indeed]\nquery = scientist\n  data analyst\nlocation = dublin\n')
+        self.assertEqual(
+            [('scientist', 'dublin'), ('data analyst', 'dublin')],
+            get_searches(c['indeed']),
+        )
+
+    def test_missing_optional_section(self):
+        """Test that a missing optional section is returned empty."""
+        cfg = load_optional_cfg(self.sample_filename, 'database')
+        self.assertEqual([], list(cfg))
+        self.assertEqual('json', cfg.get('backend', fallback='json'))
+
     def test_load_multiple_configs_indeed(self):
         """Test that we load multiple configuration files correctly."""
         indeed_cfg, *_ = get_section_configs(self.sample_filename)
@@ -192,6 +212,28 @@ class DatabaseTestCase(unittest.TestCase):
         expected_sanitised_location = 'new_york_city'
         self.assertEqual(expected_sanitised_location, location)
 
+    def test_run_metadata_round_trip(self):
+        """Test that run metadata is written beside the database and reloaded."""
+        with TemporaryDirectory() as dirname:
+            db_path = os.path.join(dirname, 'scientist_dublin.json')
+            self.assertEqual({}, load_run_metadata(db_path))
+
+            write_run_metadata({'last_full_crawl': 1492600000.0}, db_path)
+            self.assertTrue(
+                os.path.isfile(os.path.join(dirname, 'scientist_dublin.meta.json'))
+            )
+            self.assertEqual({'last_full_crawl': 1492600000.0}, load_run_metadata(db_path))
+
+    def test_run_metadata_failed_write(self):
+        """Test that a failed write leaves the previous run metadata intact."""
+        with TemporaryDirectory() as dirname:
+            db_path = os.path.join(dirname, 'scientist_dublin.json')
+            write_run_metadata({'last_full_crawl': 1492600000.0}, db_path)
+
+            with self.assertRaises(TypeError):
+                write_run_metadata({'last_full_crawl': object()}, db_path)
+            self.assertEqual({'last_full_crawl': 1492600000.0}, load_run_metadata(db_path))
+
     def test_database_write(self):
         """Test that we write a file to disk without issue."""
         write_json_db(self.json_db, self.sample_write_db)
@@ -202,6 +244,29 @@ class DatabaseTestCase(unittest.TestCase):
         os.remove(cls.sample_write_db)
 
 
+class FromageTestCase(unittest.TestCase):
+    """Test case for computing the search window from the last run."""
+    def setUp(self):
+        self.now = 1492600000.0
+
+    def test_no_previous_run(self):
+        """Test that we search the whole window without a previous run."""
+        self.assertEqual(10, get_fromage(None, self.now, max_fromage=10))
+
+    def test_recent_run(self):
+        """Test that a run ten minutes ago only searches back the margin."""
+        self.assertEqual(2, get_fromage(self.now - 600, self.now, margin=1))
+
+    def test_capped_at_max_fromage(self):
+        """Test that an old run is capped at the maximum window."""
+        last_success = self.now - 30 * 86400
+        self.assertEqual(10, get_fromage(last_success, self.now, max_fromage=10))
+
+    def test_at_least_one_day(self):
+        """Test that we always search back at least one day."""
+        self.assertEqual(1, get_fromage(self.now, self.now, margin=0))
+
+
 class EmailMatchTestCase(unittest.TestCase):
     """Test case for the EmailMatch helper class"""
     def test_message_does_not_match(self):
@@ -329,6 +394,23 @@ class ProcessArgsTestCase(unittest.TestCase):
         args = process_args()
         self.assertFalse(args.verbose)
 
+    def test_process_no_cache_flag(self):
+        args = process_args(['--no-cache'])
+        self.assertTrue(args.no_cache)
+
+    def test_process_reshard_flag(self):
+        args = process_args(['--reshard', '32'])
+        self.assertEqual(32, args.reshard)
+
+    def test_process_deliver_flag(self):
+        args = process_args(['--deliver'])
+        self.assertTrue(args.deliver)
+
+    def test_process_drain_flag(self):
+        args = process_args(['--deliver', '--drain'])
+        self.assertTrue(args.deliver)
+        self.assertTrue(args.drain)
+
 
 if __name__ == '__main__':
     unittest.main()